@@ -0,0 +1,99 @@
+import bisect
+import collections
+
+
+class AdaptiveSearch(object):
+
+    """WRTM Adaptive Search
+
+       Picks the offsets to test in a range from the outcomes of the tests done so
+       far, to map where the range faults without testing all of it. The search
+       starts with a coarse grid of 'coarse' evenly spread offsets (always including
+       both ends); every pair of neighbouring tested offsets with different outcomes
+       marks a boundary, which is then bisected until the tested offsets on its two
+       sides are at most 'resolution' bytes apart (or adjacent in the range). The
+       widest open boundary is bisected first.
+
+       Offsets between two tested offsets with the same outcome are assumed to share
+       it, so regions narrower than the grid spacing can be missed - 'coarse' trades
+       tests for that risk. Each boundary costs about log2(spacing) tests. The search
+       also stops after 'budget' tests, if given.
+    """
+
+    def __init__(self, offsets, coarse=16, resolution=0, budget=0):
+        if isinstance(offsets, range):
+            if offsets.step < 0:
+                offsets = offsets[::-1]
+        else:
+            offsets = tuple(sorted(set(offsets)))
+        self.offsets = offsets
+        self.resolution = resolution
+        self.budget = budget
+
+        # tested offset indices, kept sorted, and their outcomes
+        self.tested = []
+        self.outcomes = {}
+
+        count = len(offsets)
+        coarse = max(min(coarse, count), 2)
+        grid = sorted(set((count - 1) * k // (coarse - 1) for k in range(0, coarse)))
+        self.grid = collections.deque(grid)
+
+    def __len__(self):
+        return len(self.tested)
+
+    def next(self):
+        """Returns the index (into offsets) of the next offset to test, or None once
+           the search is over."""
+        if self.budget > 0 and len(self.tested) >= self.budget:
+            return None
+
+        while len(self.grid) > 0:
+            index = self.grid.popleft()
+            if index not in self.outcomes:
+                return index
+
+        widest = None
+        for left, right in self._boundaries():
+            if right - left > 1 and self.offsets[right] - self.offsets[left] > self.resolution:
+                if widest is None or right - left > widest[1] - widest[0]:
+                    widest = (left, right)
+
+        if widest is None:
+            return None
+        return (widest[0] + widest[1]) // 2
+
+    def record(self, index, fault):
+        if index not in self.outcomes:
+            bisect.insort(self.tested, index)
+        self.outcomes[index] = bool(fault)
+
+    def faultMap(self):
+        """Returns the regions of the range with a common outcome, as dicts holding the
+           outcome ('fault'), the first and last offset tested in the region ('first',
+           'last'), the number of tests in it and whether the boundary towards the next
+           region was narrowed down to neighbouring offsets ('exact')."""
+        regions = []
+        for index in self.tested:
+            fault = self.outcomes[index]
+            if len(regions) > 0 and regions[-1]['fault'] == fault:
+                regions[-1]['last'] = self.offsets[index]
+                regions[-1]['tests'] += 1
+                lastIndex = index
+                continue
+
+            if len(regions) > 0:
+                regions[-1]['exact'] = index - lastIndex == 1
+            regions.append({'fault': fault,
+                            'first': self.offsets[index],
+                            'last': self.offsets[index],
+                            'tests': 1,
+                            'exact': True})
+            lastIndex = index
+
+        return regions
+
+    def _boundaries(self):
+        for left, right in zip(self.tested, self.tested[1:]):
+            if self.outcomes[left] != self.outcomes[right]:
+                yield left, right
@@ -0,0 +1,120 @@
+import asyncio
+import concurrent.futures
+import hashlib
+import json
+import os
+import time
+
+
+class CampaignJournal(object):
+
+    """WRTM Campaign Journal
+
+       Append-only record of test progress, kept in a file named after the hash of the
+       test description, so a campaign can be resumed after the tester host (or the
+       tester itself) dies. Every test is journaled as 'started' when it begins and as
+       'completed' once its result is recorded; each record is flushed and synced to
+       disk before the test goes on. The writes are done by a thread of the journal's
+       own, in order, and awaited, so a sync holds up its runner but never the event
+       loop the other routers run on.
+
+       A fresh campaign appends a 'begin' record and only records after the last one
+       are taken into account, so the journal never has to be truncated. When resuming,
+       a plan section continues with the first of its tests (by ordinal, counted across
+       loops) that was not completed; a test interrupted half-way is run again.
+
+       Tests skipped on known outcomes are journaled as 'skipped', which counts as
+       completed, so they do not hold the resume point back. These records are not
+       synced on their own: losing one only means deciding the skip again.
+    """
+
+    STARTED = 'started'
+    COMPLETED = 'completed'
+    SKIPPED = 'skipped'
+    BEGIN = 'begin'
+
+    def __init__(self, planPath, directory='.'):
+        with open(planPath, "rb") as planFile:
+            self.planHash = hashlib.sha256(planFile.read()).hexdigest()
+        self.path = os.path.join(directory, "wrtm-journal-" + self.planHash[:16] + ".jsonl")
+        self.journalFile = None
+        self.executor = None
+        self.completed = {}
+
+    def open(self, resume=False):
+        if resume:
+            self._load()
+        else:
+            self.completed = {}
+
+        self.journalFile = open(self.path, "ab")
+        # a crash may have left a torn record behind, don't glue the next one to it
+        if self.journalFile.tell() > 0:
+            with open(self.path, "rb") as journalFile:
+                journalFile.seek(-1, os.SEEK_END)
+                if journalFile.read(1) != b'\n':
+                    self.journalFile.write(b'\n')
+
+        if not resume:
+            self._append({'state': CampaignJournal.BEGIN, 'hash': self.planHash})
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+
+    def close(self):
+        if self.executor is not None:
+            # records of cancelled runners may still be pending
+            self.executor.shutdown()
+            self.executor = None
+        if self.journalFile is not None:
+            self.journalFile.close()
+            self.journalFile = None
+
+    def resumePoint(self, section):
+        """Returns the ordinal of the first test of the section left to run."""
+        completed = self.completed.get(section, set())
+        ordinal = 1
+        while ordinal in completed:
+            ordinal += 1
+        return ordinal
+
+    async def started(self, section, ordinal):
+        await self._appendAsync({'state': CampaignJournal.STARTED, 'plan': section,
+                                 'test': ordinal})
+
+    async def completedTest(self, section, ordinal):
+        self.completed.setdefault(section, set()).add(ordinal)
+        await self._appendAsync({'state': CampaignJournal.COMPLETED, 'plan': section,
+                                 'test': ordinal})
+
+    async def skippedTest(self, section, ordinal):
+        self.completed.setdefault(section, set()).add(ordinal)
+        await self._appendAsync({'state': CampaignJournal.SKIPPED, 'plan': section,
+                                 'test': ordinal}, sync=False)
+
+    async def _appendAsync(self, record, sync=True):
+        await asyncio.get_event_loop().run_in_executor(self.executor, self._append, record,
+                                                       sync)
+
+    def _append(self, record, sync=True):
+        record['time'] = time.time()
+        self.journalFile.write(json.dumps(record).encode('utf-8') + b'\n')
+        self.journalFile.flush()
+        if sync:
+            os.fsync(self.journalFile.fileno())
+
+    def _load(self):
+        self.completed = {}
+        if not os.path.exists(self.path):
+            return
+
+        with open(self.path, "rb") as journalFile:
+            for line in journalFile:
+                try:
+                    record = json.loads(line.decode('utf-8'))
+                except ValueError:
+                    # torn write at the time of the crash
+                    continue
+
+                if record['state'] == CampaignJournal.BEGIN:
+                    self.completed = {}
+                elif record['state'] in (CampaignJournal.COMPLETED, CampaignJournal.SKIPPED):
+                    self.completed.setdefault(record['plan'], set()).add(record['test'])
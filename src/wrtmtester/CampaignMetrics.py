@@ -0,0 +1,184 @@
+import asyncio
+import bisect
+import os
+
+
+class _Histogram(object):
+    # observation counts per bucket (the last one is +Inf), not cumulative
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+
+
+class CampaignMetrics(object):
+
+    """WRTM Campaign Metrics
+
+       Counters and histograms of a running campaign, per router: tests issued and
+       finished (by outcome), init retries, power cycles, lost liveness probes,
+       console bytes read, wall time spent in each test state, and the ack latency,
+       ping round trip and ready wait distributions. They can be scraped in the
+       Prometheus text format from http://<address>:<port>/metrics and written to a
+       node-exporter textfile every 'interval' seconds (replaced atomically, so the
+       collector never reads half a file).
+
+       Updates take no lock: every series has a single writer - the event loop, or a
+       serial reader thread for its own console byte count, which is only read when
+       rendering (see register()) - and a histogram observation is a bisect and two
+       additions. Rendering happens on the event loop, so a scrape sees each series
+       either before or after an update.
+    """
+
+    METRICS = (
+        ('wrtm_tests_started_total', 'counter', "Tests issued to the router."),
+        ('wrtm_tests_total', 'counter', "Tests finished, by outcome."),
+        ('wrtm_retries_total', 'counter', "Test definitions resent after the ack timed out."),
+        ('wrtm_reboots_total', 'counter', "Power cycles of the router."),
+        ('wrtm_probes_lost_total', 'counter', "Liveness probes lost during tests."),
+        ('wrtm_serial_bytes_total', 'counter', "Bytes read from the serial console."),
+        ('wrtm_state_seconds_total', 'counter', "Wall time spent in each test state."),
+        ('wrtm_ack_latency_seconds', 'histogram', "Time from sending a test definition "
+                                                  + "or stop to its ack."),
+        ('wrtm_ping_rtt_seconds', 'histogram', "Round trip times of liveness probes."),
+        ('wrtm_ready_wait_seconds', 'histogram', "Time waited for the router to get ready "
+                                                 + "after a test."),
+    )
+
+    BUCKETS = {
+        'wrtm_ack_latency_seconds': (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25,
+                                     0.5, 1, 2.5, 5, 10),
+        'wrtm_ping_rtt_seconds': (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01,
+                                  0.025, 0.05, 0.1, 0.25, 0.5),
+        'wrtm_ready_wait_seconds': (0.1, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 90, 120),
+    }
+
+    CONTENT_TYPE = "text/plain; version=0.0.4"
+
+    def __init__(self):
+        # (name, labels) -> value or _Histogram; labels are tuples of (name, value)
+        self.series = {}
+        self.functions = {}
+
+        self.server = None
+        self.task = None
+        self.textfile = None
+
+    def inc(self, name, labels, amount=1):
+        key = (name, labels)
+        self.series[key] = self.series.get(key, 0) + amount
+
+    def observe(self, name, labels, value):
+        histogram = self.series.get((name, labels))
+        if histogram is None:
+            histogram = self.series[(name, labels)] = _Histogram(CampaignMetrics.BUCKETS[name])
+        histogram.observe(value)
+
+    def observeAll(self, name, labels, values):
+        for value in values:
+            self.observe(name, labels, value)
+
+    def register(self, name, labels, function):
+        """Has the value of a series read from function() whenever it is rendered."""
+        self.functions[(name, labels)] = function
+
+    def render(self):
+        values = dict(self.series)
+        for key, function in self.functions.items():
+            values[key] = function()
+
+        lines = []
+        for name, metricType, description in CampaignMetrics.METRICS:
+            keys = sorted(key for key in values if key[0] == name)
+            if len(keys) == 0:
+                continue
+            lines.append("# HELP " + name + " " + description)
+            lines.append("# TYPE " + name + " " + metricType)
+            for key in keys:
+                value = values[key]
+                if metricType != 'histogram':
+                    lines.append(name + _labels(key[1]) + " " + _number(value))
+                    continue
+
+                count = 0
+                for bound, bucketCount in zip(value.buckets + ('+Inf',), value.counts):
+                    count += bucketCount
+                    lines.append(name + "_bucket" + _labels(key[1] + (('le', _number(bound)),))
+                                 + " " + str(count))
+                lines.append(name + "_sum" + _labels(key[1]) + " " + _number(value.sum))
+                lines.append(name + "_count" + _labels(key[1]) + " " + str(count))
+        return "\n".join(lines) + "\n"
+
+    async def start(self, address='127.0.0.1', port=0, textfile=None, interval=15.0):
+        """Serves the metrics on address:port (unless port is 0) and writes them to
+           textfile every interval seconds (if given)."""
+        if port != 0:
+            self.server = await asyncio.start_server(self._serve, address, port)
+        if textfile is not None:
+            self.textfile = textfile
+            self.task = asyncio.get_event_loop().create_task(self._writeFunc(interval))
+
+    async def close(self):
+        if self.server is not None:
+            self.server.close()
+            await self.server.wait_closed()
+        if self.task is not None:
+            self.task.cancel()
+            await asyncio.gather(self.task, return_exceptions=True)
+            # the final state of the campaign
+            self._write()
+
+    async def _serve(self, reader, writer):
+        try:
+            request = await reader.readline()
+            while (await reader.readline()) not in (b'\r\n', b'\n', b''):
+                pass
+
+            words = request.split()
+            if len(words) >= 2 and words[0] == b'GET' and words[1].split(b'?')[0] == b'/metrics':
+                status, contentType, body = "200 OK", CampaignMetrics.CONTENT_TYPE, self.render()
+            else:
+                status, contentType, body = "404 Not Found", "text/plain", "Not found\n"
+
+            body = body.encode('utf-8')
+            writer.write(("HTTP/1.0 " + status + "\r\nContent-Type: " + contentType
+                          + "\r\nContent-Length: " + str(len(body)) + "\r\n\r\n")
+                         .encode('utf-8') + body)
+            await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def _writeFunc(self, interval):
+        while True:
+            self._write()
+            await asyncio.sleep(interval)
+
+    def _write(self):
+        try:
+            with open(self.textfile + ".tmp", 'w') as textFile:
+                textFile.write(self.render())
+            os.replace(self.textfile + ".tmp", self.textfile)
+        except OSError as e:
+            print("Writing the metrics to " + self.textfile + " failed (" + str(e) + ").")
+
+
+def _labels(labels):
+    if len(labels) == 0:
+        return ""
+    return "{" + ",".join(name + "=\"" + str(value).replace('\\', '\\\\').replace('"', '\\"')
+                          .replace('\n', '\\n') + "\""
+                          for name, value in labels) + "}"
+
+
+def _number(value):
+    if isinstance(value, str):
+        return value
+    if isinstance(value, int):
+        return str(value)
+    return repr(float(value))
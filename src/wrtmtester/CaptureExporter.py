@@ -0,0 +1,131 @@
+import asyncio
+import os
+import struct
+
+
+# pcapng blocks, little endian
+SECTION_HEADER = 0x0A0D0D0A
+INTERFACE_DESCRIPTION = 0x00000001
+ENHANCED_PACKET = 0x00000006
+BYTE_ORDER_MAGIC = 0x1A2B3C4D
+LINKTYPE_ETHERNET = 1
+
+OPTION_END = 0
+OPTION_IF_NAME = 2
+OPTION_IF_TSRESOL = 9
+
+
+def _block(blockType, body):
+    length = 12 + len(body) + (-len(body) % 4)
+    return struct.pack('<II', blockType, length) + body + b'\0' * (-len(body) % 4) \
+        + struct.pack('<I', length)
+
+
+def _option(code, value):
+    return struct.pack('<HH', code, len(value)) + value + b'\0' * (-len(value) % 4)
+
+
+def sectionHeader():
+    return _block(SECTION_HEADER, struct.pack('<IHHq', BYTE_ORDER_MAGIC, 1, 0, -1))
+
+
+def interfaceDescription(name):
+    # nanosecond timestamps, like the N2X hands them out
+    options = _option(OPTION_IF_NAME, name.encode('utf-8')) \
+              + _option(OPTION_IF_TSRESOL, b'\x09') + _option(OPTION_END, b'')
+    return _block(INTERFACE_DESCRIPTION,
+                  struct.pack('<HHI', LINKTYPE_ETHERNET, 0, 0) + options)
+
+
+def enhancedPacket(interfaceId, timestamp, frame):
+    return _block(ENHANCED_PACKET, struct.pack('<IIIII', interfaceId, timestamp >> 32,
+                                               timestamp & 0xFFFFFFFF, len(frame), len(frame))
+                  + frame)
+
+
+class CaptureExporter(object):
+
+    """WRTM Capture Exporter
+
+       Downloads the frames the N2X captured on its capture ports during a test into a
+       pcapng file of the test, one interface per port. The download runs in the
+       background, so that it overlaps with the router getting ready again (or
+       rebooting) instead of adding to the campaign's wall time; it fetches at most
+       'chunkFrames' frames per N2X call and writes them out right away, so neither
+       the responses nor the memory use grow with the size of the capture.
+
+       Like every other N2X call, the chunks go through the N2xExecutor, which keeps
+       them off the event loop; they are background calls, so they do not hold up
+       starting or stopping the load. The capture buffer is cleared when capturing
+       starts again, so the next test's load streams have to wait for drain().
+
+       The frames are counted (count()) once the load is stopped, in calls of their
+       own. The counting and download calls have only been exercised against the
+       N2xEmulator so far; if the N2X rejects the count, exporting is turned off for
+       the rest of the campaign and the tests go on without captures.
+    """
+
+    CHUNK_FRAMES = 256
+
+    def __init__(self, n2x, executor, directory='.', chunkFrames=CHUNK_FRAMES):
+        self.n2x = n2x
+        self.executor = executor
+        self.directory = directory
+        self.chunkFrames = chunkFrames
+        self.exports = set()
+        self.exported = 0
+        self.enabled = True
+
+    async def count(self):
+        """Returns the number of frames captured on each capture port, or None if
+           exporting is off."""
+        if not self.enabled:
+            return None
+        try:
+            counting = self.executor.submit(self.n2x.capturedFrameCounts)
+            return await asyncio.wrap_future(counting)
+        except RuntimeError as e:
+            print("Counting the captured frames failed (" + str(e)
+                  + "), not exporting captures.")
+            self.enabled = False
+            return None
+
+    def export(self, fileName, counts):
+        """Starts downloading counts[port] frames of every capture port into fileName
+           (in the capture directory); returns the path of the file."""
+        path = os.path.join(self.directory, fileName)
+        export = asyncio.get_event_loop().create_task(self._export(path, counts))
+        self.exports.add(export)
+        export.add_done_callback(self.exports.discard)
+        return path
+
+    async def drain(self):
+        if len(self.exports) == 0:
+            return
+        results = await asyncio.gather(*self.exports, return_exceptions=True)
+        for result in results:
+            if isinstance(result, Exception):
+                print("Capture export failed: " + str(result))
+
+    async def close(self):
+        await self.drain()
+
+    async def _export(self, path, counts):
+        with open(path + ".part", 'wb') as outFile:
+            outFile.write(sectionHeader())
+            ports = sorted(counts)
+            for port in ports:
+                outFile.write(interfaceDescription("n2x-" + port))
+
+            for interfaceId, port in enumerate(ports):
+                for first in range(0, counts[port], self.chunkFrames):
+                    count = min(self.chunkFrames, counts[port] - first)
+                    await asyncio.wrap_future(self.executor.background(
+                        self._exportChunk, outFile, interfaceId, port, first, count))
+        os.replace(path + ".part", path)
+
+    def _exportChunk(self, outFile, interfaceId, port, first, count):
+        frames = self.n2x.capturedFrames(port, first, count)
+        outFile.write(b''.join(enhancedPacket(interfaceId, timestamp, frame)
+                               for timestamp, frame in frames))
+        self.exported += len(frames)
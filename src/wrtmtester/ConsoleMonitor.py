@@ -0,0 +1,127 @@
+import re
+import time
+
+
+class ConsoleEvent(object):
+
+    """WRTM Console Event
+
+       A single match of the console monitor: the kind of the event, the console line
+       that triggered it and the monotonic time it was seen at.
+    """
+
+    def __init__(self, kind, line, timestamp):
+        self.kind = kind
+        self.line = line
+        self.timestamp = timestamp
+
+    def __repr__(self):
+        return "ConsoleEvent(" + self.kind + ", " + repr(self.line) + ")"
+
+
+class ConsoleMonitor(object):
+
+    """WRTM Console Monitor
+
+       Streaming pattern matcher fed with the decoded serial console output. Text is
+       split into lines as it arrives and every complete line is matched against a
+       single combined regular expression, so the cost per line does not grow with
+       the number of patterns.
+
+       Matches are published to the subscribed callbacks as ConsoleEvents:
+
+           panic     - kernel panic or oops, the router is gone
+           watchdog  - the watchdog fired, the router is about to reset
+           boot      - bootloader banner, the router has (re)started
+           module    - a WRTM module got loaded
+           ready     - a module load following a boot banner; published in
+                       addition to the 'module' event
+
+       The patterns for each kind can be replaced by passing a dict of lists of
+       regular expressions.
+    """
+
+    EVENT_PANIC = 'panic'
+    EVENT_WATCHDOG = 'watchdog'
+    EVENT_BOOT = 'boot'
+    EVENT_MODULE = 'module'
+    EVENT_READY = 'ready'
+
+    FAULT_EVENTS = (EVENT_PANIC, EVENT_WATCHDOG)
+
+    DEFAULT_PATTERNS = {
+        EVENT_PANIC: [r'Kernel panic', r'Oops', r'Unable to handle kernel', r'BUG: '],
+        EVENT_WATCHDOG: [r'[Ww]atchdog (timeout|reset|expired)', r'NMI [Ww]atchdog'],
+        EVENT_BOOT: [r'CFE version', r'U-Boot \d'],
+        EVENT_MODULE: [r'[Ww][Rr][Tt][Mm]\w* .*(loaded|initiali[sz]ed)'],
+    }
+
+    MAX_LINE = 4096
+
+    def __init__(self, patterns=None):
+        self.patterns = dict(ConsoleMonitor.DEFAULT_PATTERNS)
+        if patterns is not None:
+            self.patterns.update(patterns)
+
+        self.subscribers = []
+        self.partial = ""
+        self.bootSeen = False
+        self.regex = None
+        self.groupKinds = {}
+        self._compile()
+
+    def setPatterns(self, patterns):
+        self.patterns = dict(ConsoleMonitor.DEFAULT_PATTERNS)
+        self.patterns.update(patterns)
+        self._compile()
+
+    def subscribe(self, callback):
+        self.subscribers.append(callback)
+
+    def reset(self):
+        self.partial = ""
+        self.bootSeen = False
+
+    def feed(self, text):
+        lines = (self.partial + text).split('\n')
+        self.partial = lines.pop()
+
+        # don't let a console spewing garbage without newlines grow the buffer
+        if len(self.partial) > ConsoleMonitor.MAX_LINE:
+            lines.append(self.partial)
+            self.partial = ""
+
+        for line in lines:
+            self._matchLine(line)
+
+    def _matchLine(self, line):
+        match = self.regex.search(line)
+        if match is None:
+            return
+
+        kind = self.groupKinds[match.lastgroup]
+        self._publish(ConsoleEvent(kind, line.rstrip('\r'), time.monotonic()))
+
+        if kind == ConsoleMonitor.EVENT_BOOT:
+            self.bootSeen = True
+        elif kind == ConsoleMonitor.EVENT_MODULE and self.bootSeen:
+            self.bootSeen = False
+            self._publish(ConsoleEvent(ConsoleMonitor.EVENT_READY, line.rstrip('\r'),
+                                       time.monotonic()))
+        elif kind in ConsoleMonitor.FAULT_EVENTS:
+            self.bootSeen = False
+
+    def _publish(self, event):
+        for callback in self.subscribers:
+            callback(event)
+
+    def _compile(self):
+        alternatives = []
+        self.groupKinds = {}
+        for kind, patterns in self.patterns.items():
+            for pattern in patterns:
+                group = "g" + str(len(alternatives))
+                self.groupKinds[group] = kind
+                alternatives.append("(?P<" + group + ">" + pattern + ")")
+
+        self.regex = re.compile("|".join(alternatives))
@@ -0,0 +1,258 @@
+import asyncio
+import collections
+import struct
+
+
+ACK = struct.Struct('<2xiL')
+ACK_SEQUENCE = struct.Struct('<I')
+
+ACK_OK = 0
+ACK_UNKNOWN_TEST = 1
+ACK_PENDING = 2
+
+
+class RtoEstimator(object):
+
+    """WRTM Retransmission Timeout Estimator
+
+       Smoothed round trip time and retransmission timeout as specified for TCP in
+       RFC 6298, fed with the ack round trip times of the control channel. MIN_RTO is
+       well below the RFC's second, the routers sit on the local network.
+    """
+
+    INITIAL_RTO = 1.0
+    MIN_RTO = 0.05
+    MAX_RTO = 2.0
+    GRANULARITY = 0.001
+    ALPHA = 1 / 8
+    BETA = 1 / 4
+    K = 4
+
+    def __init__(self):
+        self.srtt = None
+        self.rttvar = None
+        self.minRtt = None
+        self.rto = RtoEstimator.INITIAL_RTO
+
+    def sample(self, rtt):
+        if self.minRtt is None or rtt < self.minRtt:
+            self.minRtt = rtt
+
+        if self.srtt is None:
+            self.srtt = rtt
+            self.rttvar = rtt / 2
+        else:
+            self.rttvar = (1 - RtoEstimator.BETA) * self.rttvar \
+                          + RtoEstimator.BETA * abs(self.srtt - rtt)
+            self.srtt = (1 - RtoEstimator.ALPHA) * self.srtt + RtoEstimator.ALPHA * rtt
+
+        rto = self.srtt + max(RtoEstimator.GRANULARITY, RtoEstimator.K * self.rttvar)
+        self.rto = min(max(rto, RtoEstimator.MIN_RTO), RtoEstimator.MAX_RTO)
+
+
+class _Request(object):
+    # a test definition waiting for its ack
+    def __init__(self, sequence, packet, future):
+        self.sequence = sequence
+        self.packet = packet
+        self.future = future
+        self.sentAt = 0
+        self.timeout = 0
+        self.transmissions = 0
+        self.timer = None
+
+
+class RouterLink(object):
+
+    """WRTM Router Link
+
+       Per-router view of the shared control sockets. Acknowledgements and init
+       broadcasts coming from the router's address are handed here by the owning
+       ControlChannel; test definitions are sent out through the shared test endpoint.
+       initCount counts the init broadcasts ever received, flushed or not.
+
+       Test definitions are sent with request(), which makes the exchange reliable:
+       every definition gets a sequence number and is retransmitted until acked, with the timeout estimated from the observed ack
+       round trip times (RtoEstimator; retransmitted requests give no samples, as per
+       Karn's algorithm) and doubled with every retransmission of the request, up to
+       RtoEstimator.MAX_RTO. A pending ack from the router
+       stops the retransmissions and the request waits for the final one.
+
+       By default, acks are matched to the oldest outstanding request, whatever their
+       length; after a retransmitted request, as many acks as there were extra
+       transmissions are taken for late duplicates if they arrive sooner than half
+       the shortest round trip time after the latest transmission. A link created
+       with echoSequence (for a router known to echo the sequence number after the
+       ack fields) sends the number in the first header word of the definition,
+       matches acks exactly by it and drops duplicates; otherwise definitions go out
+       unchanged, the first word holding the test iteration.
+
+       Up to 'window' requests may be outstanding at once, so a few short test
+       definitions can be queued up back to back; that takes echoSequence. Nothing
+       opens such a window yet: a DutRunner sends one definition and waits for its
+       ack, and ControlChannel.register() is called with the default of one.
+    """
+
+    def __init__(self, channel, routerIp, window=1, echoSequence=False):
+        if window > 1 and not echoSequence:
+            raise ValueError("A window of requests needs a router echoing the sequence "
+                             + "numbers.")
+        self.channel = channel
+        self.routerIp = routerIp
+        self.initQueue = asyncio.Queue()
+        self.initCount = 0
+        self.echoSequence = echoSequence
+
+        self.rto = RtoEstimator()
+        self.window = asyncio.Semaphore(window)
+        self.sequence = 0
+        self.pending = collections.OrderedDict()
+        self.retransmissions = 0
+        self.duplicates = 0
+
+    def send(self, data):
+        self.channel.testTransport.sendto(data, (self.routerIp, self.channel.testPort))
+
+    async def request(self, packet, timeout):
+        """Sends a test definition and returns the final ack for it, or None if it was
+           not acked within timeout seconds."""
+        loop = asyncio.get_event_loop()
+        deadline = loop.time() + timeout
+
+        try:
+            await asyncio.wait_for(self.window.acquire(), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+        try:
+            self.sequence = (self.sequence + 1) & 0xFFFFFFFF
+            packet = bytearray(packet)
+            if self.echoSequence:
+                struct.pack_into('<I', packet, 0, self.sequence)
+            request = _Request(self.sequence, packet, loop.create_future())
+            self.pending[request.sequence] = request
+            self._transmit(request)
+
+            try:
+                return await asyncio.wait_for(asyncio.shield(request.future),
+                                              deadline - loop.time())
+            except asyncio.TimeoutError:
+                return None
+            finally:
+                self._complete(request)
+        finally:
+            self.window.release()
+
+    async def recvInit(self, timeout):
+        try:
+            return await asyncio.wait_for(self.initQueue.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+    def flushInit(self):
+        while not self.initQueue.empty():
+            self.initQueue.get_nowait()
+
+    def ackReceived(self, data):
+        if len(data) < ACK.size:
+            return
+        status = ACK.unpack_from(data)[1]
+        loop = asyncio.get_event_loop()
+
+        if self.echoSequence and len(data) >= ACK.size + ACK_SEQUENCE.size:
+            request = self.pending.get(ACK_SEQUENCE.unpack_from(data, ACK.size)[0])
+        else:
+            request = next(iter(self.pending.values()), None)
+            if request is None:
+                return
+            # too quick to answer the latest transmission, must be late for an earlier one
+            if self.duplicates > 0 and self.rto.minRtt is not None \
+                    and loop.time() - request.sentAt < self.rto.minRtt / 2:
+                self.duplicates -= 1
+                return
+
+        if request is None or request.future.done():
+            return
+
+        if request.timer is not None:
+            request.timer.cancel()
+            request.timer = None
+            if request.transmissions == 1:
+                self.rto.sample(loop.time() - request.sentAt)
+
+        if status != ACK_PENDING:
+            request.future.set_result(data)
+
+    def _transmit(self, request):
+        loop = asyncio.get_event_loop()
+        if request.transmissions == 0:
+            request.timeout = self.rto.rto
+        else:
+            self.retransmissions += 1
+            request.timeout = min(request.timeout * 2, RtoEstimator.MAX_RTO)
+        request.transmissions += 1
+        request.sentAt = loop.time()
+        self.send(request.packet)
+        request.timer = loop.call_later(request.timeout, self._transmit, request)
+
+    def _complete(self, request):
+        if request.timer is not None:
+            request.timer.cancel()
+            request.timer = None
+        self.pending.pop(request.sequence, None)
+        self.duplicates = request.transmissions - 1
+
+
+class _ControlProtocol(asyncio.DatagramProtocol):
+    def __init__(self, channel, init):
+        self.channel = channel
+        self.init = init
+
+    def datagram_received(self, data, addr):
+        link = self.channel.links.get(addr[0])
+        if link is None:
+            return
+
+        if self.init:
+            link.initCount += 1
+            link.initQueue.put_nowait(data)
+        else:
+            link.ackReceived(data)
+
+
+class ControlChannel(object):
+
+    """WRTM Control Channel
+
+       Owns the UDP endpoints bound to the test and init ports and demultiplexes the
+       datagrams arriving on them by their source address, so that a single tester
+       process can talk to several routers at once. Both endpoints are serviced by the
+       running asyncio event loop. They are bound to all addresses unless 'address'
+       says otherwise (routers emulated on the same host need their own addresses on
+       the same ports, see RouterEmulator).
+    """
+
+    def __init__(self, testPort, initPort, address='0.0.0.0'):
+        self.testPort = testPort
+        self.initPort = initPort
+        self.address = address
+        self.testTransport = None
+        self.initTransport = None
+        self.links = {}
+
+    async def open(self):
+        loop = asyncio.get_event_loop()
+        self.testTransport, _ = await loop.create_datagram_endpoint(
+            lambda: _ControlProtocol(self, False), local_addr=(self.address, self.testPort))
+        self.initTransport, _ = await loop.create_datagram_endpoint(
+            lambda: _ControlProtocol(self, True), local_addr=(self.address, self.initPort))
+
+    def register(self, routerIp, window=1, echoSequence=False):
+        link = RouterLink(self, routerIp, window, echoSequence)
+        self.links[routerIp] = link
+        return link
+
+    def close(self):
+        for transport in (self.testTransport, self.initTransport):
+            if transport is not None:
+                transport.close()
@@ -0,0 +1,780 @@
+import asyncio
+import json
+import struct
+import time
+
+from wrtmtester import SerialReader
+from wrtmtester.AdaptiveSearch import AdaptiveSearch
+from wrtmtester.CampaignMetrics import CampaignMetrics
+from wrtmtester.ConsoleMonitor import ConsoleMonitor
+from wrtmtester.ControlChannel import ACK, ACK_OK, ACK_UNKNOWN_TEST
+from wrtmtester.LivenessProbe import LivenessProbe
+from wrtmtester.LoadRamp import LoadRamp
+from wrtmtester.OutcomeCache import OutcomeCache
+from wrtmtester.PlanCompiler import PlanCompiler
+from wrtmtester.UpsClient import UpsError
+from wrtmtester.SerialLogWriter import parseSize
+from wrtmtester.WrtmN2xWrapper import parseRate
+from wrtmtester.ping import Pinger
+
+
+class WrtmTestError(RuntimeError):
+    pass
+
+
+class WrtmTimeoutError(RuntimeError):
+    pass
+
+
+class WrtmRebootError(RuntimeError):
+    pass
+
+
+class TestRun(object):
+
+    """WRTM Test Run
+
+       State of a single test going through the DutRunner state machine, along with
+       the start and stop definitions to send for it.
+    """
+
+    def __init__(self, test, state, startPacket, stopPacket, last=False, traffic=None):
+        self.test = test
+        self.state = state
+        self.startPacket = startPacket
+        self.stopPacket = stopPacket
+        self.last = last
+        self.traffic = traffic or {}
+        self.retCount = 0
+        self.rebootCount = 0
+        self.startTime = 0
+        self.stopTime = 0
+        self.running = False
+        self.probe = None
+        self.errCode = None
+        self.message = None
+        self.serialStart = None
+        self.initCount = 0
+        self.request = None
+        self.capturedFrames = 0
+        self.captureFile = None
+        self.load = None
+
+    def failed(self):
+        # anything short of a clean pass, including needing a power cycle
+        return self.errCode != DutRunner.ERR_OK or self.rebootCount > 0
+
+
+class DutRunner(object):
+
+    """WRTM DUT Runner
+
+       Executes the test plans assigned to a single router under test, over its own
+       serial reader and RouterLink, so that several runners share one tester process.
+       Every test goes through a state machine driven by the asyncio event loop:
+
+           ping -> send -> ack -> run -> stop -> ready -> done
+                           |                       |   ^
+                           +-> ping (retry)        +-> reboot
+
+       Plan sections are run as sweeps, searches or ramps ('mode'); their options are
+       listed in the README.
+    """
+
+    INIT_MAGIC = 0xFEE17357
+    INIT_TIMEOUT = 120
+    RCV_TIMEOUT = 10
+    PING_TIMEOUT = 1
+    PROBE_INTERVAL = 0.1
+    PROBE_TIMEOUT = 0.5
+    PROBE_LOSS_THRESHOLD = 3
+    RESUME_DELAY = 5
+
+    ERR_OK = 0
+    ERR_RCV_TIMEOUT = 4
+    ERR_DUT_FAULT = 5
+
+    STATE_PING = 'ping'
+    STATE_SEND = 'send'
+    STATE_ACK = 'ack'
+    STATE_RUN = 'run'
+    STATE_STOP = 'stop'
+    STATE_READY = 'ready'
+    STATE_REBOOT = 'reboot'
+    STATE_DONE = 'done'
+
+    MODE_SWEEP = 'sweep'
+    MODE_SEARCH = 'search'
+    MODE_RAMP = 'ramp'
+
+    SEARCH_COARSE = 16
+
+    RAMP_MINIMUM = '1'
+    RAMP_MAXIMUM = '1000'
+    RAMP_TOLERANCE = '1'
+
+    RERUN_PROBABILITY = 0.1
+
+    def __init__(self, testParser, routerIp, tty, outlet, link, results, journal, outcomes,
+                 ups, n2x=None, n2xExecutor=None, sampler=None, capture=None, metrics=None):
+        self.testParser = testParser
+        self.routerIp = routerIp
+        self.tty = tty
+        self.outlet = outlet
+        self.link = link
+        self.results = results
+        self.journal = journal
+        self.outcomes = outcomes
+        self.ups = ups
+        self.n2x = n2x
+        self.n2xExecutor = n2xExecutor
+        self.sampler = sampler
+        self.capture = capture
+        self.serial = SerialReader()
+        self.pinger = Pinger(routerIp)
+        self.console = ConsoleMonitor()
+        self.console.subscribe(self._onConsoleEvent)
+        self.serial.addListener(self.console.feed)
+
+        # a private registry unless the campaign exports one
+        self.metrics = metrics if metrics is not None else CampaignMetrics()
+        self.metricLabels = (('router', routerIp),)
+        self.metrics.register('wrtm_serial_bytes_total', self.metricLabels,
+                              lambda: self.serial.received)
+
+        self.tag = "[" + routerIp + "] "
+        self.testName = None
+        self.plan = None
+        self.build = None
+
+        self.loop = None
+        self.consoleFault = None
+        self.consoleReady = None
+        self.consoleBoot = None
+        self.faultLine = None
+
+        self.stateHandlers = {
+            DutRunner.STATE_PING: self._statePing,
+            DutRunner.STATE_SEND: self._stateSend,
+            DutRunner.STATE_ACK: self._stateAck,
+            DutRunner.STATE_RUN: self._stateRun,
+            DutRunner.STATE_STOP: self._stateStop,
+            DutRunner.STATE_READY: self._stateReady,
+            DutRunner.STATE_REBOOT: self._stateReboot,
+        }
+
+    async def run(self, testPlans, verboseLog):
+        self.loop = asyncio.get_event_loop()
+        self.consoleFault = asyncio.Event()
+        self.consoleReady = asyncio.Event()
+        self.consoleBoot = asyncio.Event()
+        self.pinger.open()
+        try:
+            for testPlan in testPlans:
+                print(self.tag + "Starting test suite '" + testPlan + "'"
+                      + " at " + time.strftime("%d-%m-%Y %H:%M:%S", time.gmtime()))
+                await self.executePlan(testPlan, verboseLog)
+                print(self.tag + "***\n")
+        finally:
+            self.pinger.close()
+
+    async def executePlan(self, testName, verboseLog):
+        self.testName = testName
+        self.build = self.testParser.getPlanOption(testName, 'build', '')
+        mode = self.testParser.getPlanOption(testName, 'mode', DutRunner.MODE_SWEEP)
+
+        if mode not in (DutRunner.MODE_SEARCH, DutRunner.MODE_RAMP):
+            self.plan = self.testParser.getCompiledPlan(testName)
+
+            start = self.journal.resumePoint(testName)
+            if start > len(self.plan):
+                print(self.tag + "Test suite already completed, skipping.")
+                return
+            if start > 1:
+                print(self.tag + "Resuming test suite at test #" + str(start) + ".")
+
+        timeStr = time.strftime("%d-%m-%Y_%H-%M-%S", time.gmtime())
+
+        # init console monitor and serial reader, serviced by the event loop
+        patterns = {}
+        for kind in (ConsoleMonitor.EVENT_PANIC, ConsoleMonitor.EVENT_WATCHDOG,
+                     ConsoleMonitor.EVENT_BOOT, ConsoleMonitor.EVENT_MODULE):
+            value = self.testParser.getPlanOption(testName, kind + 'Patterns')
+            if value is not None:
+                patterns[kind] = [x for x in value.split('\n') if x != '']
+        self.console.setPatterns(patterns)
+        self.console.reset()
+
+        self.serial.init(self.tty, "wrt54gl-log-" + testName + "-" + timeStr + ".log",
+                         asyncio.get_event_loop(),
+                         self.testParser.getPlanOption(testName, 'serialCompression', 'none'),
+                         parseSize(self.testParser.getPlanOption(testName, 'serialRotateSize', 0)),
+                         int(self.testParser.getPlanOption(testName, 'serialRotateTests', 0)))
+        self.serial.setVerbose(verboseLog)
+
+        try:
+            if mode == DutRunner.MODE_SEARCH:
+                completed = await self._executeSearch(timeStr)
+            elif mode == DutRunner.MODE_RAMP:
+                completed = await self._executeRamp(timeStr)
+            else:
+                completed = await self._executeSweep(start)
+
+            # testing done!
+            if completed:
+                print("\r" + self.tag + "Test suite done!")
+        finally:
+            # close the serial reader, also when testing failed
+            await self.serial.close()
+
+    async def _executeSweep(self, start):
+        policy = self.testParser.getPlanOption(self.testName, 'outcomePolicy',
+                                               OutcomeCache.POLICY_NONE)
+        if policy not in OutcomeCache.POLICIES:
+            raise RuntimeError("Unknown outcome policy '" + policy + "' in test plan '"
+                               + self.testName + "'.")
+        stableRuns = int(self.testParser.getPlanOption(self.testName, 'outcomeStableRuns', 1))
+        probability = float(self.testParser.getPlanOption(self.testName,
+                                                          'outcomeRerunProbability',
+                                                          DutRunner.RERUN_PROBABILITY))
+        planTraffic = self.testParser.getTrafficOptions(self.testName)
+        skipped = 0
+
+        # loop over tests:
+        for i in range(start - 1, len(self.plan)):
+            test = self.plan.test(i)
+            traffic = dict(planTraffic, **self.plan.traffic(i))
+            if not self.outcomes.shouldRun(test, self._outcomeBuild(traffic), policy,
+                                           stableRuns, probability):
+                await self.journal.skippedTest(self.testName, test[0])
+                skipped += 1
+                continue
+
+            testRun = TestRun(test, DutRunner.STATE_PING, self.plan.startPacket(i),
+                              self.plan.stopPacket(i), i == len(self.plan) - 1, traffic)
+            await self.journal.started(self.testName, test[0])
+
+            if not await self._executeTest(testRun):
+                return False
+            await self.journal.completedTest(self.testName, test[0])
+
+        if skipped > 0:
+            print("\r" + self.tag + str(skipped) + " tests skipped on known outcomes.")
+        return True
+
+    def _singleLine(self, kind):
+        sweep = self.testParser.getTestSweep(self.testName)
+        if len(sweep.lines) != 1 or sweep.lines[0].relative:
+            raise RuntimeError("A " + kind + " plan ('" + self.testName + "') takes exactly "
+                               + "one line with an immediate offset range.")
+        return sweep.lines[0]
+
+    async def _executeSearch(self, timeStr):
+        line = self._singleLine(DutRunner.MODE_SEARCH)
+
+        coarse = int(self.testParser.getPlanOption(self.testName, 'searchCoarse',
+                                                   DutRunner.SEARCH_COARSE))
+        resolution = int(self.testParser.getPlanOption(self.testName, 'searchResolution',
+                                                       '0'), 0)
+        budget = int(self.testParser.getPlanOption(self.testName, 'searchBudget', 0))
+        traffic = dict(self.testParser.getTrafficOptions(self.testName), **line.traffic)
+
+        faultMap = {'router': self.routerIp,
+                    'plan': self.testName,
+                    'testId': line.testId,
+                    'searches': []}
+        testIter = 0
+        completed = True
+        try:
+            for interface in line.interfaces:
+                for mask in line.masks:
+                    search = AdaptiveSearch(line.offsets, coarse, resolution, budget)
+                    faultMap['searches'].append({'interface': interface,
+                                                 'mask': mask,
+                                                 'offsets': len(search.offsets),
+                                                 'regions': []})
+
+                    index = search.next()
+                    while index is not None:
+                        testIter += 1
+                        test = [testIter, line.testId, interface, line.duration,
+                                search.offsets[index], mask]
+                        testRun = TestRun(test, DutRunner.STATE_PING,
+                                          PlanCompiler.packTest(test),
+                                          PlanCompiler.packTest(test, stop=True),
+                                          traffic=traffic)
+
+                        if not await self._executeTest(testRun):
+                            completed = False
+                            return False
+                        search.record(index, testRun.failed())
+                        faultMap['searches'][-1]['regions'] = search.faultMap()
+                        index = search.next()
+
+                    print("\r\t" + self.tag + "Search on " + interface + " (mask "
+                          + str(mask) + ") done after " + str(len(search)) + " tests.")
+        finally:
+            faultMap['completed'] = completed
+            with open("faultmap-" + self.testName + "-" + timeStr + ".json", "w") as mapFile:
+                json.dump(faultMap, mapFile, indent=2)
+
+        return completed
+
+    async def _executeRamp(self, timeStr):
+        line = self._singleLine(DutRunner.MODE_RAMP)
+        if self.n2x is None or self.sampler is None:
+            raise RuntimeError("A ramp plan ('" + self.testName + "') needs the N2X load "
+                               + "streams and their stats (useLoad).")
+
+        minimum = parseRate(self.testParser.getPlanOption(self.testName, 'rampMinimum',
+                                                          DutRunner.RAMP_MINIMUM))
+        maximum = parseRate(self.testParser.getPlanOption(self.testName, 'rampMaximum',
+                                                          DutRunner.RAMP_MAXIMUM))
+        tolerance = parseRate(self.testParser.getPlanOption(self.testName, 'rampTolerance',
+                                                            DutRunner.RAMP_TOLERANCE))
+        budget = int(self.testParser.getPlanOption(self.testName, 'rampBudget', 0))
+        errorThreshold = int(self.testParser.getPlanOption(self.testName,
+                                                           'rampErrorThreshold', 0))
+        lossThreshold = int(self.testParser.getPlanOption(self.testName,
+                                                          'rampLossThreshold', 0))
+        traffic = dict(self.testParser.getTrafficOptions(self.testName), **line.traffic)
+
+        report = {'router': self.routerIp,
+                  'plan': self.testName,
+                  'testId': line.testId,
+                  'minimum': minimum,
+                  'maximum': maximum,
+                  'tolerance': tolerance,
+                  'ramps': []}
+        testIter = 0
+        completed = True
+        try:
+            for interface in line.interfaces:
+                for offset in line.offsets:
+                    for mask in line.masks:
+                        ramp = LoadRamp(minimum, maximum, tolerance, budget)
+                        report['ramps'].append({'interface': interface,
+                                                'offset': offset,
+                                                'mask': mask})
+
+                        load = ramp.next()
+                        while load is not None:
+                            testIter += 1
+                            test = [testIter, line.testId, interface, line.duration,
+                                    offset, mask]
+                            testRun = TestRun(test, DutRunner.STATE_PING,
+                                              PlanCompiler.packTest(test),
+                                              PlanCompiler.packTest(test, stop=True),
+                                              traffic=dict(traffic, load=repr(load)))
+
+                            if not await self._executeTest(testRun):
+                                completed = False
+                                return False
+
+                            errors = sum(testRun.load[1]) if testRun.load is not None else None
+                            lost = testRun.probe.lost if testRun.probe is not None else None
+                            fault = testRun.failed() \
+                                or errors is not None and errors > errorThreshold \
+                                or lost is not None and lost > lossThreshold
+                            ramp.record(load, fault, errors=errors, probesLost=lost,
+                                        errorCode=testRun.errCode,
+                                        reboots=testRun.rebootCount)
+                            self._rampReport(report['ramps'][-1], ramp)
+                            load = ramp.next()
+
+                        onset = report['ramps'][-1]['onset']
+                        print("\r\t" + self.tag + "Ramp on " + interface + " (offset "
+                              + str(offset) + ", mask " + str(mask) + ") done after "
+                              + str(len(ramp)) + " tests, fault onset: "
+                              + (('%g' % onset) + " Mbit/s" if onset is not None else "none")
+                              + ".")
+        finally:
+            report['completed'] = completed
+            with open("ramp-" + self.testName + "-" + timeStr + ".json", "w") as rampFile:
+                json.dump(report, rampFile, indent=2)
+
+        return completed
+
+    def _rampReport(self, entry, ramp):
+        clean, onset = ramp.bracket()
+        entry['onset'] = onset
+        entry['clean'] = clean
+        entry['converged'] = ramp.converged()
+        entry['curve'] = ramp.curve()
+
+    async def _executeTest(self, testRun):
+        # runs a test through the state machine; False if testing has to be abandoned
+        self.metrics.inc('wrtm_tests_started_total', self.metricLabels)
+        try:
+            while testRun.state != DutRunner.STATE_DONE:
+                self._mark(testRun)
+                state = testRun.state
+                entered = self.loop.time()
+                try:
+                    testRun.state = await self.stateHandlers[state](testRun)
+                finally:
+                    self.metrics.inc('wrtm_state_seconds_total',
+                                     self.metricLabels + (('state', state),),
+                                     self.loop.time() - entered)
+            self._mark(testRun)
+            self._recordResult(testRun)
+
+        except WrtmTestError as te:
+            print("\r\t" + self.tag + str(te))
+            await self._stopLoadStreams(testRun)
+            self._recordResult(testRun)
+            return False
+
+        except WrtmTimeoutError as tme:
+            # if test timed out on second send-ack or test init, report failure and go next
+            print("\r\t" + self.tag + str(tme))
+            testRun.errCode = DutRunner.ERR_RCV_TIMEOUT
+            testRun.message = str(tme)
+            self._recordResult(testRun)
+
+        return True
+
+    async def _statePing(self, testRun):
+        self.consoleFault.clear()
+        self.consoleReady.clear()
+        self.consoleBoot.clear()
+        testRun.initCount = self.link.initCount
+
+        print("\r\t" + self.tag + "Executing test #" + str(testRun.test[0])
+              + " (" + time.strftime("%H:%M:%S", time.gmtime()) + ")")
+
+        delay = await self.pinger.ping(DutRunner.PING_TIMEOUT)
+        if delay is None:
+            raise WrtmTestError("Router under test did not respond to the "
+                                + "initial ping request. Abandoning ship.")
+
+        return DutRunner.STATE_SEND
+
+    async def _stateSend(self, testRun):
+        # start load streams before the test definition if the delay is negative
+        delay = self._getLoadDelay()
+        if delay < 0:
+            await self._startLoadStreams(testRun)
+            await asyncio.sleep(-delay)
+
+        testRun.request = self.loop.create_task(
+            self.link.request(testRun.startPacket, DutRunner.RCV_TIMEOUT))
+        return DutRunner.STATE_ACK
+
+    async def _stateAck(self, testRun):
+        try:
+            await self._recvAck(testRun.test, testRun.request)
+        except WrtmTimeoutError:
+            testRun.retCount += 1
+            self.metrics.inc('wrtm_retries_total', self.metricLabels)
+            if testRun.retCount == 3:
+                raise WrtmTimeoutError("Test #" + str(testRun.test[0]) + " skipped "
+                                       + "due to excessive number of init retries.")
+            print("\r\t" + self.tag + "Link with the router timed out. Retrying...")
+            return DutRunner.STATE_PING
+
+        testRun.running = True
+
+        # otherwise start them once the test is acknowledged
+        delay = self._getLoadDelay()
+        if delay >= 0:
+            await asyncio.sleep(delay)
+            await self._startLoadStreams(testRun)
+
+        testRun.startTime = time.time()
+        return DutRunner.STATE_RUN
+
+    async def _stateRun(self, testRun):
+        # keep probing for the duration of the test
+        # if the router stops responding: fail the test
+        testRun.probe = LivenessProbe(
+            self.pinger,
+            float(self.testParser.getPlanOption(self.testName, 'probeInterval',
+                                                DutRunner.PROBE_INTERVAL)),
+            float(self.testParser.getPlanOption(self.testName, 'probeTimeout',
+                                                DutRunner.PROBE_TIMEOUT)),
+            int(self.testParser.getPlanOption(self.testName, 'probeLossThreshold',
+                                              DutRunner.PROBE_LOSS_THRESHOLD)))
+        testRun.probe.start()
+
+        # whichever comes first: end of the test, lost router or a console fault
+        fault = self.loop.create_task(self.consoleFault.wait())
+        alive = self.loop.create_task(testRun.probe.wait(testRun.test[3]))
+        await asyncio.wait([fault, alive], return_when=asyncio.FIRST_COMPLETED)
+        fault.cancel()
+        alive.cancel()
+        await testRun.probe.stop()
+        self.metrics.observeAll('wrtm_ping_rtt_seconds', self.metricLabels, testRun.probe.rtts)
+        self.metrics.inc('wrtm_probes_lost_total', self.metricLabels, testRun.probe.lost)
+        # sample the load stats before the streams are stopped, within the test's time
+        if self.sampler is not None:
+            self.sampler.trigger()
+        testRun.stopTime = time.time()
+
+        if self.consoleFault.is_set():
+            await self._stopLoadStreams(testRun)
+            testRun.errCode = DutRunner.ERR_DUT_FAULT
+            testRun.message = "Console reported a fault during test #" \
+                              + str(testRun.test[0]) + ": " + self.faultLine
+            print("\r\t" + self.tag + testRun.message)
+            return self._scheduleReboot(testRun)
+
+        if not alive.result():
+            await self._stopLoadStreams(testRun)
+            testRun.errCode = DutRunner.ERR_RCV_TIMEOUT
+            testRun.message = "Router under test did not respond to ping requests " \
+                              + "during test #" + str(testRun.test[0])
+            print("\r\t" + self.tag + testRun.message)
+            return DutRunner.STATE_READY
+
+        return DutRunner.STATE_STOP
+
+    async def _stateStop(self, testRun):
+        testRun.running = False
+
+        # send stop-test, wait for ack; if no response, fail the test
+        await self._recvAck(testRun.test,
+                            self.link.request(testRun.stopPacket, DutRunner.RCV_TIMEOUT))
+
+        # post-test:
+        # stop load streams
+        await self._stopLoadStreams(testRun)
+
+        # test passed (no matter the result), the result is saved once the router is ready
+        testRun.errCode = DutRunner.ERR_OK
+
+        if self._stayedUp(testRun):
+            print("\r\t" + self.tag + "Test done (" + testRun.probe.formatSummary() + "). "
+                  + "Router stayed up, moving on.")
+            return DutRunner.STATE_DONE
+
+        print("\r\t" + self.tag + "Test done (" + testRun.probe.formatSummary() + "). "
+              + "Waiting for the router to announce its readiness.")
+        return DutRunner.STATE_READY
+
+    async def _stateReady(self, testRun):
+        # check if the router is ready (by waiting for broadcast on init socket or for
+        # the console to show it booted); if it won't get ready within 120 seconds or
+        # the console reports a fault, reboot through UPS
+        # in case it doesn't get ready after two reboots, cancel the test suite altogether
+        waitStart = self.loop.time()
+        ready = await self._waitForReady(DutRunner.INIT_TIMEOUT)
+        self.metrics.observe('wrtm_ready_wait_seconds', self.metricLabels,
+                             self.loop.time() - waitStart)
+        if ready:
+            if not testRun.last:
+                print("\r\t" + self.tag + "Resuming testing in "
+                      + str(DutRunner.RESUME_DELAY) + " seconds...")
+                await asyncio.sleep(DutRunner.RESUME_DELAY)
+
+            # flush init queue
+            self.link.flushInit()
+            return DutRunner.STATE_DONE
+
+        if self.consoleFault.is_set():
+            print("\r\t" + self.tag + "Console reported a fault (" + self.faultLine + "), "
+                  + "preparing for a power cycle.")
+        else:
+            print("\r\t" + self.tag + "Router did not initiate after " +
+                  str(DutRunner.INIT_TIMEOUT) + " seconds, " + "preparing for a power cycle.")
+        return self._scheduleReboot(testRun)
+
+    async def _stateReboot(self, testRun):
+        self.consoleFault.clear()
+        self.consoleReady.clear()
+        self.consoleBoot.clear()
+        self.console.reset()
+        self.metrics.inc('wrtm_reboots_total', self.metricLabels)
+        await self._powerCycle()
+        return DutRunner.STATE_READY
+
+    def _stayedUp(self, testRun):
+        if self.testParser.getPlanOption(self.testName, 'fastPath', 'yes') != 'yes':
+            return False
+        if not self.testParser.isContinuousTest(testRun.test[1]):
+            return False
+        return not self.consoleFault.is_set() and not self.consoleBoot.is_set() \
+            and self.link.initCount == testRun.initCount
+
+    def _scheduleReboot(self, testRun):
+        testRun.rebootCount += 1
+        if testRun.rebootCount == 3:
+            raise WrtmTestError("Router did not initiate after three tries, " +
+                                "aborting testing.")
+        return DutRunner.STATE_REBOOT
+
+    async def _waitForReady(self, timeout):
+        waiters = [self.loop.create_task(self._waitForInit(timeout)),
+                   self.loop.create_task(self.consoleReady.wait()),
+                   self.loop.create_task(self.consoleFault.wait())]
+        done, pending = await asyncio.wait(waiters, timeout=timeout,
+                                           return_when=asyncio.FIRST_COMPLETED)
+        for waiter in pending:
+            waiter.cancel()
+
+        if self.consoleFault.is_set():
+            return False
+        if waiters[0] in done:
+            return waiters[0].result()
+        return waiters[1] in done
+
+    async def _waitForInit(self, timeout):
+        deadline = self.loop.time() + timeout
+        while True:
+            data = await self.link.recvInit(deadline - self.loop.time())
+            if data is None:
+                return False
+
+            magic = struct.unpack("<II", data[2:10])
+            if magic[1] == 0xFFFFFFFF and magic[0] == DutRunner.INIT_MAGIC:
+                return True
+
+    def _onConsoleEvent(self, event):
+        # may be called from the serial reader thread
+        self.loop.call_soon_threadsafe(self._handleConsoleEvent, event)
+
+    def _handleConsoleEvent(self, event):
+        if event.kind in ConsoleMonitor.FAULT_EVENTS:
+            self.faultLine = event.line
+            self.consoleFault.set()
+        elif event.kind == ConsoleMonitor.EVENT_READY:
+            self.consoleReady.set()
+        elif event.kind == ConsoleMonitor.EVENT_BOOT:
+            self.consoleBoot.set()
+
+    def _getLoadDelay(self):
+        return int(self.testParser.getPlanOption(self.testName, 'loadDelay', 0))
+
+    def _outcomeBuild(self, traffic):
+        # the same test under other traffic is a different test
+        if len(traffic) == 0:
+            return self.build
+        return self.build + " " + _trafficSignature(traffic)
+
+    async def _startLoadStreams(self, testRun):
+        if self.n2x is None:
+            return
+        # restarting the capture clears it, the previous test's frames have to be out
+        if self.capture is not None:
+            await self.capture.drain()
+        await asyncio.get_event_loop().run_in_executor(self.n2xExecutor,
+                                                       self.n2x._startLoadStreams,
+                                                       testRun.traffic)
+        # baseline for the test's load stats
+        if self.sampler is not None:
+            self.sampler.trigger()
+
+    async def _stopLoadStreams(self, testRun):
+        if self.n2x is None or not self.n2x.running:
+            return
+        await asyncio.get_event_loop().run_in_executor(self.n2xExecutor,
+                                                       self.n2x._stopLoadStreams)
+        if self.capture is None:
+            return
+
+        # download the captured frames while the router gets ready again
+        counts = await self.capture.count()
+        if counts is not None and sum(counts.values()) > 0:
+            testRun.capturedFrames = sum(counts.values())
+            testRun.captureFile = self.capture.export(
+                "capture-" + self.testName + "-" + str(testRun.test[0]) + "-"
+                + time.strftime("%d-%m-%Y_%H-%M-%S", time.gmtime()) + ".pcapng", counts)
+
+    async def _powerCycle(self):
+        print("\r\t" + self.tag + "** Power cycling the router...")
+        try:
+            await self.ups.powerCycle(self.outlet)
+        except UpsError as e:
+            raise WrtmTestError("Power cycle failed (" + str(e) + "), aborting testing.")
+        print("\r\t" + self.tag + "** Power restored.")
+
+    async def _recvAck(self, test, request):
+        # the link retransmits until acked and waits out pending acks
+        sent = self.loop.time()
+        ackData = await request
+        if ackData is None:
+            raise WrtmTimeoutError()
+        self.metrics.observe('wrtm_ack_latency_seconds', self.metricLabels,
+                             self.loop.time() - sent)
+        #print("[:debug] ackData " + ":".join("{:02x}".format(c) for c in ackData))
+        ackPack = ACK.unpack_from(ackData)
+
+        if ackPack[1] == ACK_OK:
+            if ackPack[0] != test[1]:
+                raise WrtmTestError("Got an ack for a wrong test?? " + str(test))
+            return
+        elif ackPack[1] == ACK_UNKNOWN_TEST:
+            raise WrtmTestError("Specified test type (" + str(test[1]) + ") "
+                                + "was not identified on RUT!")
+        raise WrtmTestError("Received a NACK for test #" + str(test[0]) + " from RUT!")
+
+    def _mark(self, testRun):
+        position = self.serial.mark(testRun.test[0], testRun.state)
+        if testRun.serialStart is None:
+            testRun.serialStart = position
+
+    def _recordResult(self, testRun):
+        if testRun.errCode is None:
+            return
+
+        if testRun.errCode == DutRunner.ERR_RCV_TIMEOUT:
+            outcome = 'timed_out'
+        elif testRun.failed():
+            outcome = 'failed'
+        else:
+            outcome = 'passed'
+        self.metrics.inc('wrtm_tests_total', self.metricLabels + (('outcome', outcome),))
+
+        test = testRun.test
+        row = {'router': self.routerIp,
+               'plan': self.testName,
+               'iteration': test[0],
+               'test_id': test[1],
+               'interface': test[2],
+               'offset': test[4],
+               'mask': test[5],
+               'error_code': testRun.errCode,
+               'retries': testRun.retCount,
+               'reboots': testRun.rebootCount,
+               'message': testRun.message}
+
+        if testRun.startTime > 0:
+            row['started_at'] = testRun.startTime
+        if testRun.stopTime > testRun.startTime > 0:
+            row['stopped_at'] = testRun.stopTime
+            row['duration'] = testRun.stopTime - testRun.startTime
+        else:
+            row['duration'] = 0
+
+        if testRun.serialStart is not None:
+            segment, end = self.serial.position()
+            row['serial_log'] = self.serial.logPath
+            row['serial_segment'], row['serial_start'] = testRun.serialStart
+            if segment == row['serial_segment']:
+                row['serial_end'] = end
+
+        if testRun.probe is not None:
+            row['rtt_min'], row['rtt_p50'], row['rtt_p99'], row['rtt_max'], \
+                row['probes_lost'], row['probes'] = testRun.probe.summary()
+
+        if self.sampler is not None and testRun.stopTime > testRun.startTime > 0:
+            load = self.sampler.delta(testRun.startTime, testRun.stopTime)
+            testRun.load = load
+            if load is not None:
+                row['load_samples'] = load[0]
+                row['load_errors'] = sum(load[1])
+                row['load_stream_errors'] = ",".join(str(x) for x in load[1])
+
+        if testRun.captureFile is not None:
+            row['captured_frames'] = testRun.capturedFrames
+            row['capture_file'] = testRun.captureFile
+
+        if len(testRun.traffic) > 0:
+            row['traffic'] = _trafficSignature(testRun.traffic)
+
+        self.results.record(row)
+        self.outcomes.record(test, self._outcomeBuild(testRun.traffic), testRun.failed())
+
+
+def _trafficSignature(traffic):
+    return ",".join(k + "=" + v for k, v in sorted(traffic.items()))
@@ -0,0 +1,109 @@
+import array
+import asyncio
+
+
+class LivenessProbe(object):
+
+    """WRTM Liveness Probe
+
+       Pings the router under test on a fixed, drift-free schedule while a test is
+       running. Probes are fired at start + k * interval on the loop's monotonic clock
+       and do not wait for each other, so a slow reply never delays the next probe.
+       Once lossThreshold probes in a row go unanswered for longer than timeout, the
+       router is considered dead.
+
+       The round trip times of answered probes are kept for the per-test summary.
+    """
+
+    def __init__(self, pinger, interval=0.1, timeout=0.5, lossThreshold=3):
+        self.pinger = pinger
+        self.interval = interval
+        self.timeout = timeout
+        self.lossThreshold = lossThreshold
+
+        self.rtts = array.array('d')
+        self.sent = 0
+        self.lost = 0
+        self.lastAnswered = -1
+        self.pendingLosses = set()
+
+        self.loop = None
+        self.task = None
+        self.probes = set()
+        self.failed = None
+
+    def start(self):
+        self.loop = asyncio.get_event_loop()
+        self.failed = self.loop.create_future()
+        self.task = self.loop.create_task(self._scheduleFunc())
+
+    async def wait(self, duration):
+        """Waits for duration seconds; returns False as soon as the router is
+           declared dead, True if it stayed alive throughout."""
+        try:
+            await asyncio.wait_for(asyncio.shield(self.failed), duration)
+        except asyncio.TimeoutError:
+            return True
+        return False
+
+    async def stop(self):
+        self.task.cancel()
+        for probe in list(self.probes):
+            probe.cancel()
+        await asyncio.gather(self.task, *self.probes, return_exceptions=True)
+
+    def summary(self):
+        """Returns (min, p50, p99, max) of the round trip times in seconds (None if
+           nothing was answered), followed by the number of lost and completed probes.
+           Probes still in flight when the probe was stopped are not counted."""
+        completed = len(self.rtts) + self.lost
+        if len(self.rtts) == 0:
+            return (None, None, None, None, self.lost, completed)
+
+        rtts = sorted(self.rtts)
+        return (rtts[0], self._percentile(rtts, 50), self._percentile(rtts, 99), rtts[-1],
+                self.lost, completed)
+
+    def formatSummary(self):
+        rttMin, rttP50, rttP99, rttMax, lost, completed = self.summary()
+        if rttMin is None:
+            rtt = "-"
+        else:
+            rtt = "/".join("{:.3f}".format(x * 1000.0) for x in (rttMin, rttP50, rttP99, rttMax))
+        return "rtt(min/p50/p99/max): " + rtt + " ms loss: " + str(lost) + "/" + str(completed)
+
+    def _percentile(self, rtts, percent):
+        # nearest-rank
+        rank = -(-len(rtts) * percent // 100)
+        return rtts[max(rank, 1) - 1]
+
+    async def _scheduleFunc(self):
+        startTime = self.loop.time()
+        slot = 0
+        while True:
+            probe = self.loop.create_task(self._probeFunc(self.sent))
+            self.probes.add(probe)
+            probe.add_done_callback(self.probes.discard)
+            self.sent += 1
+
+            # skip the slots we were too late for instead of bunching probes up
+            slot = max(slot + 1, int((self.loop.time() - startTime) / self.interval) + 1)
+            await asyncio.sleep(startTime + slot * self.interval - self.loop.time())
+
+    async def _probeFunc(self, index):
+        rtt = await self.pinger.ping(self.timeout)
+
+        if rtt is not None:
+            self.rtts.append(rtt)
+            self.lastAnswered = max(self.lastAnswered, index)
+            self.pendingLosses = set(i for i in self.pendingLosses if i > index)
+            return
+
+        self.lost += 1
+        if index < self.lastAnswered:
+            # a later probe was already answered, so this is no longer a streak
+            return
+
+        self.pendingLosses.add(index)
+        if len(self.pendingLosses) >= self.lossThreshold and not self.failed.done():
+            self.failed.set_result(None)
@@ -0,0 +1,77 @@
+class LoadRamp(object):
+
+    """WRTM Load Ramp
+
+       Picks the loads (in Mbit/s) to run a test at, to find the lowest load in
+       [minimum, maximum] at which the router faults. Both ends are tested first: a
+       fault at the minimum puts the onset at or below it, a clean run at the maximum
+       means there is none in the range. Otherwise the interval between the highest
+       clean load below the lowest faulty one and that faulty load is bisected until
+       it is at most 'tolerance' wide, which takes about log2((maximum - minimum) /
+       tolerance) tests, or until its midpoint is no longer a new load (the float
+       resolution). The ramp also stops after 'budget' tests, if given.
+
+       Every test adds a point to the curve - the load and whatever the runner
+       measured at it - so the report shows the errors against the throughput, not
+       only the onset.
+    """
+
+    def __init__(self, minimum, maximum, tolerance, budget=0):
+        if not tolerance > 0:
+            raise RuntimeError("The ramp tolerance must be positive, not "
+                               + str(tolerance) + ".")
+        if minimum > maximum:
+            minimum, maximum = maximum, minimum
+        self.minimum = minimum
+        self.maximum = maximum
+        self.tolerance = tolerance
+        self.budget = budget
+
+        # outcomes of the tested loads, and the points of the curve
+        self.outcomes = {}
+        self.points = []
+
+    def __len__(self):
+        return len(self.points)
+
+    def next(self):
+        """Returns the next load to test, or None once the ramp is over."""
+        if self.budget > 0 and len(self.points) >= self.budget:
+            return None
+
+        for load in (self.minimum, self.maximum):
+            if load not in self.outcomes:
+                return load
+
+        clean, onset = self.bracket()
+        if clean is None or onset is None or self._narrowed(clean, onset):
+            return None
+        return (clean + onset) / 2
+
+    def record(self, load, fault, **measured):
+        self.outcomes[load] = bool(fault)
+        self.points.append(dict(measured, load=load, fault=bool(fault)))
+
+    def bracket(self):
+        """Returns the highest clean load below the lowest faulty one and the lowest
+           faulty load (the onset), either None if there is no such load."""
+        faulty = [load for load, fault in self.outcomes.items() if fault]
+        onset = min(faulty) if len(faulty) > 0 else None
+        clean = [load for load, fault in self.outcomes.items()
+                 if not fault and (onset is None or load < onset)]
+        return (max(clean) if len(clean) > 0 else None), onset
+
+    def converged(self):
+        clean, onset = self.bracket()
+        if onset is None:
+            return self.outcomes.get(self.maximum) is False
+        return clean is None and onset == self.minimum or \
+            clean is not None and self._narrowed(clean, onset)
+
+    def _narrowed(self, clean, onset):
+        # a midpoint equal to either end would be tested over and over
+        return onset - clean <= self.tolerance or (clean + onset) / 2 in (clean, onset)
+
+    def curve(self):
+        """Returns the tested points sorted by load."""
+        return sorted(self.points, key=lambda point: point['load'])
@@ -0,0 +1,215 @@
+import argparse
+import asyncio
+import contextlib
+import io
+import json
+import socket
+import sys
+import threading
+import time
+
+from wrtmtester.N2xEmulator import N2xEmulator
+from wrtmtester.N2xInterface import N2xInterface, listFromResponse
+from wrtmtester.WrtmN2xWrapper import WrtmN2xWrapper
+
+
+class _ReplaySocket(object):
+    # hands out a prepared byte string in recv() sized chunks
+    def __init__(self, data):
+        self.data = data
+        self.position = 0
+
+    def recv(self, size):
+        chunk = self.data[self.position:self.position + size]
+        self.position += size
+        return chunk
+
+
+class N2xBenchmark(object):
+
+    """WRTM N2X Benchmark
+
+       Measures the N2X path against the N2xEmulator, for every emulated response
+       latency (in seconds), with the emulated N2X taking 'commandTime' seconds to
+       execute a command:
+
+           initBuild       - seconds to set up the session from scratch
+           initRestore     - seconds to set up the session from the saved one
+           invokeSerial    - invokes per second, one at a time
+           invokePipelined - invokes per second, 'invokes' of them in one pipeline
+
+       and, without any connection, the parsing cost in microseconds per response:
+
+           parseResponse   - reading and splitting responses off the proxy socket
+           parseList       - listFromResponse of a four element list
+
+       The emulator restores a saved session as one command, so initRestore shows
+       the round trips saved over initBuild, not how long the N2X itself takes to
+       restore; that has to be measured on the RouterTester900.
+
+       Every measurement is repeated 'repeat' times and the best result is kept.
+       Results are keyed '<name>' or '<name>@<latency in ms>ms' and can be compared
+       to a saved baseline; a result worse than the baseline by more than the
+       tolerance (a fraction) is a regression.
+    """
+
+    # results where more is better
+    RATES = ('invokeSerial', 'invokePipelined')
+
+    def __init__(self, latencies=(0.0, 0.001, 0.005), commandTime=0.0005, invokes=500,
+                 repeat=3):
+        self.latencies = latencies
+        self.commandTime = commandTime
+        self.invokes = invokes
+        self.repeat = repeat
+
+    def run(self):
+        results = {}
+        for latency in self.latencies:
+            key = "@" + ('%g' % (latency * 1000)) + "ms"
+            for name, value in self._measureSession(latency).items():
+                results[name + key] = value
+
+        results['parseResponse'] = self._best(self._measureResponseParsing, min)
+        results['parseList'] = self._best(self._measureListParsing, min)
+        return results
+
+    def _best(self, measure, best):
+        return best(measure() for _ in range(self.repeat))
+
+    def _measureSession(self, latency):
+        emulator = N2xEmulator(latency, commandTime=self.commandTime)
+        results = {}
+        for _ in range(self.repeat):
+            build, wrapper, thread = self._establish(emulator, False)
+            try:
+                serial = self._invokeRate(wrapper.n2x, False)
+                pipelined = self._invokeRate(wrapper.n2x, True)
+            finally:
+                self._shutdown(wrapper, thread)
+            # the first start saves the session, the second one restores it
+            self._shutdown(*self._establish(emulator, True)[1:])
+            restore, wrapper, thread = self._establish(emulator, True)
+            self._shutdown(wrapper, thread)
+
+            for name, value in (('initBuild', build), ('initRestore', restore),
+                                ('invokeSerial', serial), ('invokePipelined', pipelined)):
+                best = max if name in N2xBenchmark.RATES else min
+                results[name] = best(results.get(name, value), value)
+        return results
+
+    def _establish(self, emulator, cacheSession):
+        wrapper = WrtmN2xWrapper()
+        wrapper.n2x.proxyPort = _freePort()
+        thread = threading.Thread(target=asyncio.run,
+                                  args=(emulator.connect('127.0.0.1', wrapper.n2x.proxyPort),),
+                                  daemon=True)
+        thread.start()
+
+        with contextlib.redirect_stdout(io.StringIO()):
+            wrapper.n2x.reverseProxy()
+            start = time.perf_counter()
+            wrapper.establishSession(cacheSession)
+            elapsed = time.perf_counter() - start
+        return elapsed, wrapper, thread
+
+    def _shutdown(self, wrapper, thread):
+        wrapper.shutdownN2X()
+        thread.join()
+
+    def _invokeRate(self, n2x, pipelined):
+        start = time.perf_counter()
+        if pipelined:
+            with n2x.pipeline():
+                for _ in range(self.invokes):
+                    n2x.invoke("AgtTestController", "GetTestState")
+        else:
+            for _ in range(self.invokes):
+                n2x.invoke("AgtTestController", "GetTestState")
+        return self.invokes / (time.perf_counter() - start)
+
+    def _measureResponseParsing(self):
+        n2x = N2xInterface()
+        data = b"0 {1 2 3 4}\r\n" * self.invokes * 10
+        replay = _ReplaySocket(data)
+        start = time.perf_counter()
+        for _ in range(self.invokes * 10):
+            n2x._readWrapper(replay)
+        return (time.perf_counter() - start) * 1e6 / (self.invokes * 10)
+
+    def _measureListParsing(self):
+        start = time.perf_counter()
+        for _ in range(self.invokes * 10):
+            listFromResponse("{1 2 3 4}")
+        return (time.perf_counter() - start) * 1e6 / (self.invokes * 10)
+
+    @staticmethod
+    def regressions(results, baseline, tolerance):
+        """Returns (name, result, baseline) of the results worse than the baseline."""
+        regressions = []
+        for name, value in sorted(results.items()):
+            if name not in baseline:
+                continue
+            if name.partition('@')[0] in N2xBenchmark.RATES:
+                worse = value < baseline[name] * (1 - tolerance)
+            else:
+                worse = value > baseline[name] * (1 + tolerance)
+            if worse:
+                regressions.append((name, value, baseline[name]))
+        return regressions
+
+
+def _freePort():
+    probe = socket.socket()
+    probe.bind(('127.0.0.1', 0))
+    port = probe.getsockname()[1]
+    probe.close()
+    return port
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description="Benchmark the N2X path against the "
+                                                 + "N2X emulator")
+    parser.add_argument('-l', '--latencies', type=str,
+                        help='comma separated emulated latencies in milliseconds',
+                        required=False, default='0,1,5')
+    parser.add_argument('-c', '--commandTime', type=float,
+                        help='emulated command execution time in milliseconds',
+                        required=False, default=0.5)
+    parser.add_argument('-n', '--invokes', type=int, help='invokes per measurement',
+                        required=False, default=500)
+    parser.add_argument('-r', '--repeat', type=int, help='repetitions of every measurement',
+                        required=False, default=3)
+    parser.add_argument('-s', '--save', type=str, help='save the results to a JSON file',
+                        required=False, default=None)
+    parser.add_argument('-b', '--baseline', type=str,
+                        help='JSON file with baseline results to compare with',
+                        required=False, default=None)
+    parser.add_argument('-t', '--tolerance', type=float,
+                        help='tolerated slowdown relative to the baseline',
+                        required=False, default=0.25)
+    args = parser.parse_args(argv[1:])
+
+    latencies = tuple(float(x) / 1000 for x in args.latencies.split(','))
+    results = N2xBenchmark(latencies, args.commandTime / 1000, args.invokes,
+                           args.repeat).run()
+    for name, value in sorted(results.items()):
+        print("%-28s %12.4f" % (name, value))
+
+    if args.save is not None:
+        with open(args.save, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+
+    if args.baseline is not None:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = N2xBenchmark.regressions(results, baseline, args.tolerance)
+        for name, value, expected in regressions:
+            print("Regression in " + name + ": " + ('%.4f' % value) + " (baseline "
+                  + ('%.4f' % expected) + ")")
+        if len(regressions) > 0:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main(sys.argv)
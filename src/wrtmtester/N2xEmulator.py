@@ -0,0 +1,444 @@
+import argparse
+import asyncio
+import copy
+import random
+import re
+import struct
+import sys
+import time
+
+
+class _EmulatedSession(object):
+    # objects of one open N2X session
+    def __init__(self, sessionId, sessionType, label):
+        self.sessionId = sessionId
+        self.sessionType = sessionType
+        self.label = label
+        self.reset()
+
+    def reset(self):
+        self.ports = []
+        self.addressPools = {}
+        self.sutIpAddresses = {}
+        self.profiles = []
+        self.streamGroups = []
+        self.PDUs = {}
+        self.frameMatchers = []
+        self.stats = []
+        self.owners = {}
+        self.loads = {}
+        self.testRunning = False
+        self.testStarted = 0
+        self.captureRunning = False
+        self.captureStarted = 0
+        self.captureStopped = 0
+
+    def snapshot(self):
+        return copy.deepcopy(dict((name, getattr(self, name)) for name in _SESSION_STATE))
+
+    def restore(self, snapshot):
+        for name, value in copy.deepcopy(snapshot).items():
+            setattr(self, name, value)
+
+
+# what a saved session holds
+_SESSION_STATE = ('ports', 'addressPools', 'sutIpAddresses', 'profiles', 'streamGroups',
+                  'PDUs', 'frameMatchers', 'stats', 'owners', 'loads')
+
+
+class N2xEmulator(object):
+
+    """WRTM N2X Emulator
+
+       Local stand-in for the N2X and its proxy, for exercising N2xInterface and
+       WrtmN2xWrapper without the traffic generator. Like the real proxy, it connects
+       to the tester (which listens on port 9001) and answers the 'invoke', 'connect'
+       and 'disconnect' lines with '<code> <output>' lines, in order.
+
+       Sessions, ports, profiles, stream groups with their PDUs, frame matchers and
+       statistics handlers are kept as far as the tester needs them: handles are
+       handed out and checked when they are used (and listed by the objects owning
+       them, like on the N2X), saved sessions are kept for as long
+       as the emulator runs and the packet integrity error counters grow by
+       'integrityErrors' per second while a test is running with a profile loaded to
+       'onsetLoad' Mbit/s or more, like a router failing above some throughput. As
+       many errored frames per second are captured on every port, up to
+       CAPTURE_FRAMES of them, and can be downloaded. Methods the tester merely
+       configures with are accepted without effect.
+
+       Commands are executed one after another, taking 'commandTime' seconds each
+       (restoring a saved session counts as one command), and every response is
+       delayed by another 'latency' seconds, so pipelined commands overlap like on a
+       real link. Commands fail with probability 'errorRate', or always if their
+       method is in 'failMethods'.
+    """
+
+    SM_PORT_BASE = 9100
+    CAPTURE_FRAMES = 100000
+
+    # methods whose first argument is a handle of the given kind
+    HANDLE_METHODS = {
+        'SetMode': 'profiles',
+        'SetAverageLoad': 'profiles',
+        'AddStreamGroupsWithExistingProfile': 'profiles',
+        'SetExpectedDestinationPorts': 'streamGroups',
+        'SetPduHeaders': 'streamGroups',
+        'SetL2Error': 'streamGroups',
+        'SetFieldFixedValue': 'PDUs',
+        'SetPayloadFill': 'PDUs',
+        'AddFrameFlags': 'frameMatchers',
+        'SelectStatistics': 'stats',
+        'SelectPorts': 'stats',
+        'SelectStreamGroups': 'stats',
+        'GetStreamGroupStatistics': 'stats',
+        'ClearAllFilters': 'ports',
+        'AddProfile': 'ports',
+        'AddFrameMatcher': 'ports',
+        'AddFrameMatcherFilters': 'ports',
+        'SetErroredFrameFilter': 'ports',
+        'ListAddressPools': 'ports',
+        'ListSutIpAddresses': 'ports',
+        'ListProfiles': 'ports',
+        'ListStreamGroups': 'ports',
+        'ListFrameMatchers': 'ports',
+        'ListPdus': 'streamGroups',
+        'ModifySutIpAddress': 'ports',
+        'GetCapturedFrameCount': 'ports',
+        'GetCapturedFrames': 'ports',
+    }
+
+    # methods accepted without any effect
+    SETTERS = ('SetMode', 'SetExpectedDestinationPorts', 'SetPduHeaders',
+               'SetL2Error', 'SetFieldFixedValue', 'SetPayloadFill', 'SetPortGroup',
+               'ClearAllFilters', 'AddFrameFlags', 'AddFrameMatcherFilters',
+               'SetCaptureMode', 'SetErroredFrameFilter', 'SelectStatistics',
+               'SelectPorts', 'SelectStreamGroups', 'SetTesterIpAddresses')
+
+    # Mbit/s per unit of a profile load
+    LOAD_UNITS = {'AGT_UNITS_KBITS_PER_SEC': 0.001, 'AGT_UNITS_MBITS_PER_SEC': 1,
+                  'AGT_UNITS_GBITS_PER_SEC': 1000}
+
+    def __init__(self, latency=0.0, errorRate=0.0, failMethods=(), integrityErrors=0.0,
+                 commandTime=0.0, seed=None, onsetLoad=0.0):
+        self.latency = latency
+        self.commandTime = commandTime
+        self.errorRate = errorRate
+        self.failMethods = set(failMethods)
+        self.integrityErrors = integrityErrors
+        self.onsetLoad = onsetLoad
+        self.random = random.Random(seed)
+
+        self.sessions = {1: _EmulatedSession(1, 'SYSTEM', 'SYSTEM')}
+        self.nextSessionId = 2
+        self.saved = {}
+        self.handle = 0
+
+        self.session = None
+        self.commands = 0
+
+    async def connect(self, host='127.0.0.1', port=9001, retryTime=10):
+        """Connects to the tester, retrying for up to retryTime seconds while it does
+           not listen yet, and serves it until it disconnects."""
+        loop = asyncio.get_event_loop()
+        deadline = loop.time() + retryTime
+        while True:
+            try:
+                reader, writer = await asyncio.open_connection(host, port)
+                break
+            except OSError:
+                if loop.time() > deadline:
+                    raise
+                await asyncio.sleep(0.05)
+
+        responses = asyncio.Queue()
+        sender = asyncio.ensure_future(self._send(writer, responses))
+        busyUntil = 0
+        try:
+            while True:
+                line = await reader.readline()
+                if len(line) == 0:
+                    break
+                line = line.decode('utf-8').rstrip('\r\n')
+                if len(line) == 0:
+                    continue
+                self.commands += 1
+                busyUntil = max(busyUntil, loop.time()) + self.commandTime
+                responses.put_nowait((busyUntil + self.latency, self.execute(line)))
+        finally:
+            await responses.put(None)
+            await sender
+            writer.close()
+
+    async def _send(self, writer, responses):
+        loop = asyncio.get_event_loop()
+        while True:
+            item = await responses.get()
+            if item is None:
+                break
+            due, response = item
+            if due > loop.time():
+                await asyncio.sleep(due - loop.time())
+            try:
+                writer.write(response.encode('utf-8') + b"\r\n")
+                await writer.drain()
+            except ConnectionError:
+                break
+
+    def execute(self, line):
+        """Executes one command line and returns the response line."""
+        words = line.split(' ', 1)
+        if words[0] == 'connect':
+            return self._connect(words[1] if len(words) > 1 else '')
+        if words[0] == 'disconnect':
+            if self.session is None:
+                return "1 not connected"
+            self.session = None
+            return "0 disconnected"
+        if words[0] != 'invoke' or len(words) < 2:
+            return "1 unknown command: " + words[0]
+
+        words = words[1].split(' ')
+        if words[0] == 'sm':
+            words = words[1:]
+            session = None
+        else:
+            session = self.session
+            if session is None:
+                return "1 not connected to a session"
+        if len(words) < 2:
+            return "1 malformed invoke"
+        interfaceName, methodName = words[:2]
+        args = ' '.join(words[2:])
+
+        if methodName in self.failMethods \
+                or (self.errorRate > 0 and self.random.random() < self.errorRate):
+            return "1 injected error in " + interfaceName + "::" + methodName
+
+        try:
+            if session is None:
+                output = self._sessionManager(methodName, args)
+            else:
+                output = self._invoke(session, interfaceName, methodName, args)
+        except (ValueError, IndexError, KeyError) as e:
+            return "1 " + interfaceName + "::" + methodName + " failed: " + str(e)
+        return "0 " + output
+
+    def _connect(self, sessionPort):
+        for session in self.sessions.values():
+            if str(N2xEmulator.SM_PORT_BASE + session.sessionId) == sessionPort.strip():
+                self.session = session
+                return "0 connected"
+        return "1 no session at port " + sessionPort
+
+    def _sessionManager(self, methodName, args):
+        words = _tokens(args)
+        if methodName == 'ListOpenSessions':
+            return "{" + ' '.join(str(x) for x in self.sessions) + "}"
+        if methodName == 'OpenSession':
+            sessionId = self.nextSessionId
+            self.nextSessionId += 1
+            self.sessions[sessionId] = _EmulatedSession(sessionId, words[0], "")
+            return str(sessionId)
+        if methodName == 'CloseSession':
+            session = self.sessions.pop(int(words[0]))
+            if session is self.session:
+                self.session = None
+            return ""
+        if methodName == 'GetSessionPort':
+            return str(N2xEmulator.SM_PORT_BASE + self.sessions[int(words[0])].sessionId)
+        if methodName == 'GetSessionLabel':
+            return self.sessions[int(words[0])].label
+        if methodName == 'SetSessionLabel':
+            self.sessions[int(words[0])].label = ' '.join(words[1:])
+            return ""
+        raise ValueError("unknown method")
+
+    def _invoke(self, session, interfaceName, methodName, args):
+        words = _tokens(args)
+        kind = N2xEmulator.HANDLE_METHODS.get(methodName)
+        handles = getattr(session, kind) if kind is not None else None
+        if kind == 'PDUs':
+            handles = handles.values()
+        if handles is not None and words[0] not in handles:
+            raise ValueError("invalid handle " + words[0])
+
+        if methodName in N2xEmulator.SETTERS:
+            return ""
+
+        if methodName == 'AddPorts':
+            for name in words:
+                port = str(len(session.ports) + 1)
+                session.ports.append(port)
+                session.addressPools[port] = [self._newHandle()]
+                session.sutIpAddresses[port] = ["192.168.0." + port]
+            return "{" + ' '.join(session.ports) + "}"
+        if methodName == 'ListAddressPools':
+            return "{" + ' '.join(session.addressPools[words[0]]) + "}"
+        if methodName == 'ListSutIpAddresses':
+            return "{" + ' '.join(session.sutIpAddresses[words[0]]) + "}"
+        if methodName == 'ModifySutIpAddress':
+            addresses = session.sutIpAddresses[words[0]]
+            addresses[addresses.index(words[1])] = words[2]
+            return ""
+        if methodName == 'AddProfile':
+            return self._add(session.profiles, session, words[0])
+        if methodName == 'SetAverageLoad':
+            session.loads[words[0]] = float(words[1]) * N2xEmulator.LOAD_UNITS[words[2]]
+            return ""
+        if methodName == 'AddStreamGroupsWithExistingProfile':
+            streamGroup = self._add(session.streamGroups, session,
+                                    session.owners[words[0]])
+            session.PDUs[streamGroup] = self._newHandle()
+            return "{" + streamGroup + "} {" + session.PDUs[streamGroup] + "}"
+        if methodName == 'AddFrameMatcher':
+            return self._add(session.frameMatchers, session, words[0])
+        if methodName == 'ListPorts':
+            return "{" + ' '.join(session.ports) + "}"
+        if methodName in ('ListProfiles', 'ListStreamGroups', 'ListFrameMatchers'):
+            handles = {'ListProfiles': session.profiles,
+                       'ListStreamGroups': session.streamGroups,
+                       'ListFrameMatchers': session.frameMatchers}[methodName]
+            return "{" + ' '.join(x for x in handles if session.owners[x] == words[0]) + "}"
+        if methodName == 'ListPdus':
+            return "{" + session.PDUs[words[0]] + "}"
+        if interfaceName == 'AgtStatisticsList' and methodName == 'ListHandles':
+            return "{" + ' '.join(session.stats) + "}"
+        if interfaceName == 'AgtStatisticsList' and methodName == 'Add':
+            return self._add(session.stats)
+        if methodName == 'GetStreamGroupStatistics':
+            errors = 0
+            if session.testRunning:
+                errors = int((time.time() - session.testStarted) * self._errorRate(session))
+            return "{" + str(errors) + "}"
+
+        if methodName == 'StartTest':
+            session.testRunning = True
+            session.testStarted = time.time()
+            return ""
+        if methodName == 'StopTest':
+            session.testRunning = False
+            return ""
+        if methodName == 'GetTestState':
+            return "AGT_TEST_" + ("STARTED" if session.testRunning else "STOPPED")
+        if methodName == 'StartCapture':
+            session.captureRunning = True
+            session.captureStarted = time.time()
+            return ""
+        if methodName == 'StopCapture':
+            if session.captureRunning:
+                session.captureStopped = time.time()
+            session.captureRunning = False
+            return ""
+        if methodName == 'GetCapturedFrameCount':
+            return str(self._capturedFrames(session))
+        if methodName == 'GetCapturedFrames':
+            first = int(words[1])
+            last = min(first + int(words[2]), self._capturedFrames(session))
+            return "{" + ' '.join(self._capturedFrame(session, words[0], i)
+                                  for i in range(first, last)) + "}"
+        if methodName == 'GetCaptureState':
+            return "AGT_CAPTURE_" + ("STARTED" if session.captureRunning else "STOPPED")
+
+        if methodName in ('SaveSession', 'SaveInterfaces'):
+            self.saved[words[0]] = session.snapshot()
+            return ""
+        if methodName in ('RestoreSession', 'RestoreInterfaces'):
+            session.restore(self.saved[words[0]])
+            return ""
+        if methodName in ('ResetSession', 'ResetInterfaces'):
+            session.reset()
+            return ""
+        if methodName == 'ListSavedInterfaces':
+            if words[0] not in self.saved:
+                raise KeyError("no saved session " + words[0])
+            return "{" + ' '.join(_INTERFACES) + "}"
+        if methodName in ('ListInterfaces', 'ListSaveableInterfaces'):
+            return "{" + ' '.join(_INTERFACES) + "}"
+
+        raise ValueError("unknown method")
+
+    def _errorRate(self, session):
+        if max(session.loads.values(), default=0.0) < self.onsetLoad:
+            return 0.0
+        return self.integrityErrors
+
+    def _capturedFrames(self, session):
+        stopped = time.time() if session.captureRunning else session.captureStopped
+        return min(int(max(0, stopped - session.captureStarted) * self._errorRate(session)),
+                   N2xEmulator.CAPTURE_FRAMES)
+
+    def _capturedFrame(self, session, port, i):
+        # '<timestamp in ns> <hex frame>' of an Ethernet/IPv4 frame with a broken checksum
+        timestamp = int((session.captureStarted + i / self.integrityErrors) * 1e9)
+        frame = b'\x02\0\0\0\0' + bytes((int(port),)) + b'\x02\0\0\0\0\x01\x08\x00' \
+                + struct.pack('>BBHHHBBH4s4s', 0x45, 0, 108, i & 0xFFFF, 0, 64, 6, 0xDEAD,
+                              bytes((192, 168, 1, 2)), bytes((192, 168, 3, 2))) \
+                + b'\xA5\xA5\x3C\x3C' * 22
+        return str(timestamp) + " " + frame.hex()
+
+    def _newHandle(self):
+        self.handle += 1
+        return str(self.handle)
+
+    def _add(self, handles, session=None, port=None):
+        handles.append(self._newHandle())
+        if port is not None:
+            session.owners[handles[-1]] = port
+        return handles[-1]
+
+
+_INTERFACES = ('AgtPortSelector', 'AgtEthernetAddresses', 'AgtProfileList',
+               'AgtStreamGroupList', 'AgtFrameMatcherList', 'AgtCaptureControl',
+               'AgtStatisticsList')
+
+
+def _tokens(args):
+    # arguments without the Tcl list/quoting syntax
+    return [x for x in re.split(r'[\s{}\[\]"]+', args) if x not in ('', 'list')]
+
+
+async def serve(args):
+    emulator = N2xEmulator(args.latency, args.errorRate,
+                           args.fail.split(',') if args.fail else (),
+                           args.integrityErrors, args.commandTime, args.seed, args.onsetLoad)
+    while True:
+        print("Connecting to the tester at " + args.tester + ":" + str(args.port) + "...")
+        await emulator.connect(args.tester, args.port, float('inf'))
+        print("Tester disconnected after " + str(emulator.commands) + " commands.")
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description="Emulate the N2X proxy")
+    parser.add_argument('-t', '--tester', type=str, help='address of the tester',
+                        required=False, default='127.0.0.1')
+    parser.add_argument('-p', '--port', type=int, help='proxy port of the tester',
+                        required=False, default=9001)
+    parser.add_argument('-l', '--latency', type=float, help='response latency in seconds',
+                        required=False, default=0.0)
+    parser.add_argument('-e', '--errorRate', type=float,
+                        help='probability of failing a command',
+                        required=False, default=0.0)
+    parser.add_argument('-f', '--fail', type=str,
+                        help='comma separated list of methods that always fail',
+                        required=False, default=None)
+    parser.add_argument('-i', '--integrityErrors', type=float,
+                        help='packet integrity errors per second of a running test',
+                        required=False, default=0.0)
+    parser.add_argument('-o', '--onsetLoad', type=float,
+                        help='lowest load in Mbit/s causing integrity errors',
+                        required=False, default=0.0)
+    parser.add_argument('-c', '--commandTime', type=float,
+                        help='time the N2X takes to execute a command in seconds',
+                        required=False, default=0.0)
+    parser.add_argument('--seed', type=int, help='seed for the error injection',
+                        required=False, default=None)
+    args = parser.parse_args(argv[1:])
+
+    try:
+        asyncio.run(serve(args))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main(sys.argv)
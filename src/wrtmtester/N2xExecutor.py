@@ -0,0 +1,67 @@
+import concurrent.futures
+import itertools
+import queue
+import threading
+
+
+class N2xExecutor(concurrent.futures.Executor):
+
+    """WRTM N2X Executor
+
+       Runs the blocking N2X calls one at a time, in order, on a thread of its own -
+       there is only the one proxy connection. Calls handed to background() (stats
+       samples, capture downloads) run only when no other call is waiting, so
+       starting and stopping the load streams never queues up behind them; at most
+       the background call already running is waited for.
+    """
+
+    PRIORITY_CONTROL = 0
+    PRIORITY_BACKGROUND = 1
+    PRIORITY_SHUTDOWN = 2
+
+    def __init__(self):
+        self.queue = queue.PriorityQueue()
+        # keeps calls of the same priority in order
+        self.counter = itertools.count()
+        self.thread = threading.Thread(target=self._threadFunc)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def submit(self, fn, *args, **kwargs):
+        return self._submit(N2xExecutor.PRIORITY_CONTROL, fn, args, kwargs)
+
+    def background(self, fn, *args, **kwargs):
+        """Like submit(), for calls that may wait for all others."""
+        return self._submit(N2xExecutor.PRIORITY_BACKGROUND, fn, args, kwargs)
+
+    def shutdown(self, wait=True, *, cancel_futures=False):
+        # the calls already submitted are run first
+        if self.thread is None:
+            return
+        self.queue.put((N2xExecutor.PRIORITY_SHUTDOWN, next(self.counter), None))
+        if wait:
+            self.thread.join()
+        self.thread = None
+
+    def _submit(self, priority, fn, args, kwargs):
+        if self.thread is None:
+            raise RuntimeError("Cannot schedule N2X calls after shutdown.")
+        future = concurrent.futures.Future()
+        self.queue.put((priority, next(self.counter), (future, fn, args, kwargs)))
+        return future
+
+    def _threadFunc(self):
+        while True:
+            _, _, call = self.queue.get()
+            if call is None:
+                break
+
+            future, fn, args, kwargs = call
+            if not future.set_running_or_notify_cancel():
+                continue
+            try:
+                result = fn(*args, **kwargs)
+            except BaseException as e:
+                future.set_exception(e)
+            else:
+                future.set_result(result)
@@ -1,8 +1,9 @@
+import contextlib
 import socket
 
 
 def listFromResponse(output):
-    return output[output.find("{")+1:output.rfind("}")].split(' ')
+    return output[output.find("{")+1:output.rfind("}")].split()
 
 class N2xInterface(object):
 
@@ -11,6 +12,15 @@ class N2xInterface(object):
        Wrapper around the N2X connection, used to setup a testing session, configure
        statistics collection, activating and deactivating traffic generation and
        managing the proxy socket.
+
+       Commands issued inside a pipeline() block are not sent one at a time, but
+       queued and written back to back when the block ends; the proxy answers them in
+       order, so the whole block takes a single round trip. Wrappers whose output is
+       needed (the lists of profiles, stream groups, PDUs, frame matchers, stats and
+       the address pools/SUT addresses of the ports) record it once the responses are
+       in, so commands using those handles have to go into a later pipeline. All
+       responses of a pipeline are read even if one of the commands failed; the first
+       failure is then raised, naming the command that caused it.
     """
 
     def __init__(self, address='0.0.0.0', port=9001):
@@ -21,8 +31,11 @@ class N2xInterface(object):
         self.PDUs = []
         self.frameMatchers = []
         self.stats = []
+        self.addressPools = {}
+        self.sutIpAddresses = {}
 
-        self.readBuffer = ""
+        self.readBuffer = bytearray()
+        self.pipelined = None
 
         self.proxyAddress = address
         self.proxyPort = port
@@ -30,6 +43,8 @@ class N2xInterface(object):
 
     def reverseProxy(self):
         serverSocket = socket.socket()
+        # a restarted tester must not wait for the previous connection's TIME_WAIT
+        serverSocket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
         serverSocket.bind(('', self.proxyPort))
         serverSocket.listen(1)
         self.proxySocket, self.proxyAddress = serverSocket.accept()
@@ -39,6 +54,13 @@ class N2xInterface(object):
     def connectToProxy(self):
         raise NotImplementedError()
 
+    def shutdown(self):
+        # the proxy connection is of no use after a socket error
+        try:
+            self.proxySocket.close()
+        except OSError:
+            pass
+
     def disconnectFromProxy(self):
         self.proxySocket.shutdown(socket.SHUT_RDWR)
         self.proxySocket.close()
@@ -79,17 +101,58 @@ class N2xInterface(object):
     def smInvoke(self, interfaceName, methodName, args=""):
         return self.invoke("sm " + interfaceName, methodName, args)
         
-    def invoke(self, interfaceName, methodName, args=""):
+    def invoke(self, interfaceName, methodName, args="", then=None):
+        """Executes a command and returns its output, or then(output) if given. Inside
+           a pipeline, the command is only queued (then is applied once its response
+           arrives) and None is returned."""
         data = "invoke " + interfaceName + " " + methodName + " " + str(args);
 
+        if self.pipelined is not None:
+            self.pipelined.append((data, then))
+            return None
+
         self._writeWrapper(self.proxySocket, data)
         result, output = self._readWrapper(self.proxySocket)
 
         if result != 0:
             raise RuntimeError('Error: "' + output + '" while executing command: ' + data)
 
+        if then is not None:
+            return then(output)
         return output
-        
+
+    @contextlib.contextmanager
+    def pipeline(self):
+        if self.pipelined is not None:
+            yield
+            return
+
+        self.pipelined = []
+        try:
+            yield
+            commands = self.pipelined
+        finally:
+            self.pipelined = None
+
+        if len(commands) > 0:
+            self._executePipeline(commands)
+
+    def _executePipeline(self, commands):
+        self._writeWrapper(self.proxySocket, "\r\n".join(data for data, _ in commands))
+        responses = [self._readWrapper(self.proxySocket) for _ in commands]
+
+        error = None
+        for (data, then), (result, output) in zip(commands, responses):
+            if result != 0:
+                if error is None:
+                    error = RuntimeError('Error: "' + output + '" while executing command: '
+                                         + data)
+            elif then is not None:
+                then(output)
+
+        if error is not None:
+            raise error
+
     def _writeWrapper(self, socket, data):
         try:
             socket.sendall(bytes(data + "\r\n", 'utf-8'))
@@ -99,17 +162,23 @@ class N2xInterface(object):
             raise
 
     def _readWrapper(self, socket):
+        # responses (captured frames in particular) may be large: the bytes are
+        # appended to a bytearray, only the new part of it is searched for the line end
+        # and a line is decoded once complete
         try:
-            while "\r\n" not in self.readBuffer:
-                self.readBuffer += socket.recv(4096).decode('utf-8')
+            end = self.readBuffer.find(b"\r\n")
+            while end < 0:
+                scanned = max(len(self.readBuffer) - 1, 0)
+                data = socket.recv(65536)
+                if len(data) == 0:
+                    raise ConnectionResetError("N2X proxy closed the connection")
+                self.readBuffer += data
+                end = self.readBuffer.find(b"\r\n", scanned)
 
-            parts = self.readBuffer.partition("\r\n")
-            self.readBuffer = parts[2]
-            
-            result = int(parts[0].partition(' ')[0])
-            output = parts[0].partition(' ')[2]
+            result, _, output = self.readBuffer[:end].decode('utf-8').partition(' ')
+            del self.readBuffer[:end + 2]
 
-            return result, output
+            return int(result), output
 
         except OSError:
             self.shutdown()
@@ -177,16 +246,83 @@ class N2xInterface(object):
         else:
             self.invoke("AgtTestSession", "RestoreSession", fileName)
 
+    def rediscoverHandles(self):
+        """Refills the handle lists from the session, e.g. after restoring it, through
+           the List methods of the objects owning the handles: the ports of the
+           session, the profiles, stream groups and frame matchers of every port, the
+           PDUs of every stream group and the statistics handlers. Each list is in the
+           order of the ports (or stream groups), as the handles were created."""
+        self.ports = []
+        self.profiles = []
+        self.streamGroups = []
+        self.PDUs = []
+        self.frameMatchers = []
+        self.stats = []
+        self.addressPools = {}
+        self.sutIpAddresses = {}
+
+        self.listPorts()
+        with self.pipeline():
+            for port in self.ports:
+                self.listProfiles(port)
+                self.listStreamGroups(port)
+                self.listFrameMatchers(port)
+            self.listStatHandlers()
+        with self.pipeline():
+            for streamGroup in self.streamGroups:
+                self.listPdus(streamGroup)
+
+    def listPorts(self):
+        def listed(output):
+            self.ports = listFromResponse(output)
+
+        self.invoke("AgtPortSelector", "ListPorts", "", listed)
+
+    def listProfiles(self, port):
+        self.invoke("AgtProfileList", "ListProfiles", port,
+                    lambda output: self.profiles.extend(listFromResponse(output)))
+
+    def listStreamGroups(self, port):
+        self.invoke("AgtStreamGroupList", "ListStreamGroups", port,
+                    lambda output: self.streamGroups.extend(listFromResponse(output)))
+
+    def listPdus(self, streamGroup):
+        self.invoke("AgtStreamGroup", "ListPdus", streamGroup,
+                    lambda output: self.PDUs.extend(listFromResponse(output)))
+
+    def listFrameMatchers(self, port):
+        self.invoke("AgtFrameMatcherList", "ListFrameMatchers", port,
+                    lambda output: self.frameMatchers.extend(listFromResponse(output)))
+
+    def listStatHandlers(self):
+        def listed(output):
+            self.stats = listFromResponse(output)
+
+        self.invoke("AgtStatisticsList", "ListHandles", "", listed)
+
     # N2X API session specific wrappers
     def addPortsToSession(self, ports):
         if type(ports) is list:
             ports = "[list " + ' '.join(ports) + "]"
-        self.ports = listFromResponse(self.invoke("AgtPortSelector", "AddPorts", ports))
+        def added(output):
+            self.ports = listFromResponse(output)
+
+        self.invoke("AgtPortSelector", "AddPorts", ports, added)
 
     def listAddressPools(self, port):
-        return listFromResponse(self.invoke("AgtEthernetAddresses", "ListAddressPools", str(port)))                
+        def listed(output):
+            self.addressPools[port] = listFromResponse(output)
+            return self.addressPools[port]
+
+        return self.invoke("AgtEthernetAddresses", "ListAddressPools", str(port), listed)
+
     def listSutIpAddresses(self, port):
-        return listFromResponse(self.invoke("AgtEthernetAddresses", "ListSutIpAddresses", str(port)))                
+        def listed(output):
+            self.sutIpAddresses[port] = listFromResponse(output)
+            return self.sutIpAddresses[port]
+
+        return self.invoke("AgtEthernetAddresses", "ListSutIpAddresses", str(port), listed)
+
     def modifySutIpAddress(self, port, oldip, ip):
         try:
             socket.inet_aton(oldip)
@@ -194,11 +330,17 @@ class N2xInterface(object):
         except socket.error:
             raise RuntimeError("Malformed IP address supplied (oldip=" + oldip + ",ip=" + ip + ")")
 
+        def modified(output):
+            addresses = self.sutIpAddresses.get(port, [])
+            if oldip in addresses:
+                addresses[addresses.index(oldip)] = ip
+
         args = port + " " + oldip + " " + ip
-        self.invoke("AgtEthernetAddresses", "ModifySutIpAddress", args)
+        self.invoke("AgtEthernetAddresses", "ModifySutIpAddress", args, modified)
 
     def setSutIpAddress(self, port, ip):
-        self.modifySutIpAddress(port, self.listSutIpAddresses(port)[0], ip)
+        self.modifySutIpAddress(port, self._listed(self.sutIpAddresses,
+                                                   self.listSutIpAddresses, port)[0], ip)
 
     def setTesterIpAddress(self, port, ip, mask, noaddr=1, step=1):
         try:
@@ -206,13 +348,21 @@ class N2xInterface(object):
         except socket.error:
             raise RuntimeError("Malformed IP address supplied (ip=" + ip + ")")
 
-        args = self.listAddressPools(port)[0] + " " + ip + " " + mask + " " \
-               + str(noaddr) + " " + str(step)
+        args = self._listed(self.addressPools, self.listAddressPools, port)[0] + " " \
+               + ip + " " + mask + " " + str(noaddr) + " " + str(step)
         self.invoke("AgtEthernetAddressPool", "SetTesterIpAddresses", args)
 
+    def _listed(self, known, lister, port):
+        if port not in known:
+            if self.pipelined is not None:
+                raise RuntimeError("Addresses of port " + port + " have to be listed in "
+                                   + "an earlier pipeline.")
+            lister(port)
+        return known[port]
+
     def addProfile(self, port, profileType):
         args = port + " " + profileType
-        self.profiles.append(self.invoke("AgtProfileList", "AddProfile", args))
+        self.invoke("AgtProfileList", "AddProfile", args, self.profiles.append)
 
     def setProfileMode(self, profile, profileType, profileMode):
         args = profile + " " + profileMode
@@ -224,7 +374,10 @@ class N2xInterface(object):
 
     def addStreamGroupToProfile(self, profile):
         args = profile + " AGT_PACKET_STREAM_GROUP 1"
-        output = self.invoke("AgtStreamGroupList", "AddStreamGroupsWithExistingProfile", args)
+        self.invoke("AgtStreamGroupList", "AddStreamGroupsWithExistingProfile", args,
+                    self._streamGroupAdded)
+
+    def _streamGroupAdded(self, output):
         firstLBracket = output.find('{')
         firstRBracket = output.find('}', firstLBracket)
         secondLBracket = output.find('{', firstRBracket)
@@ -248,7 +401,7 @@ class N2xInterface(object):
         self.invoke("AgtStreamGroup", "SetPduHeaders", args)
 
     def enableL2ErrorInjection(self, streamGroup, errorType):
-        args = streamgroup + " AGT_L2_FCS_ERROR"
+        args = streamGroup + " " + errorType
         self.invoke("AgtStreamGroup", "SetL2Error", args)
 
     def setFixedPduFieldValue(self, pdu, protocol, field, value):
@@ -288,7 +441,7 @@ class N2xInterface(object):
         self.invoke("AgtCaptureFilter", "ClearAllFilters", port)
 
     def createFrameMatcher(self, port):
-        self.frameMatchers.append(self.invoke("AgtFrameMatcherList", "AddFrameMatcher", port))
+        self.invoke("AgtFrameMatcherList", "AddFrameMatcher", port, self.frameMatchers.append)
 
     def addMatcherFrameFlags(self, frameMatcher, frameFlag):
         args = frameMatcher + " " + frameFlag
@@ -315,6 +468,21 @@ class N2xInterface(object):
     def stopCapture(self):
         self.invoke("AgtCaptureControl", "StopCapture")
 
+    def getCapturedFrameCount(self, port, then=None):
+        def counted(output):
+            count = int(output)
+            return count if then is None else then(count)
+
+        return self.invoke("AgtCaptureControl", "GetCapturedFrameCount", port, counted)
+
+    def getCapturedFrames(self, port, first, count):
+        """Returns (timestamp in nanoseconds, frame) of up to count captured frames,
+           starting with the first-th (counted from 0); the frames come hex encoded."""
+        args = port + " " + str(first) + " " + str(count)
+        values = listFromResponse(self.invoke("AgtCaptureControl", "GetCapturedFrames", args))
+        return [(int(values[i]), bytes.fromhex(values[i + 1]))
+                for i in range(0, len(values) - 1, 2)]
+
     def startTest(self):
         self.invoke("AgtTestController", "StartTest")
 
@@ -326,7 +494,7 @@ class N2xInterface(object):
 
     # N2X API statistics wrappers
     def createStatHandler(self):
-        self.stats.append(self.invoke("AgtStatisticsList", "Add", "AGT_STATISTICS"))
+        self.invoke("AgtStatisticsList", "Add", "AGT_STATISTICS", self.stats.append)
 
     def selectStats(self, stats, statTypes):
         args = stats + " {" + statTypes + "}"
@@ -346,6 +514,10 @@ class N2xInterface(object):
         args = stats + " " + streamGroups
         self.invoke("AgtStatistics", "SelectStreamGroups", args)
 
-    def collectStats(self, stats, streamGroup):
+    def collectStats(self, stats, streamGroup, then=None):
+        def collected(output):
+            values = listFromResponse(output)
+            return values if then is None else then(values)
+
         args = stats + " " + streamGroup
-        return listFromResponse(self.invoke("AgtStatistics", "GetStreamGroupStatistics", args))
+        return self.invoke("AgtStatistics", "GetStreamGroupStatistics", args, collected)
@@ -0,0 +1,117 @@
+import random
+import time
+
+from wrtmtester.SqliteWriter import SqliteWriter
+
+
+class OutcomeCache(object):
+
+    """WRTM Outcome Cache
+
+       Remembers the outcome of every test ever run, keyed by the test type,
+       interface, offset, mask and the build identifier of the firmware/WRTM modules
+       on the router, in an SQLite database shared by all campaigns. Before a test is
+       issued, the cache decides whether it is worth running again:
+
+           none         - always run (the cache is only updated)
+           skip-stable  - skip tests that passed at least 'stableRuns' times and never
+                          failed
+           failures     - run only tests that failed before or were never run
+           probability  - like skip-stable, but still rerun stable tests with the
+                          given probability
+
+       Entries not run for 'expiry' seconds are forgotten, and once there are more
+       than 'maxEntries' of them the least recently run are evicted; both happen when
+       the cache is opened.
+
+       Outcomes are recorded like the rows of a ResultStore: queued and written by a
+       SqliteWriter, which commits them in groups, so the event loop never waits for
+       SQLite. Lookups see an outcome once its group
+       is committed; close() writes the queued outcomes out.
+    """
+
+    POLICY_NONE = 'none'
+    POLICY_SKIP_STABLE = 'skip-stable'
+    POLICY_FAILURES = 'failures'
+    POLICY_PROBABILITY = 'probability'
+
+    POLICIES = (POLICY_NONE, POLICY_SKIP_STABLE, POLICY_FAILURES, POLICY_PROBABILITY)
+
+    DEFAULT_EXPIRY = 30 * 24 * 3600
+    DEFAULT_MAX_ENTRIES = 10000000
+
+    COMMIT_INTERVAL = 1.0
+    COMMIT_BATCH = 256
+
+    def __init__(self, path, expiry=DEFAULT_EXPIRY, maxEntries=DEFAULT_MAX_ENTRIES):
+        self.path = path
+        self.expiry = expiry
+        self.maxEntries = maxEntries
+        self.connection = None
+        self.random = random.Random()
+        self.writer = SqliteWriter(
+            path, "INSERT INTO outcomes VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?) "
+            "ON CONFLICT (test_id, interface, offset, mask, build) DO UPDATE SET "
+            "passes = passes + excluded.passes, "
+            "failures = failures + excluded.failures, "
+            "last_failed = excluded.last_failed, last_run = excluded.last_run",
+            OutcomeCache.COMMIT_INTERVAL, OutcomeCache.COMMIT_BATCH)
+
+    def open(self):
+        self.connection = SqliteWriter.connect(self.path)
+        self.connection.execute("CREATE TABLE IF NOT EXISTS outcomes ("
+                                "test_id INTEGER, interface TEXT, offset INTEGER, "
+                                "mask INTEGER, build TEXT, passes INTEGER, "
+                                "failures INTEGER, last_failed INTEGER, last_run REAL, "
+                                "PRIMARY KEY (test_id, interface, offset, mask, build))")
+        self.connection.execute("CREATE INDEX IF NOT EXISTS outcomes_last_run "
+                                "ON outcomes (last_run)")
+
+        # expire and evict
+        if self.expiry > 0:
+            self.connection.execute("DELETE FROM outcomes WHERE last_run < ?",
+                                    (time.time() - self.expiry,))
+        count = self.connection.execute("SELECT COUNT(*) FROM outcomes").fetchone()[0]
+        if self.maxEntries > 0 and count > self.maxEntries:
+            self.connection.execute("DELETE FROM outcomes WHERE rowid IN (SELECT rowid FROM "
+                                    "outcomes ORDER BY last_run LIMIT ?)",
+                                    (count - self.maxEntries,))
+        self.connection.commit()
+
+        self.writer.start()
+
+    def close(self):
+        self.writer.close()
+        if self.connection is not None:
+            self.connection.close()
+            self.connection = None
+
+    def lookup(self, test, build):
+        """Returns (passes, failures, last run failed) of a test, or None."""
+        return self.connection.execute(
+            "SELECT passes, failures, last_failed FROM outcomes WHERE test_id = ? AND "
+            "interface = ? AND offset = ? AND mask = ? AND build = ?",
+            (test[1], test[2], test[4], test[5], build)).fetchone()
+
+    def shouldRun(self, test, build, policy, stableRuns=1, probability=0.0):
+        if policy == OutcomeCache.POLICY_NONE:
+            return True
+
+        outcome = self.lookup(test, build)
+        if outcome is None:
+            return True
+        passes, failures, lastFailed = outcome
+
+        if policy == OutcomeCache.POLICY_FAILURES:
+            return failures > 0
+        if failures > 0 or passes < stableRuns:
+            return True
+        if policy == OutcomeCache.POLICY_PROBABILITY:
+            return self.random.random() < probability
+        return False
+
+    def record(self, test, build, failed):
+        """Queues the outcome of a test."""
+        failed = int(bool(failed))
+        self.writer.put((test[1], test[2], test[4], test[5], build, 1 - failed, failed,
+                         failed, time.time()))
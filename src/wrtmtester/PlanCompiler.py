@@ -0,0 +1,202 @@
+import hashlib
+import json
+import mmap
+import os
+import struct
+
+
+PLAN_MAGIC = b'WRTMPLN2'
+PLAN_HEADER = struct.Struct('<8sII')
+TEST_PACKET = struct.Struct('<IIILII128sII')
+TRAFFIC_INDEX = struct.Struct('<I')
+
+CACHE_DIR = '.wrtm-cache'
+
+
+class CompiledPlan(object):
+
+    """WRTM Compiled Plan
+
+       A test plan section compiled into one contiguous, memory-mapped buffer. Every
+       test takes two consecutive packets in it, the start and the stop definition,
+       ready to be sent as they are; startPacket() and stopPacket() only slice the
+       buffer. The test parameters are read back from the start packet.
+
+       The packets are followed by the index of the test's traffic overrides in a
+       table (JSON) after the last test, which holds each distinct set of overrides
+       once.
+    """
+
+    RECORD_SIZE = 2 * TEST_PACKET.size + TRAFFIC_INDEX.size
+
+    def __init__(self, path):
+        self.path = path
+        self.planFile = open(path, "rb")
+        self.buffer = mmap.mmap(self.planFile.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            magic, recordSize, self.count = PLAN_HEADER.unpack_from(self.buffer)
+            end = PLAN_HEADER.size + self.count * recordSize
+            if magic != PLAN_MAGIC or recordSize != CompiledPlan.RECORD_SIZE \
+                    or len(self.buffer) <= end:
+                raise ValueError("bad header")
+            self.traffics = json.loads(self.buffer[end:].decode('utf-8'))
+        except (ValueError, struct.error):
+            self.buffer.close()
+            self.planFile.close()
+            raise RuntimeError("'" + path + "' is not a compiled test plan.")
+        self.view = memoryview(self.buffer)
+
+    def __len__(self):
+        return self.count
+
+    def close(self):
+        self.view.release()
+        self.buffer.close()
+        self.planFile.close()
+
+    def test(self, i):
+        """Returns the i-th test (0-based) in the form given by the TestPlanParser."""
+        testIter, _, testId, _, duration, _, name, offset, mask = TEST_PACKET.unpack_from(
+            self.buffer, PLAN_HEADER.size + i * CompiledPlan.RECORD_SIZE)
+        return [testIter, testId, name.rstrip(b'\0').decode('utf-8'), duration, offset, mask]
+
+    def startPacket(self, i):
+        start = PLAN_HEADER.size + i * CompiledPlan.RECORD_SIZE
+        return self.view[start:start + TEST_PACKET.size]
+
+    def stopPacket(self, i):
+        start = PLAN_HEADER.size + i * CompiledPlan.RECORD_SIZE + TEST_PACKET.size
+        return self.view[start:start + TEST_PACKET.size]
+
+    def traffic(self, i):
+        """Returns the traffic overrides of the i-th test (not to be modified)."""
+        return self.traffics[TRAFFIC_INDEX.unpack_from(
+            self.buffer, PLAN_HEADER.size + (i + 1) * CompiledPlan.RECORD_SIZE
+            - TRAFFIC_INDEX.size)[0]]
+
+
+class SweepPlan(object):
+
+    """WRTM Sweep Plan
+
+       Stand-in for a CompiledPlan of a section too large to be compiled. The test
+       definitions are packed on demand from the section's TestSweep.
+    """
+
+    def __init__(self, sweep):
+        self.sweep = sweep
+
+    def __len__(self):
+        return len(self.sweep)
+
+    def close(self):
+        pass
+
+    def test(self, i):
+        return self.sweep[i]
+
+    def startPacket(self, i):
+        return PlanCompiler.packTest(self.sweep[i])
+
+    def stopPacket(self, i):
+        return PlanCompiler.packTest(self.sweep[i], stop=True)
+
+    def traffic(self, i):
+        return self.sweep.traffic(i)
+
+
+class PlanCompiler(object):
+
+    """WRTM Plan Compiler
+
+       Validates a test plan section once and compiles it into a CompiledPlan. The
+       result is cached in a '.wrtm-cache' directory next to the test description,
+       keyed by the hash of the description, the test types file and the section name,
+       so later runs of an unchanged plan just map the cached file - the section is
+       not even parsed then; the count in the header must match the file's size.
+
+       Sections with more than MAX_COMPILED tests (huge sweeps) are not compiled;
+       their lines are validated and a SweepPlan is returned instead.
+    """
+
+    MAX_COMPILED = 1 << 20
+
+    def __init__(self, testParser):
+        self.testParser = testParser
+
+    def compile(self, name):
+        path = self.cachePath(name)
+        if os.path.exists(path):
+            try:
+                return CompiledPlan(path)
+            except RuntimeError:
+                # stale or torn cache entry, compile it again
+                pass
+
+        sweep = self.testParser.getTestSweep(name)
+        if len(sweep) > PlanCompiler.MAX_COMPILED:
+            for line in sweep.lines:
+                for interface in line.interfaces:
+                    self._validate(name, [0, line.testId, interface, line.duration, 0, 0])
+            return SweepPlan(sweep)
+
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmpPath = path + ".tmp" + str(os.getpid())
+        with open(tmpPath, "wb") as planFile:
+            planFile.write(PLAN_HEADER.pack(PLAN_MAGIC, CompiledPlan.RECORD_SIZE, len(sweep)))
+            traffics = []
+            indices = {}
+            for i in range(len(sweep)):
+                test = sweep[i]
+                self._validate(name, test)
+                traffic = sweep.traffic(i)
+                key = tuple(sorted(traffic.items()))
+                if key not in indices:
+                    indices[key] = len(traffics)
+                    traffics.append(traffic)
+                planFile.write(self.packTest(test))
+                planFile.write(self.packTest(test, stop=True))
+                planFile.write(TRAFFIC_INDEX.pack(indices[key]))
+            planFile.write(json.dumps(traffics).encode('utf-8'))
+        os.replace(tmpPath, path)
+
+        return CompiledPlan(path)
+
+    def cachePath(self, name):
+        digest = hashlib.sha256()
+        for path in (self.testParser.loadedPath, self.testParser.testTypesPath):
+            if path is not None:
+                with open(path, "rb") as inFile:
+                    digest.update(hashlib.sha256(inFile.read()).digest())
+        digest.update(name.encode('utf-8'))
+
+        directory = os.path.dirname(os.path.abspath(self.testParser.loadedPath))
+        return os.path.join(directory, CACHE_DIR, digest.hexdigest()[:32] + ".plan")
+
+    @staticmethod
+    def packTest(test, stop=False):
+        if stop:
+            stop = 1
+        else:
+            stop = 0
+        return TEST_PACKET.pack(test[0],
+                                test[0],
+                                test[1],
+                                136,
+                                test[3],
+                                stop,
+                                bytes(test[2], 'utf-8'),
+                                test[4],
+                                test[5])
+
+    def _validate(self, name, test):
+        where = "Test #" + str(test[0]) + " of plan '" + name + "'"
+        testTypes = self.testParser.testTypes
+        if len(testTypes) > 0 and test[1] not in testTypes:
+            raise RuntimeError(where + " has an unknown test type (" + str(test[1]) + ").")
+        if len(bytes(test[2], 'utf-8')) >= 128:
+            raise RuntimeError(where + " has an interface name too long.")
+        for value, field in ((test[1], "test type"), (test[3], "duration"),
+                             (test[4], "offset"), (test[5], "mask")):
+            if value < 0 or value > 0xFFFFFFFF:
+                raise RuntimeError(where + " has its " + field + " out of range.")
@@ -0,0 +1,141 @@
+import argparse
+import csv
+import json
+import sys
+import time
+
+from wrtmtester.SqliteWriter import SqliteWriter
+
+
+class ResultStore(object):
+
+    """WRTM Result Store
+
+       Keeps one typed row per executed test in an SQLite database (in WAL mode).
+       Rows are queued by the runners and written by a SqliteWriter, which commits
+       them in groups - every COMMIT_INTERVAL seconds or COMMIT_BATCH rows, whichever
+       comes first - so recording a result costs a test nothing and a crash loses at
+       most the last interval. The database can be exported to JSONL or CSV.
+
+       close() writes the queued rows out and waits for the writer.
+    """
+
+    COMMIT_INTERVAL = 1.0
+    COMMIT_BATCH = 256
+
+    COLUMNS = (
+        ('router', 'TEXT'),
+        ('plan', 'TEXT'),
+        ('iteration', 'INTEGER'),
+        ('test_id', 'INTEGER'),
+        ('interface', 'TEXT'),
+        ('offset', 'INTEGER'),
+        ('mask', 'INTEGER'),
+        ('error_code', 'INTEGER'),
+        ('retries', 'INTEGER'),
+        ('duration', 'REAL'),
+        ('started_at', 'REAL'),
+        ('stopped_at', 'REAL'),
+        ('recorded_at', 'REAL'),
+        ('reboots', 'INTEGER'),
+        ('serial_log', 'TEXT'),
+        ('serial_segment', 'INTEGER'),
+        ('serial_start', 'INTEGER'),
+        ('serial_end', 'INTEGER'),
+        ('rtt_min', 'REAL'),
+        ('rtt_p50', 'REAL'),
+        ('rtt_p99', 'REAL'),
+        ('rtt_max', 'REAL'),
+        ('probes_lost', 'INTEGER'),
+        ('probes', 'INTEGER'),
+        ('load_samples', 'INTEGER'),
+        ('load_errors', 'INTEGER'),
+        ('load_stream_errors', 'TEXT'),
+        ('captured_frames', 'INTEGER'),
+        ('capture_file', 'TEXT'),
+        ('traffic', 'TEXT'),
+        ('message', 'TEXT'),
+    )
+
+    def __init__(self, path):
+        self.path = path
+
+        names = [name for name, _ in ResultStore.COLUMNS]
+        self.writer = SqliteWriter(path, "INSERT INTO results (" + ", ".join(names)
+                                   + ") VALUES (" + ", ".join("?" * len(names)) + ")",
+                                   ResultStore.COMMIT_INTERVAL, ResultStore.COMMIT_BATCH)
+
+    def open(self):
+        connection = SqliteWriter.connect(self.path)
+        connection.execute("CREATE TABLE IF NOT EXISTS results (id INTEGER PRIMARY KEY, "
+                           + ", ".join(name + " " + sqlType
+                                       for name, sqlType in ResultStore.COLUMNS) + ")")
+        # databases written by older versions lack the newer columns
+        existing = set(row[1] for row in connection.execute("PRAGMA table_info(results)"))
+        for name, sqlType in ResultStore.COLUMNS:
+            if name not in existing:
+                connection.execute("ALTER TABLE results ADD COLUMN " + name + " " + sqlType)
+        connection.commit()
+        connection.close()
+
+        self.writer.start()
+
+    def record(self, row):
+        """Queues a result; row is a dict keyed by column name, missing columns are
+           stored as NULL."""
+        row.setdefault('recorded_at', time.time())
+        self.writer.put(tuple(row.get(name) for name, _ in ResultStore.COLUMNS))
+
+    def close(self):
+        self.writer.close()
+
+    def rows(self):
+        connection = SqliteWriter.connect(self.path)
+        try:
+            # named, as migrated databases have their columns in another order
+            names = ['id'] + [name for name, _ in ResultStore.COLUMNS]
+            cursor = connection.execute("SELECT " + ", ".join(names)
+                                        + " FROM results ORDER BY id")
+            for values in cursor:
+                yield dict(zip(names, values))
+        finally:
+            connection.close()
+
+    def exportJsonl(self, path):
+        with open(path, "w") as outFile:
+            for row in self.rows():
+                outFile.write(json.dumps(row) + "\n")
+
+    def exportCsv(self, path):
+        with open(path, "w", newline='') as outFile:
+            writer = csv.writer(outFile)
+            names = ['id'] + [name for name, _ in ResultStore.COLUMNS]
+            writer.writerow(names)
+            for row in self.rows():
+                writer.writerow([row[name] for name in names])
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description="Export WRTM Tester results")
+    parser.add_argument('dbPath', type=str,
+                        help='path to the results database')
+    parser.add_argument('-j', '--jsonl', type=str,
+                        help='export the results as JSON lines into the given file',
+                        required=False, default=None)
+    parser.add_argument('-c', '--csv', type=str,
+                        help='export the results as CSV into the given file',
+                        required=False, default=None)
+    args = parser.parse_args(argv[1:])
+
+    store = ResultStore(args.dbPath)
+    if args.jsonl is not None:
+        store.exportJsonl(args.jsonl)
+    if args.csv is not None:
+        store.exportCsv(args.csv)
+    if args.jsonl is None and args.csv is None:
+        for row in store.rows():
+            print(json.dumps(row))
+
+
+if __name__ == '__main__':
+    main(sys.argv)
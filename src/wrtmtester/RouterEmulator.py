@@ -0,0 +1,148 @@
+import argparse
+import asyncio
+import collections
+import random
+import struct
+import sys
+
+from wrtmtester.ControlChannel import ACK, ACK_SEQUENCE, ACK_OK, ACK_UNKNOWN_TEST
+from wrtmtester.PlanCompiler import TEST_PACKET
+
+
+class RouterEmulator(asyncio.DatagramProtocol):
+
+    """WRTM Router Emulator
+
+       Local stand-in for the control side of a router running the WRTM modules, for
+       exercising the tester without hardware. It listens for test definitions on its
+       own address (use one of 127.0.0.0/8 per emulated router, the tester tells
+       routers apart by address; the tester then has to bind 127.0.0.1 with the
+       'controlAddress' option), acks them - echoing the sequence number if
+       echoSequence is set, like a router listed in 'ackSequence' - and, if reinit is
+       set, sends the init broadcast after every stopped test.
+
+       Datagrams are dropped in both directions with probability 'loss' and acks are
+       delayed by 'delay' seconds, to exercise retransmissions. A retransmitted
+       definition is acked again but only acted upon once; without echoSequence, a
+       definition is taken for a retransmission if it repeats the previous one.
+    """
+
+    INIT_MAGIC = 0xFEE17357
+
+    def __init__(self, testerIp, initPort, loss=0.0, delay=0.0, reinit=True,
+                 echoSequence=False, testTypes=None, seed=None):
+        self.testerIp = testerIp
+        self.initPort = initPort
+        self.loss = loss
+        self.delay = delay
+        self.reinit = reinit
+        self.echoSequence = echoSequence
+        self.testTypes = testTypes
+        self.random = random.Random(seed)
+
+        self.transport = None
+        self.sequences = collections.deque(maxlen=1024)
+        self.lastDefinition = None
+        self.received = 0
+        self.handled = 0
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def datagram_received(self, data, addr):
+        self.received += 1
+        if self._lost() or len(data) != TEST_PACKET.size:
+            return
+
+        fields = TEST_PACKET.unpack(data)
+        sequence, testId, stop = fields[0], fields[2], fields[5]
+
+        status = ACK_OK
+        if self.testTypes is not None and testId not in self.testTypes:
+            status = ACK_UNKNOWN_TEST
+
+        ack = ACK.pack(testId, status)
+        if self.echoSequence:
+            ack += ACK_SEQUENCE.pack(sequence)
+        asyncio.get_event_loop().call_later(self.delay, self._sendAck, ack, addr)
+
+        if self.echoSequence:
+            if sequence in self.sequences:
+                return
+            self.sequences.append(sequence)
+        elif data == self.lastDefinition:
+            return
+        self.lastDefinition = data
+        self.handled += 1
+
+        if stop and self.reinit:
+            asyncio.get_event_loop().call_later(self.delay, self._sendInit)
+
+    def _lost(self):
+        return self.loss > 0 and self.random.random() < self.loss
+
+    def _sendAck(self, ack, addr):
+        if not self._lost():
+            self.transport.sendto(ack, addr)
+
+    def _sendInit(self):
+        self.transport.sendto(b'\0\0' + struct.pack("<II", RouterEmulator.INIT_MAGIC,
+                                                   0xFFFFFFFF),
+                              (self.testerIp, self.initPort))
+
+
+async def serve(args):
+    loop = asyncio.get_event_loop()
+    testTypes = None
+    if args.testTypes is not None:
+        testTypes = set(int(x) for x in args.testTypes.split(','))
+
+    transport, emulator = await loop.create_datagram_endpoint(
+        lambda: RouterEmulator(args.tester, args.initPort, args.loss, args.delay,
+                               not args.noreinit, args.echo, testTypes, args.seed),
+        local_addr=(args.address, args.testPort))
+    print("Emulating a router at " + args.address + ":" + str(args.testPort) + ".")
+    try:
+        await loop.create_future()
+    finally:
+        transport.close()
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description="Emulate the control channel of a router "
+                                                 + "running the WRTM modules")
+    parser.add_argument('address', type=str,
+                        help='address to emulate the router at (e.g. 127.0.0.2)')
+    parser.add_argument('-t', '--tester', type=str,
+                        help='address of the tester, for init broadcasts',
+                        required=False, default='127.0.0.1')
+    parser.add_argument('--testPort', type=int, help='test definition port',
+                        required=False, default=7999)
+    parser.add_argument('--initPort', type=int, help='init broadcast port',
+                        required=False, default=4094)
+    parser.add_argument('-l', '--loss', type=float,
+                        help='probability of dropping a datagram (each way)',
+                        required=False, default=0.0)
+    parser.add_argument('-d', '--delay', type=float, help='ack delay in seconds',
+                        required=False, default=0.0)
+    parser.add_argument('--testTypes', type=str,
+                        help='comma separated list of known test types (all by default)',
+                        required=False, default=None)
+    parser.add_argument('--noreinit', action='store_true',
+                        help='do not send init broadcasts after stopped tests',
+                        required=False, default=False)
+    parser.add_argument('--echo', action='store_true',
+                        help='echo sequence numbers in acks',
+                        required=False, default=False)
+    parser.add_argument('--seed', type=int, help='seed for the packet loss',
+                        required=False, default=None)
+    args = parser.parse_args(argv[1:])
+
+    try:
+        asyncio.run(serve(args))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main(sys.argv)
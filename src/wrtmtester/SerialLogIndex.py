@@ -0,0 +1,191 @@
+import argparse
+import bisect
+import gzip
+import mmap
+import os
+import struct
+import sys
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+PHASES = ('ping', 'send', 'ack', 'run', 'stop', 'ready', 'reboot', 'done')
+
+COMPRESSIONS = ('none', 'gzip', 'zstd')
+COMPRESSION_SUFFIXES = ('', '.gz', '.zst')
+
+INDEX_MAGIC = b'WRTMIDX2'
+INDEX_HEADER = struct.Struct('<8sBB6x')
+INDEX_RECORD = struct.Struct('<IHHdQ')
+
+
+def indexPath(logPath):
+    return logPath + '.idx'
+
+
+def segmentPath(logPath, segment, compression, rotating):
+    # an unrotated, uncompressed log keeps its plain name
+    if rotating:
+        base, ext = os.path.splitext(logPath)
+        logPath = base + "." + "{:04d}".format(segment) + ext
+    return logPath + COMPRESSION_SUFFIXES[COMPRESSIONS.index(compression)]
+
+
+def openSegment(path, compression, mode):
+    if compression == 'gzip':
+        return gzip.open(path, mode)
+    if compression == 'zstd':
+        if zstandard is None:
+            raise RuntimeError("Reading '" + path + "' requires the zstandard module.")
+        if mode == 'rb':
+            return zstandard.ZstdDecompressor().stream_reader(open(path, 'rb'),
+                                                              closefd=True)
+        return zstandard.ZstdCompressor().stream_writer(open(path, 'wb'), closefd=True)
+    return open(path, mode)
+
+
+class SerialLogIndexWriter(object):
+
+    """WRTM Serial Log Index Writer
+
+       Appends fixed-size records (test number, phase, log segment, monotonic
+       timestamp, uncompressed byte offset of the phase marker within the segment) to
+       the index file kept next to a serial log.
+    """
+
+    def __init__(self, logPath, compression='none', rotating=False):
+        self.indexFile = open(indexPath(logPath), "wb")
+        self.indexFile.write(INDEX_HEADER.pack(INDEX_MAGIC, COMPRESSIONS.index(compression),
+                                               int(rotating)))
+
+    def append(self, testIter, phase, segment, timestamp, offset):
+        if phase in PHASES:
+            phaseCode = PHASES.index(phase)
+        else:
+            phaseCode = len(PHASES)
+        self.indexFile.write(INDEX_RECORD.pack(testIter, phaseCode, segment, timestamp,
+                                               offset))
+
+    def flush(self):
+        self.indexFile.flush()
+
+    def close(self):
+        self.indexFile.close()
+
+
+class SerialLogIndex(object):
+
+    """WRTM Serial Log Index
+
+       Random access to the console output of single tests in a serial log. The index
+       is memory-mapped and binary searched (test numbers never decrease within a
+       plan), and the slice between the first marker of a test and the first marker of
+       the next one is read from the log with a single seek, so the cost of extracting
+       a test does not depend on the size of the log.
+
+       Rotated logs never split a test between segments. For compressed segments the
+       seek has to decompress the segment up to the test, which is bounded by the
+       rotation size.
+    """
+
+    def __init__(self, logPath):
+        self.logPath = logPath
+        self.indexFile = open(indexPath(logPath), "rb")
+        header = self.indexFile.read(INDEX_HEADER.size)
+        if len(header) < INDEX_HEADER.size or header[:len(INDEX_MAGIC)] != INDEX_MAGIC:
+            raise RuntimeError("'" + indexPath(logPath) + "' is not a serial log index.")
+        _, compressionCode, rotating = INDEX_HEADER.unpack(header)
+        self.compression = COMPRESSIONS[compressionCode]
+        self.rotating = bool(rotating)
+
+        if os.fstat(self.indexFile.fileno()).st_size == INDEX_HEADER.size:
+            self.index = b''
+        else:
+            self.index = mmap.mmap(self.indexFile.fileno(), 0, access=mmap.ACCESS_READ)
+
+        self.count = max(len(self.index) - INDEX_HEADER.size, 0) // INDEX_RECORD.size
+        self.tests = _TestColumn(self)
+
+    def close(self):
+        if isinstance(self.index, mmap.mmap):
+            self.index.close()
+        self.indexFile.close()
+
+    def record(self, i):
+        testIter, phaseCode, segment, timestamp, offset = INDEX_RECORD.unpack_from(
+            self.index, INDEX_HEADER.size + i * INDEX_RECORD.size)
+        if phaseCode < len(PHASES):
+            phase = PHASES[phaseCode]
+        else:
+            phase = '?'
+        return testIter, phase, segment, timestamp, offset
+
+    def records(self):
+        for i in range(0, self.count):
+            yield self.record(i)
+
+    def findTest(self, testIter):
+        """Returns the segment and the (start, end) byte range of a test in it; end is
+           None for the last test in the segment."""
+        first = bisect.bisect_left(self.tests, testIter)
+        if first == self.count or self.tests[first] != testIter:
+            raise KeyError("Test #" + str(testIter) + " is not in the index.")
+
+        last = bisect.bisect_right(self.tests, testIter)
+        segment, start = self.record(first)[2], self.record(first)[4]
+        if last == self.count or self.record(last)[2] != segment:
+            return segment, start, None
+        return segment, start, self.record(last)[4]
+
+    def extract(self, testIter):
+        segment, start, end = self.findTest(testIter)
+        path = segmentPath(self.logPath, segment, self.compression, self.rotating)
+        with openSegment(path, self.compression, "rb") as logFile:
+            logFile.seek(start)
+            if end is None:
+                return logFile.read()
+            return logFile.read(end - start)
+
+
+class _TestColumn(object):
+    # sequence view of the test numbers in the index, for bisect
+    def __init__(self, index):
+        self.index = index
+
+    def __len__(self):
+        return self.index.count
+
+    def __getitem__(self, i):
+        return struct.unpack_from('<I', self.index.index,
+                                  INDEX_HEADER.size + i * INDEX_RECORD.size)[0]
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description="Extract the console output of a single "
+                                                 + "test from an indexed serial log")
+    parser.add_argument('logPath', type=str,
+                        help='path to the serial log')
+    parser.add_argument('test', type=int, nargs='?',
+                        help='number of the test to extract')
+    parser.add_argument('-l', '--list', action='store_true',
+                        help='list the phase markers recorded in the index',
+                        required=False, default=False)
+    args = parser.parse_args(argv[1:])
+
+    index = SerialLogIndex(args.logPath)
+    try:
+        if args.list or args.test is None:
+            for testIter, phase, segment, timestamp, offset in index.records():
+                print("#" + str(testIter) + " " + phase + " @ " + "{:.6f}".format(timestamp)
+                      + " segment " + str(segment) + " offset " + str(offset))
+        else:
+            sys.stdout.buffer.write(index.extract(args.test))
+    finally:
+        index.close()
+
+
+if __name__ == '__main__':
+    main(sys.argv)
@@ -0,0 +1,198 @@
+import threading
+import time
+
+from wrtmtester.SerialLogIndex import SerialLogIndexWriter
+from wrtmtester.SerialLogIndex import openSegment, segmentPath, zstandard
+
+
+def parseSize(value):
+    """Parses a byte count with an optional k/M/G suffix."""
+    value = str(value).strip()
+    multipliers = {'k': 1 << 10, 'K': 1 << 10, 'M': 1 << 20, 'G': 1 << 30}
+    if value[-1:] in multipliers:
+        return int(value[:-1]) * multipliers[value[-1]]
+    return int(value)
+
+
+class SerialLogWriter(object):
+
+    """WRTM Serial Log Writer
+
+       Stores the serial console output on disk from a thread of its own. The reader
+       only appends the bytes it got from the port (and the phase markers) to a
+       pending buffer, under a lock the writer thread only takes to swap the buffer
+       out, so neither disk I/O nor compression ever stalls it - nor the event loop it
+       may be reading on.
+
+       The log can be compressed on the fly ('gzip', or 'zstd' when the zstandard
+       module is installed - gzip is used otherwise) and rotated into numbered
+       segments once a segment holds rotateSize uncompressed bytes or rotateTests
+       tests. Segments are only ever switched between tests, so a test is always
+       stored in one piece.
+
+       Offsets and rotation are accounted for when the data is queued, so mark() and
+       position() can tell where in the log a test's output is going to end up
+       without waiting for the writer thread.
+
+       Chunks are coalesced as they are queued, so pending output takes what its bytes
+       take and a writer that fell behind catches up in large writes. At most
+       MAX_PENDING bytes are held, well over an hour of console output at 115200 baud;
+       should the disk fall that far behind, console bytes are dropped (phase markers
+       never are) and a note of how many goes into the log where they were lost.
+
+       The writer thread is a daemon, so a runner failing before close() cannot keep
+       the process alive; close() flushes whatever is queued and waits for it.
+    """
+
+    MAX_PENDING = 64 << 20
+    WRITE_BUFFER = 65536
+    FLUSH_INTERVAL = 1.0
+
+    def __init__(self, logPath, compression='none', rotateSize=0, rotateTests=0):
+        if compression == 'zstd' and zstandard is None:
+            print("zstandard module not available, compressing the serial log with gzip.")
+            compression = 'gzip'
+
+        self.logPath = logPath
+        self.compression = compression
+        self.rotateSize = rotateSize
+        self.rotateTests = rotateTests
+        self.rotating = rotateSize > 0 or rotateTests > 0
+
+        # data and index records per segment, a segment after the first is rotated to
+        self.pending = [(bytearray(), [])]
+        # bytes queued and not yet written, and console bytes dropped since the last
+        # write that made it
+        self.pendingBytes = 0
+        self.dropped = 0
+        self.closing = False
+        self.thread = None
+        # both the serial reader and the event loop queue data
+        self.lock = threading.Lock()
+        self.condition = threading.Condition(self.lock)
+
+        self.segment = 0
+        self.fileSegment = 0
+        self.segmentFile = None
+        self.written = 0
+        self.segmentTests = 0
+        self.lastTest = None
+        self.index = None
+        self.lastFlush = 0
+
+    def open(self, header):
+        self.index = SerialLogIndexWriter(self.logPath, self.compression, self.rotating)
+        self._openSegment()
+
+        self.thread = threading.Thread(target=self._threadFunc)
+        self.thread.daemon = True
+        self.thread.start()
+
+        self.write(header)
+
+    def write(self, data):
+        with self.lock:
+            if self.pendingBytes + len(data) > SerialLogWriter.MAX_PENDING:
+                self.dropped += len(data)
+                return
+            self._queueDropped()
+            self._queue(data)
+
+    def mark(self, testIter, phase, timestamp, marker):
+        """Queues a phase marker; returns the (segment, offset) it will be stored at."""
+        with self.lock:
+            # lost output belongs to the phase before the marker
+            self._queueDropped()
+            if testIter != self.lastTest:
+                if self.lastTest is not None and self._segmentFull():
+                    self.segment += 1
+                    self.written = 0
+                    self.segmentTests = 0
+                    self.pending.append((bytearray(), []))
+                self.lastTest = testIter
+                self.segmentTests += 1
+
+            record = (testIter, phase, self.segment, timestamp, self.written)
+            self._queue(marker, record)
+            return self.segment, record[4]
+
+    def position(self):
+        with self.lock:
+            return self.segment, self.written
+
+    def close(self):
+        if self.thread is None:
+            return
+        with self.condition:
+            self._queueDropped()
+            self.closing = True
+            self.condition.notify()
+        self.thread.join()
+        self.thread = None
+
+    def _queue(self, data, record=None):
+        # called with the lock held
+        chunk, records = self.pending[-1]
+        if record is not None:
+            records.append(record)
+        chunk += data
+        self.written += len(data)
+        self.pendingBytes += len(data)
+        self.condition.notify()
+
+    def _queueDropped(self):
+        if self.dropped > 0:
+            self._queue(bytes("\n[WRTM " + str(self.dropped) + " console bytes dropped, the "
+                              + "log writer fell behind]\n", 'utf-8'))
+            self.dropped = 0
+
+    def _threadFunc(self):
+        self.lastFlush = time.monotonic()
+        closing = False
+        while not closing:
+            with self.condition:
+                if len(self.pending) == 1 and len(self.pending[0][0]) == 0 \
+                        and not self.closing:
+                    self.condition.wait(SerialLogWriter.FLUSH_INTERVAL)
+                pending = self.pending
+                self.pending = [(bytearray(), [])]
+                closing = self.closing
+
+            written = 0
+            for i, (chunk, records) in enumerate(pending):
+                if i > 0:
+                    self._rotate()
+                for record in records:
+                    self.index.append(*record)
+                if len(chunk) > 0:
+                    self.segmentFile.write(chunk)
+                    written += len(chunk)
+            if written > 0:
+                with self.lock:
+                    self.pendingBytes -= written
+
+            now = time.monotonic()
+            if now - self.lastFlush >= SerialLogWriter.FLUSH_INTERVAL:
+                self.segmentFile.flush()
+                self.index.flush()
+                self.lastFlush = now
+
+        self.segmentFile.close()
+        self.index.close()
+
+    def _segmentFull(self):
+        if self.rotateSize > 0 and self.written >= self.rotateSize:
+            return True
+        return self.rotateTests > 0 and self.segmentTests >= self.rotateTests
+
+    def _rotate(self):
+        self.segmentFile.close()
+        self.fileSegment += 1
+        self._openSegment()
+
+    def _openSegment(self):
+        path = segmentPath(self.logPath, self.fileSegment, self.compression, self.rotating)
+        if self.compression == 'none':
+            self.segmentFile = open(path, "wb", buffering=SerialLogWriter.WRITE_BUFFER)
+        else:
+            self.segmentFile = openSegment(path, self.compression, "wb")
@@ -1,19 +1,53 @@
+import asyncio
+import codecs
 import serial
 import time
 import threading
 
+from wrtmtester.SerialLogWriter import SerialLogWriter
+
 class SerialReader(object):
+
+    """WRTM Serial Reader
+
+       Captures the router's serial console into a log file. The port is read in
+       blocks of whatever the driver has buffered; the raw bytes are handed to a
+       SerialLogWriter exactly as received (it stores, compresses and rotates the log
+       on its own thread), while an incremental UTF-8 decoder (carrying split
+       multibyte sequences over to the next read) feeds the console and listeners.
+
+       Phase markers can be put into the log with mark(); the byte offset of each one
+       is recorded in an index file next to the log (see SerialLogIndex), so that the
+       output of a single test can be extracted without reading the whole log.
+
+       Closing takes in what the router still sends, waiting up to DRAIN_TIMEOUT
+       seconds for it, in an executor, so the event loop keeps running meanwhile.
+    """
+
+    READ_SIZE = 4096
+    DRAIN_TIMEOUT = 2
+
     def __init__(self, verbose=False):
         self.handle = None
         self.doLoop = False
         self.thread = None
         self.outputFile = None
+        self.logPath = None
         self.verbose = verbose
+        self.loop = None
+        self.decoder = None
+        self.listeners = []
+        # bytes read over all logs, written by whichever reads the port
+        self.received = 0
 
     def setVerbose(self, verbose):
         self.verbose = verbose
 
-    def init(self, device, outfile):
+    def addListener(self, callback):
+        # called with every chunk of decoded console output, from the reading thread
+        self.listeners.append(callback)
+
+    def init(self, device, outfile, loop=None, compression='none', rotateSize=0, rotateTests=0):
         sd = serial.Serial()
         sd.port = device
         sd.baudrate = 115200
@@ -29,49 +63,93 @@ class SerialReader(object):
         self.doLoop = True
 
         timeStr = time.strftime("%d-%m-%Y_%H-%M-%S", time.gmtime())
-        self.outputFile = open(outfile, "w+")
+        self.logPath = outfile
+        self.outputFile = SerialLogWriter(outfile, compression, rotateSize, rotateTests)
         logIntroLine1 = "WRTMasher Router Serial Log\n"
         logIntroLine2 = "Opened " + device + " @ " + timeStr + "\n"
         logIntroLine3 = "*" * (len(logIntroLine2) - 1) + "\n"
         logIntro = logIntroLine1 + logIntroLine2 + logIntroLine3
-        self.outputFile.write(logIntro)
+        self.outputFile.open(bytes(logIntro, 'utf-8'))
+        self.decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+
+        try:
+            self.handle.open()
+            self.handle.flushInput()
+            self.handle.flushOutput()
+        except Exception:
+            # without a port there is nothing to log, don't leave the writer behind
+            self.outputFile.close()
+            self.outputFile = None
+            self.handle = None
+            raise
 
-        self.handle.open()
-        self.handle.flushInput()
-        self.handle.flushOutput()
+        # with an event loop at hand, let its selector service the port;
+        # otherwise fall back to a dedicated reader thread
+        if loop is not None and hasattr(self.handle, 'fileno'):
+            self.loop = loop
+            self.handle.timeout = 0
+            self.loop.add_reader(self.handle.fileno(), self._readerFunc)
+            return
 
         self.thread = threading.Thread(target=self._threadFunc)
         self.thread.daemon = False
         self.thread.start()
 
-    def close(self):
+    async def close(self):
+        if self.handle is None:
+            return
         self.doLoop = False
-        self.thread.join()
-        self.outputFile.close()
+        loop = asyncio.get_event_loop()
+        try:
+            if self.loop is not None:
+                self.loop.remove_reader(self.handle.fileno())
+                self.loop = None
+                # only the blocking read leaves the loop, the output is consumed here
+                self._consume(await loop.run_in_executor(None, self._readRest), final=True)
+            else:
+                await loop.run_in_executor(None, self.thread.join)
+        finally:
+            self.handle.close()
+            self.handle = None
+            self.outputFile.close()
 
-    def _threadFunc(self):
-        x = bytes()
-        while self.doLoop:
-            x += self.handle.read()
-            if len(x) == 0:
-                continue
+    def mark(self, testIter, phase):
+        timestamp = time.monotonic()
+        marker = bytes("\n[WRTM " + "{:.6f}".format(timestamp) + "] test #" + str(testIter)
+                       + " " + phase + "\n", 'utf-8')
+
+        return self.outputFile.mark(testIter, phase, timestamp, marker)
+
+    def position(self):
+        return self.outputFile.position()
 
-            try:
-                xstr = x.decode('utf8')
-            except UnicodeDecodeError:
-                x = x[:-1]  # TODO: losing chars?
-                continue
+    def _readerFunc(self):
+        self._consume(self.handle.read(self.handle.in_waiting or SerialReader.READ_SIZE))
 
+    def _consume(self, x, final=False):
+        if len(x) != 0:
+            self.outputFile.write(x)
+            self.received += len(x)
+
+        xstr = self.decoder.decode(x, final)
+        if len(xstr) != 0:
             if self.verbose:
                 print(xstr, end="")
 
-            self.outputFile.write(xstr)
+            for callback in self.listeners:
+                callback(xstr)
+
+    def _readRest(self):
+        self.handle.timeout = SerialReader.DRAIN_TIMEOUT
+        return self.handle.read(max(self.handle.in_waiting, 1))
 
-            x = bytes()
+    def _threadFunc(self):
+        while self.doLoop:
+            # block for the first byte (up to the timeout), then take all that's buffered
+            x = self.handle.read(1)
+            if len(x) != 0:
+                x += self.handle.read(self.handle.in_waiting)
+            self._consume(x)
 
         # read the rest
-        self.handle.timeout = 2
-        xstr = (x + self.handle.read()).decode('utf8')
-        if self.verbose:
-            print(xstr, end="")
-        self.outputFile.write(xstr)
+        self._consume(self._readRest(), final=True)
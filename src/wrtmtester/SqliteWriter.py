@@ -0,0 +1,82 @@
+import queue
+import sqlite3
+import threading
+import time
+
+
+class SqliteWriter(object):
+
+    """WRTM SQLite Writer
+
+       Writes the rows queued by put() into an SQLite database (in WAL mode) with a
+       single statement, on a thread with a connection of its own. The rows are
+       committed in groups - every 'interval' seconds or 'batch' rows, whichever comes
+       first - so queueing one costs the caller nothing and a crash loses at most the
+       last interval. Shared by the ResultStore and the OutcomeCache.
+
+       The thread is a daemon, so it cannot keep the process alive should the writer
+       not be closed; close() writes the queued rows out and waits for it.
+    """
+
+    def __init__(self, path, sql, interval=1.0, batch=256):
+        self.path = path
+        self.sql = sql
+        self.interval = interval
+        self.batch = batch
+        self.queue = queue.Queue()
+        self.thread = None
+
+    @staticmethod
+    def connect(path):
+        connection = sqlite3.connect(path)
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute("PRAGMA synchronous=NORMAL")
+        return connection
+
+    def start(self):
+        self.thread = threading.Thread(target=self._threadFunc)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def put(self, row):
+        self.queue.put(row)
+
+    def close(self):
+        if self.thread is None:
+            return
+        self.queue.put(None)
+        self.thread.join()
+        self.thread = None
+
+    def _threadFunc(self):
+        connection = SqliteWriter.connect(self.path)
+        batch = []
+        deadline = None
+        done = False
+
+        while not done:
+            if deadline is None:
+                timeout = None
+            else:
+                timeout = max(deadline - time.monotonic(), 0)
+
+            try:
+                row = self.queue.get(timeout=timeout)
+            except queue.Empty:
+                row = False
+
+            if row is None:
+                done = True
+            elif row:
+                batch.append(row)
+                if deadline is None:
+                    deadline = time.monotonic() + self.interval
+
+            if len(batch) > 0 and (done or len(batch) >= self.batch
+                                   or time.monotonic() >= deadline):
+                connection.executemany(self.sql, batch)
+                connection.commit()
+                batch = []
+                deadline = None
+
+        connection.close()
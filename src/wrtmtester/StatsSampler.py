@@ -0,0 +1,120 @@
+import array
+import asyncio
+import time
+
+
+class StatsSampler(object):
+
+    """WRTM Stats Sampler
+
+       Polls the packet integrity error counters of the N2X stream groups every
+       'interval' seconds while the load streams are running, on a drift-free
+       schedule like the LivenessProbe. The N2X calls go through the N2xExecutor that
+       serializes all of them, as background calls, so neither the event loop (and
+       with it the test state machines) nor starting or stopping the load waits for
+       a sample; trigger() takes an extra sample right away, e.g. when a test starts
+       or ends.
+
+       Samples are stored in a ring buffer of 'capacity' entries: the times in one
+       array and the counters of all stream groups, one row per sample, in another.
+       Samples are stamped with the (wall clock) time they were requested at, so they
+       line up with the start and stop times of the tests; delta() sums the counter
+       increases over a test, taking a counter that went down for one that was reset
+       (the N2X resets them when the load streams are started).
+    """
+
+    def __init__(self, n2x, executor, interval=1.0, capacity=3600):
+        self.n2x = n2x
+        self.executor = executor
+        self.interval = interval
+        self.capacity = capacity
+
+        self.times = array.array('d', bytes(8 * capacity))
+        self.counters = None
+        self.streams = 0
+        self.count = 0
+
+        self.loop = None
+        self.task = None
+        self.samples = set()
+
+    def start(self):
+        self.loop = asyncio.get_event_loop()
+        self.task = self.loop.create_task(self._scheduleFunc())
+
+    async def stop(self):
+        self.task.cancel()
+        await asyncio.gather(self.task, *self.samples, return_exceptions=True)
+
+    def trigger(self):
+        if self.loop is None or not self.n2x.running:
+            return
+        sample = self.loop.create_task(self._sample(time.time()))
+        self.samples.add(sample)
+        sample.add_done_callback(self.samples.discard)
+
+    def delta(self, startTime, stopTime):
+        """Returns the number of samples taken between startTime and stopTime and the
+           increase of every counter over that time (counted from the last sample
+           before startTime), or None if there were no samples at all or the ones
+           from the start of the test were overwritten already."""
+        if self.count == 0:
+            return None
+
+        first = max(0, self.count - self.capacity)
+        begin = self._lastAtOrBefore(startTime, first)
+        end = self._lastAtOrBefore(stopTime, first)
+        if begin < first and first > 0:
+            return None
+
+        deltas = [0] * self.streams
+        samples = 0
+        for i in range(max(begin, first) + 1, end + 1):
+            previous = (i - 1) % self.capacity * self.streams
+            current = i % self.capacity * self.streams
+            for stream in range(self.streams):
+                value = self.counters[current + stream]
+                if value >= self.counters[previous + stream]:
+                    value -= self.counters[previous + stream]
+                deltas[stream] += value
+            samples += 1
+
+        # the first sample of the test has nothing to count from
+        if begin < first <= end:
+            samples += 1
+        return samples, deltas
+
+    def _lastAtOrBefore(self, t, first):
+        # logical index of the last sample taken at or before t, first - 1 if none
+        low, high = first, self.count
+        while low < high:
+            middle = (low + high) // 2
+            if self.times[middle % self.capacity] <= t:
+                low = middle + 1
+            else:
+                high = middle
+        return low - 1
+
+    async def _scheduleFunc(self):
+        start = self.loop.time()
+        k = 0
+        while True:
+            k += 1
+            await asyncio.sleep(max(0, start + k * self.interval - self.loop.time()))
+            if self.n2x.running:
+                await self._sample(time.time())
+
+    async def _sample(self, requestedAt):
+        counters = await asyncio.wrap_future(self.executor.background(self.n2x.collectLoadStats))
+        if counters is None or len(counters) == 0:
+            return
+
+        if self.counters is None:
+            self.streams = len(counters)
+            self.counters = array.array('q', bytes(8 * self.capacity * self.streams))
+
+        slot = self.count % self.capacity
+        self.times[slot] = requestedAt
+        self.counters[slot * self.streams:(slot + 1) * self.streams] = \
+            array.array('q', counters[:self.streams])
+        self.count += 1
@@ -1,5 +1,8 @@
+import bisect
 from configparser import SafeConfigParser
 
+from wrtmtester.PlanCompiler import PlanCompiler
+
 
 class TestPlanParser(object):
     
@@ -13,17 +16,59 @@ class TestPlanParser(object):
 
        Address/offset can either be an immediate value or a difference from the last
        returned value (in the form of +x or -x).
+       Tests are numbered consecutively (from 1) across all loops of a section.
+
+       A single line can also describe a sweep: the offset and mask accept ranges
+       (start:stop[:step], stop excluded) and lists ({a,b,c}), and the interface
+       accepts lists ({eth0,br-lan}). The line then stands for every combination of
+       them (interfaces outermost, masks innermost). Numbers may be given in hex. Sweeps
+       are never expanded in memory - counting tests and fetching any one of them
+       does not depend on the size of the sweep (see TestSweep).
 
        Additionally the 'main' section specifies the address of the device under test 
        ('dut') and the address of the N2X probe ('n2x'). Comments are allowed in separate 
        lines starting with a # (hashtag) or a ; (semicolon).
+
+       Several routers can be tested at once by listing them in a 'routers' option of
+       the 'main' section, one per line:
+
+           router-ip [serial-device [ups-outlet]]
+
+       A plan section is bound to one of them with a 'router' option holding its IP;
+       sections without one are dealt out to the routers in a round-robin fashion.
+       If 'routers' is missing, the single 'routerIp'/'tty' pair is used instead.
+       The UPS powering the routers is described in an optional 'ups' section.
+
+       Liveness probing during a test is tuned with 'probeInterval' and 'probeTimeout'
+       (in seconds) and 'probeLossThreshold' (consecutive lost probes before the test
+       is failed), either in 'main' or per plan section.
+
+       Sections are compiled (see PlanCompiler) into ready-to-send test definitions
+       the first time they are needed; getCompiledPlan() returns the result.
+
+       The N2X load streams can be changed per section (or in 'main') with the
+       TRAFFIC_OPTIONS: 'load' (rate in Mbit/s, with an optional k/M/G suffix, or in
+       N2X units), 'loadMode' (profile mode), 'loadHeaders' (comma separated PDU
+       headers), 'loadFill' (hex payload pattern), 'loadSourcePort' and
+       'loadDestinationPort' (of the TCP/UDP header). A plan line may override them
+       for its tests with key=value tokens after the mask, e.g. 'load=20M'.
     """
 
+    DEFAULT_TTY = '/dev/ttyAMA0'
+
+    RESERVED_SECTIONS = ('main', 'ups')
+
+    TRAFFIC_OPTIONS = ('load', 'loadMode', 'loadHeaders', 'loadFill', 'loadSourcePort',
+                       'loadDestinationPort')
+
     def __init__(self):
         self.parser = SafeConfigParser()
         self.loaded = False
         self.loadedPath = None
         self.testTypes = {}
+        self.testTypesPath = None
+        self.sweeps = {}
+        self.compiledPlans = {}
 
     def load(self, path):
         if len(self.parser.read(path)) < 1:
@@ -32,6 +77,7 @@ class TestPlanParser(object):
         self.loadedPath = path
 
     def loadTestTypes(self, fileName):
+        self.testTypesPath = fileName
         testsFile = open(fileName)
         for testType in testsFile:
             splitarray = testType.split(' ')
@@ -40,54 +86,285 @@ class TestPlanParser(object):
             testDescription = ' '.join(splitarray[2:])
             self.testTypes[testId] = (testContinuous, testDescription)
 
+    def isContinuousTest(self, testId):
+        return testId in self.testTypes and self.testTypes[testId][0] == 1
+
     def sections(self):
         return self.parser.sections()
 
+    def getPlanOption(self, name, option, default=None):
+        # plan sections may override options set in 'main'
+        for section in (name, 'main'):
+            if self.parser.has_option(section, option):
+                return self.parser[section][option]
+        return default
+
+    def getTrafficOptions(self, name):
+        traffic = {}
+        for option in TestPlanParser.TRAFFIC_OPTIONS:
+            value = self.getPlanOption(name, option)
+            if value is not None:
+                traffic[option] = value
+        return traffic
+
+    def getTestPlans(self):
+        return [x for x in self.parser.sections()
+                if x not in TestPlanParser.RESERVED_SECTIONS]
+
+    def getRouters(self):
+        routers = []
+        if self.parser.has_option('main', 'routers'):
+            for line in self.parser['main']['routers'].split('\n'):
+                routerTuple = line.split()
+                if len(routerTuple) == 0:
+                    continue
+                tty = TestPlanParser.DEFAULT_TTY
+                outlet = None
+                if len(routerTuple) > 1:
+                    tty = routerTuple[1]
+                if len(routerTuple) > 2:
+                    outlet = int(routerTuple[2])
+                routers.append((routerTuple[0], tty, outlet))
+        else:
+            if self.parser.has_option('main', 'tty'):
+                tty = self.parser['main']['tty']
+            else:
+                tty = TestPlanParser.DEFAULT_TTY
+            routers.append((self.parser['main']['routerIp'], tty, None))
+
+        # without an outlet the whole UPS is switched, taking every other router down
+        if len(routers) > 1:
+            for routerIp, tty, outlet in routers:
+                if outlet is None:
+                    raise RuntimeError("Router " + routerIp + " has no UPS outlet; each "
+                                       + "of several routers needs its own.")
+
+        return routers
+
+    def getPlanAssignments(self):
+        routers = [router[0] for router in self.getRouters()]
+        assignments = dict((routerIp, []) for routerIp in routers)
+
+        nextRouter = 0
+        for name in self.getTestPlans():
+            if self.parser.has_option(name, 'router'):
+                routerIp = self.parser[name]['router']
+                if routerIp not in assignments:
+                    raise RuntimeError("Test plan '" + name + "' is assigned to an unknown "
+                                       + "router (" + routerIp + ").")
+            else:
+                routerIp = routers[nextRouter % len(routers)]
+                nextRouter += 1
+            assignments[routerIp].append(name)
+
+        return assignments
+
     def getListOfTests(self):
         if self.loaded:
             return self.parser.sections()
         return None
 
     def getNumberOfTestCases(self, name):
-        if self.parser.has_option(name, 'loop'):
-            loops = self.parser.getint(name, 'loop')
+        if name in self.compiledPlans:
+            return len(self.compiledPlans[name])
+        return len(self.getTestSweep(name))
+
+    def getTestSweep(self, name):
+        if name not in self.sweeps:
+            if self.parser.has_option(name, 'loop'):
+                loops = self.parser.getint(name, 'loop')
+            else:
+                loops = 1
+
+            if self.parser.has_option(name, 'offsetStep'):
+                offsetStep = self.parser.getint(name, 'offsetStep')
+            else:
+                offsetStep = 0
+
+            lines = [x for x in self.parser[name]['plan'].split('\n') if x.strip() != '']
+            self.sweeps[name] = TestSweep(name, lines, loops, offsetStep)
+        return self.sweeps[name]
+
+    def getCompiledPlan(self, name):
+        if name not in self.compiledPlans:
+            self.compiledPlans[name] = PlanCompiler(self).compile(name)
+        return self.compiledPlans[name]
+
+    def getTestGenerator(self, name=None, start=1):
+        # tests are numbered 1..N across all loops, the ones before 'start' are skipped
+        sweep = self.getTestSweep(name)
+        for i in range(start - 1, len(sweep)):
+            yield sweep[i]
+
+
+class _PlanLine(object):
+    # one line of a plan; each field is a sequence (range or tuple) of its values
+    def __init__(self, testId, interfaces, duration, offsets, relative, masks, traffic):
+        self.testId = testId
+        self.interfaces = interfaces
+        self.duration = duration
+        self.offsets = offsets
+        self.relative = relative
+        self.masks = masks
+        self.traffic = traffic
+        self.count = len(interfaces) * len(offsets) * len(masks)
+        # offset of a relative line in loop 'it' is a + b * it (or loop start + a)
+        self.fromStart = False
+        self.a = 0
+        self.b = 0
+
+
+class TestSweep(object):
+
+    """WRTM Test Sweep
+
+       Lazy sequence of the tests of a plan section, including all its loops. Only
+       the plan lines are kept; a test is computed from the line it falls into when
+       indexed (a binary search over the lines, then plain arithmetic), so a line
+       standing for a sweep of any size costs the same as a single test.
+
+       Relative offsets (+x/-x) carry over from the last test of the previous line and
+       loop. Their value in loop 'it' is resolved to an affine function of 'it' up
+       front, so indexing never replays the plan.
+    """
+
+    def __init__(self, name, lines, loops, offsetStep):
+        self.name = name
+        self.loops = loops
+        self.offsetStep = offsetStep
+        self.lines = []
+        self.ends = []
+
+        total = 0
+        for i, line in enumerate(lines):
+            try:
+                planLine = self._parseLine(line)
+            except (ValueError, IndexError) as e:
+                raise RuntimeError("Line " + str(i + 1) + " of plan '" + name + "' is "
+                                   + "malformed (" + str(e) + ").")
+            if planLine.count == 0:
+                raise RuntimeError("Line " + str(i + 1) + " of plan '" + name + "' is "
+                                   + "an empty sweep.")
+            total += planLine.count
+            self.lines.append(planLine)
+            self.ends.append(total)
+        self.perLoop = total
+
+        self._resolveRelative()
+
+    def __len__(self):
+        return self.perLoop * self.loops
+
+    def __getitem__(self, i):
+        if i < 0:
+            i += len(self)
+        it, line, k = self._locate(i)
+
+        k, maskIndex = divmod(k, len(line.masks))
+        interfaceIndex, offsetIndex = divmod(k, len(line.offsets))
+
+        if line.relative:
+            offset = self._relativeOffset(line, it)
         else:
-            loops = 1
+            offset = line.offsets[offsetIndex] + it * self.offsetStep
+
+        return [i + 1,
+                line.testId,
+                line.interfaces[interfaceIndex],
+                line.duration,
+                offset,
+                line.masks[maskIndex]]
+
+    def traffic(self, i):
+        """Returns the traffic overrides of the i-th test's line."""
+        return self._locate(i)[1].traffic
 
-        return len(self.parser[name]['plan'].split('\n')[1:]) * loops
+    def _locate(self, i):
+        # loop, line and index within the line of the i-th test
+        if i < 0 or i >= len(self):
+            raise IndexError("Test #" + str(i + 1) + " is not in plan '" + self.name + "'.")
 
-    def getTestGenerator(self, name=None):
-        if self.parser.has_option(name, 'loop'):
-            loops = self.parser.getint(name, 'loop')
+        it, k = divmod(i, self.perLoop)
+        n = bisect.bisect_right(self.ends, k)
+        if n > 0:
+            k -= self.ends[n - 1]
+        return it, self.lines[n], k
+
+    def _parseLine(self, line):
+        testTuple = [x for x in line.split() if '=' not in x]
+        traffic = {}
+        for token in line.split():
+            if '=' not in token:
+                continue
+            key, _, value = token.partition('=')
+            if key not in TestPlanParser.TRAFFIC_OPTIONS:
+                raise ValueError("unknown traffic option '" + key + "'")
+            traffic[key] = value
+
+        relative = testTuple[3][0] == '+' or testTuple[3][0] == '-'
+        if relative:
+            offsets = (_parseInt(testTuple[3]),)
         else:
-            loops = 1
+            offsets = _parseSequence(testTuple[3])
 
-        if self.parser.has_option(name, 'offsetStep'):
-            offsetStep = self.parser.getint(name, 'offsetStep')
+        if testTuple[1][0] == '{' and testTuple[1][-1] == '}':
+            interfaces = tuple(x.strip() for x in testTuple[1][1:-1].split(',')
+                               if x.strip() != '')
         else:
-            offsetStep = 0
-
-        tests = self.parser[name]['plan'].split('\n')[1:]
-        offset = 0
-
-        for it in range(0, loops):
-            for i in range(0, len(tests)):
-                testTuple = tests[i].split(' ')
-                if testTuple[3][0] == '+' or testTuple[3][0] == '-':
-                    offset += int(testTuple[3][0])
-                else:
-                    offset = int(testTuple[3][0]) + it * offsetStep
-                
-                testTuple[3] = offset
-
-                yield self.parseTestLine(i+1, testTuple)
-    
-        return None
-    
-    def parseTestLine(self, testIter, testTuple):
-        return [testIter,
-                int(testTuple[0]),  # testId 
-                testTuple[1],       # interfaceName
-                int(testTuple[2]),  # testDuration
-                int(testTuple[3]),  # address/offset
-                int(testTuple[4])]  # mask
+            interfaces = (testTuple[1],)
+
+        return _PlanLine(_parseInt(testTuple[0]),         # testId
+                         interfaces,                      # interfaceName(s)
+                         _parseInt(testTuple[2]),         # testDuration
+                         offsets,                         # address/offset(s)
+                         relative,
+                         _parseSequence(testTuple[4]),    # mask(s)
+                         traffic)                         # traffic overrides
+
+    def _resolveRelative(self):
+        # walk one loop keeping the last offset either as a + b * it or as loop start + a
+        fromStart, a, b = True, 0, 0
+        for line in self.lines:
+            if line.relative:
+                a += line.offsets[0]
+                line.fromStart, line.a, line.b = fromStart, a, b
+            else:
+                fromStart, a, b = False, line.offsets[-1], self.offsetStep
+
+        # where the previous loop left the offset
+        self.endFromStart, self.endA, self.endB = fromStart, a, b
+
+    def _relativeOffset(self, line, it):
+        if not line.fromStart:
+            return line.a + line.b * it
+        return self._loopStart(it) + line.a
+
+    def _loopStart(self, it):
+        if it == 0:
+            return 0
+        if self.endFromStart:
+            # no immediate offsets at all, every loop adds the same amount
+            return it * self.endA
+        return self.endA + self.endB * (it - 1)
+
+
+def _parseInt(value):
+    try:
+        return int(value, 0)
+    except ValueError:
+        # plain decimals with leading zeroes
+        return int(value)
+
+
+def _parseSequence(value):
+    if value[0] == '{' and value[-1] == '}':
+        return tuple(_parseInt(x) for x in value[1:-1].split(',') if x.strip() != '')
+    if ':' in value:
+        bounds = value.split(':')
+        if len(bounds) > 3:
+            raise ValueError("too many fields in range '" + value + "'")
+        step = 1
+        if len(bounds) == 3:
+            step = _parseInt(bounds[2])
+        return range(_parseInt(bounds[0]), _parseInt(bounds[1]), step)
+    return (_parseInt(value),)
@@ -0,0 +1,165 @@
+import asyncio
+
+
+class UpsError(RuntimeError):
+    pass
+
+
+class _UpsConnection(object):
+    # one authenticated session with upsd
+    def __init__(self, reader, writer):
+        self.reader = reader
+        self.writer = writer
+
+    async def command(self, line):
+        self.writer.write(line.encode('utf-8') + b'\n')
+        await self.writer.drain()
+        response = await self.reader.readline()
+        if len(response) == 0:
+            raise ConnectionResetError("upsd closed the connection")
+        return response.decode('utf-8').rstrip('\r\n')
+
+    def close(self):
+        self.writer.close()
+
+
+class UpsClient(object):
+
+    """WRTM UPS Client
+
+       Controls the power of the routers under test through a NUT upsd, speaking its
+       network protocol directly. Connections are authenticated once and pooled (up
+       to poolSize of them), so several routers can be power cycled at the same time
+       without reconnecting for every command; a connection that broke is replaced
+       and the command retried once.
+
+       A power cycle switches the outlet (or the whole UPS if the router has no
+       outlet) off, polls its state every pollInterval seconds until the load has
+       actually dropped, keeps it off for holdTime seconds and powers it back on,
+       again waiting until the outlet reports it is on. UPSes that do not report the
+       outlet state are given offTime seconds instead.
+
+       Every failure - refused commands and credentials as well as lost connections -
+       is raised as a UpsError.
+    """
+
+    PORT = 3493
+    POLL_INTERVAL = 0.2
+    SWITCH_TIMEOUT = 30
+    HOLD_TIME = 2
+    OFF_TIME = 10
+
+    def __init__(self, name, host='localhost', port=PORT, username=None, password=None,
+                 poolSize=4, pollInterval=POLL_INTERVAL, holdTime=HOLD_TIME,
+                 offTime=OFF_TIME):
+        self.name = name
+        self.host = host
+        self.port = port
+        self.username = username
+        self.password = password
+        self.pollInterval = pollInterval
+        self.holdTime = holdTime
+        self.offTime = offTime
+
+        self.slots = asyncio.Semaphore(poolSize)
+        self.idle = []
+
+    async def close(self):
+        while len(self.idle) > 0:
+            connection = self.idle.pop()
+            try:
+                await connection.command("LOGOUT")
+            except (ConnectionError, OSError):
+                pass
+            connection.close()
+
+    async def instcmd(self, command):
+        response = await self._command("INSTCMD " + self.name + " " + command)
+        if not response.startswith("OK"):
+            raise UpsError("upsd refused '" + command + "': " + response)
+
+    async def getVar(self, variable):
+        """Returns the value of a variable, or None if the UPS does not have it."""
+        response = await self._command("GET VAR " + self.name + " " + variable)
+        if response.startswith("VAR "):
+            return response[response.index('"') + 1:response.rindex('"')].replace('\\"', '"')
+        if response in ("ERR VAR-NOT-SUPPORTED", "ERR UNKNOWN-COMMAND"):
+            return None
+        raise UpsError("upsd failed to get '" + variable + "': " + response)
+
+    async def powerCycle(self, outlet=None):
+        if outlet is None:
+            command = 'load.'
+        else:
+            command = 'outlet.' + str(outlet) + '.load.'
+
+        await self.instcmd(command + 'off')
+        if await self.waitForPower(outlet, False):
+            await asyncio.sleep(self.holdTime)
+        else:
+            await asyncio.sleep(self.offTime)
+        await self.instcmd(command + 'on')
+        await self.waitForPower(outlet, True)
+
+    async def waitForPower(self, outlet, on):
+        """Polls the outlet (or UPS output) state until it is on/off; returns False
+           if the UPS does not report it."""
+        loop = asyncio.get_event_loop()
+        deadline = loop.time() + UpsClient.SWITCH_TIMEOUT
+        while True:
+            if outlet is None:
+                status = await self.getVar('ups.status')
+                if status is not None:
+                    status = 'OFF' not in status.split()
+            else:
+                status = await self.getVar('outlet.' + str(outlet) + '.status')
+                if status is not None:
+                    status = status.lower() == 'on'
+
+            if status is None:
+                return False
+            if status == on:
+                return True
+            if loop.time() > deadline:
+                raise UpsError("Outlet " + str(outlet) + " of " + self.name + " did not "
+                               + "switch " + ("on" if on else "off") + ".")
+            await asyncio.sleep(self.pollInterval)
+
+    async def _command(self, line):
+        async with self.slots:
+            for attempt in (0, 1):
+                connection = await self._connection()
+                try:
+                    response = await connection.command(line)
+                except (ConnectionError, OSError) as e:
+                    connection.close()
+                    if attempt == 1:
+                        raise UpsError("Lost the connection to upsd at " + self.host + ":"
+                                       + str(self.port) + " (" + str(e) + ").")
+                    continue
+                self.idle.append(connection)
+                return response
+
+    async def _connection(self):
+        if len(self.idle) > 0:
+            return self.idle.pop()
+
+        try:
+            reader, writer = await asyncio.open_connection(self.host, self.port)
+        except OSError as e:
+            raise UpsError("Unable to connect to upsd at " + self.host + ":"
+                           + str(self.port) + " (" + str(e) + ").")
+        connection = _UpsConnection(reader, writer)
+        for command, value in (("USERNAME", self.username), ("PASSWORD", self.password)):
+            if value is None:
+                continue
+            try:
+                response = await connection.command(command + " " + value)
+            except (ConnectionError, OSError) as e:
+                connection.close()
+                raise UpsError("upsd dropped the connection at the " + command.lower()
+                               + " (" + str(e) + ").")
+            if not response.startswith("OK"):
+                connection.close()
+                raise UpsError("upsd rejected the " + command.lower() + ": " + response)
+        return connection
@@ -0,0 +1,163 @@
+import argparse
+import asyncio
+import sys
+
+
+class UpsEmulator(object):
+
+    """WRTM UPS Emulator
+
+       Fake NUT upsd for exercising the UpsClient (and power cycles in general)
+       without a UPS. It understands USERNAME, PASSWORD, INSTCMD, GET VAR and LOGOUT
+       for a single UPS with numbered outlets. Switching an outlet (or the whole
+       output, 'load.off'/'load.on') takes effect after switchDelay seconds; onSwitch,
+       if given, is then called with the outlet number (None for the whole output) and
+       the new state.
+    """
+
+    def __init__(self, name, outlets=1, username=None, password=None, switchDelay=0.5,
+                 onSwitch=None):
+        self.name = name
+        self.username = username
+        self.password = password
+        self.switchDelay = switchDelay
+        self.onSwitch = onSwitch
+        self.outlets = dict((i, True) for i in range(1, outlets + 1))
+        self.output = True
+        self.server = None
+        self.commands = []
+
+    async def start(self, host='127.0.0.1', port=3493):
+        self.server = await asyncio.start_server(self._handleClient, host, port)
+
+    def close(self):
+        self.server.close()
+
+    async def _handleClient(self, reader, writer):
+        username = None
+        authenticated = False
+        while True:
+            line = await reader.readline()
+            if len(line) == 0:
+                break
+            words = line.decode('utf-8').split()
+            if len(words) == 0:
+                continue
+
+            if words[0] == 'USERNAME' and len(words) == 2:
+                username = words[1]
+                response = "OK"
+            elif words[0] == 'PASSWORD' and len(words) == 2:
+                authenticated = username == self.username and words[1] == self.password
+                response = "OK" if authenticated else "ERR ACCESS-DENIED"
+            elif words[0] == 'LOGOUT':
+                writer.write(b"OK Goodbye\n")
+                break
+            elif words[:1] == ['INSTCMD'] and len(words) == 3:
+                if self.username is not None and not authenticated:
+                    response = "ERR USERNAME-REQUIRED"
+                else:
+                    response = self._instcmd(words[1], words[2])
+            elif words[:2] == ['GET', 'VAR'] and len(words) == 4:
+                response = self._getVar(words[2], words[3])
+            else:
+                response = "ERR UNKNOWN-COMMAND"
+
+            writer.write(response.encode('utf-8') + b"\n")
+            await writer.drain()
+
+        writer.close()
+
+    def _instcmd(self, name, command):
+        if name != self.name:
+            return "ERR UNKNOWN-UPS"
+
+        parts = command.split('.')
+        if parts[:1] == ['outlet'] and len(parts) == 4 and parts[2] == 'load':
+            try:
+                outlet = int(parts[1])
+            except ValueError:
+                return "ERR CMD-NOT-SUPPORTED"
+            if outlet not in self.outlets:
+                return "ERR CMD-NOT-SUPPORTED"
+            action = parts[3]
+        elif parts[:1] == ['load'] and len(parts) == 2:
+            outlet = None
+            action = parts[1]
+        else:
+            return "ERR CMD-NOT-SUPPORTED"
+
+        if action not in ('on', 'off'):
+            return "ERR CMD-NOT-SUPPORTED"
+
+        self.commands.append(command)
+        asyncio.get_event_loop().call_later(self.switchDelay, self._switch, outlet,
+                                            action == 'on')
+        return "OK"
+
+    def _switch(self, outlet, on):
+        if outlet is None:
+            self.output = on
+        else:
+            self.outlets[outlet] = on
+        if self.onSwitch is not None:
+            self.onSwitch(outlet, on)
+
+    def _getVar(self, name, variable):
+        if name != self.name:
+            return "ERR UNKNOWN-UPS"
+
+        if variable == 'ups.status':
+            value = "OL" if self.output else "OL OFF"
+        elif variable.startswith('outlet.') and variable.endswith('.status'):
+            try:
+                outlet = int(variable.split('.')[1])
+            except ValueError:
+                return "ERR VAR-NOT-SUPPORTED"
+            if outlet not in self.outlets:
+                return "ERR VAR-NOT-SUPPORTED"
+            value = "on" if self.outlets[outlet] and self.output else "off"
+        else:
+            return "ERR VAR-NOT-SUPPORTED"
+
+        return "VAR " + name + " " + variable + " \"" + value + "\""
+
+
+async def serve(args):
+    emulator = UpsEmulator(args.name, args.outlets, args.username, args.password,
+                           args.delay,
+                           lambda outlet, on: print("Outlet " + str(outlet) + " "
+                                                    + ("on" if on else "off")))
+    await emulator.start(args.address, args.port)
+    print("Emulating UPS '" + args.name + "' at " + args.address + ":" + str(args.port) + ".")
+    try:
+        await asyncio.get_event_loop().create_future()
+    finally:
+        emulator.close()
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description="Emulate a NUT upsd serving one UPS")
+    parser.add_argument('name', type=str, help='name of the UPS')
+    parser.add_argument('-a', '--address', type=str, help='address to listen at',
+                        required=False, default='127.0.0.1')
+    parser.add_argument('-p', '--port', type=int, help='port to listen at',
+                        required=False, default=3493)
+    parser.add_argument('-o', '--outlets', type=int, help='number of outlets',
+                        required=False, default=1)
+    parser.add_argument('-u', '--username', type=str, help='required username',
+                        required=False, default=None)
+    parser.add_argument('-w', '--password', type=str, help='required password',
+                        required=False, default=None)
+    parser.add_argument('-d', '--delay', type=float, help='switching delay in seconds',
+                        required=False, default=0.5)
+    args = parser.parse_args(argv[1:])
+
+    try:
+        asyncio.run(serve(args))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main(sys.argv)
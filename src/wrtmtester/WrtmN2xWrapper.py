@@ -1,114 +1,324 @@
+import hashlib
+import json
+
 from wrtmtester import N2xInterface
+from wrtmtester.N2xInterface import listFromResponse
 
 class WrtmN2xWrapper(object):
+
+    """WRTM N2X Wrapper
+
+       Provisions the RouterTester900 session generating the load streams: two
+       constant profiles on the first two ports, each with a stream group sent to
+       one of the other two ports, where errored frames are captured and counted.
+       The desired configuration is described by CONFIGURATION.
+
+       With the session cache enabled, a provisioned session is saved on the N2X
+       under a name derived from the hash of the configuration. On the next start the
+       saved session is restored in one call and the object handles are listed from
+       it through the List methods of their owners (see
+       N2xInterface.rediscoverHandles), instead of configuring everything again. A
+       missing saved session, any call the N2X rejects or a session not matching the
+       configuration falls back to building it from scratch, which is then saved.
+
+       Tests may ask for different traffic (see TestPlanParser.TRAFFIC_OPTIONS). The
+       wrapper keeps a model of what is currently applied to each stream - load,
+       profile mode, PDU headers, fixed PDU field values and payload fill - and before
+       the load streams are started sends only the commands changing what differs,
+       in a single pipeline. A new header stack resets the PDU, so its fields are set
+       again. If applying fails, the state is unknown and everything is set the next
+       time.
+    """
+
+    SESSION_TYPE = "RouterTester900"
+    SESSION_FILE = "wrtm-session-%s.ses"
+
+    CONFIGURATION = {
+        'ports': ['101/1', '101/2', '101/3', '101/4'],
+        'profile': "AGT_CONSTANT_PROFILE",
+        'profileMode': "AGT_TRAFFIC_PROFILE_MODE_CONTINUOUS",
+        'load': "1 AGT_UNITS_MBITS_PER_SEC",
+        'headers': ['ethernet', 'ipv4', 'tcp'],
+        'sources': ["192.168.1.2", "192.168.2.2"],
+        'destinations': ["192.168.3.2", "192.168.4.2"],
+        'tcpPorts': [6478, 6479],
+        'fills': ["0xA5A53C3C", "0x96965A5A"],
+        'frameFlags': ["AGT_FRAME_FLAG_IPV4_HEADER_CHECKSUM_ERROR",
+                       "AGT_FRAME_FLAG_ANY_L2_ERROR"],
+        'captureMode': "AGT_CAPTURE_CYCLIC",
+        'statistics': "AGT_PACKET_INTEGRITY_ERROR",
+    }
+
+    # interfaces a saved session has to hold to be worth restoring
+    SAVED_INTERFACES = ('AgtPortSelector', 'AgtProfileList', 'AgtStreamGroupList',
+                        'AgtFrameMatcherList', 'AgtStatisticsList')
+
     def __init__(self):
         self.n2x = N2xInterface()
         self.inited = False
         self.running = False
+        self.applied = None
 
-    def initN2X(self):
+    def configurationHash(self):
+        configuration = dict(WrtmN2xWrapper.CONFIGURATION,
+                             session=WrtmN2xWrapper.SESSION_TYPE)
+        return hashlib.sha256(json.dumps(configuration, sort_keys=True)
+                              .encode('utf-8')).hexdigest()
+
+    def initN2X(self, cacheSession=True):
         print('Waiting for n2x proxy to connect...')
         self.n2x.reverseProxy()
+        self.establishSession(cacheSession)
 
+    def establishSession(self, cacheSession=True):
         print('Establishing an N2X session...')
-        self.n2x.openSession("RouterTester900")
+        self.n2x.openSession(WrtmN2xWrapper.SESSION_TYPE)
+
+        fileName = WrtmN2xWrapper.SESSION_FILE % self.configurationHash()[:16]
+        if cacheSession and self._restoreSession(fileName):
+            print('Restored the saved N2X session ' + fileName + '.')
+        else:
+            self._buildSession()
+            if cacheSession:
+                try:
+                    self.n2x.saveSession(fileName)
+                except RuntimeError as e:
+                    print("Saving the N2X session failed (" + str(e) + ").")
+
+        # either way, the streams are set up as configured
+        self.applied = self.trafficState({})
+
+        self.inited = True
+
+    def _restoreSession(self, fileName):
         try:
-            self.n2x.addPortsToSession(['101/1', '101/2', '101/3', '101/4'])
+            saved = listFromResponse(self.n2x.listObjects("AGT_SAVED", fileName))
+        except RuntimeError:
+            return False
+        if any(x not in saved for x in WrtmN2xWrapper.SAVED_INTERFACES):
+            return False
+
+        try:
+            self.n2x.restoreSession(fileName)
+            self.n2x.setSessionLabel("WRTMasher probing stream session")
+            self.n2x.rediscoverHandles()
+        except RuntimeError as e:
+            print("Restoring the N2X session failed (" + str(e) + "), rebuilding.")
+            self.n2x.resetSession()
+            return False
+
+        if len(self.n2x.ports) != 4 or len(self.n2x.profiles) != 2 \
+                or len(self.n2x.streamGroups) != 2 or len(self.n2x.PDUs) != 2 \
+                or len(self.n2x.frameMatchers) != 4 or len(self.n2x.stats) != 2:
+            print("The saved N2X session does not match the configuration, rebuilding.")
+            self.n2x.resetSession()
+            return False
+
+        return True
+
+    def _buildSession(self):
+        config = WrtmN2xWrapper.CONFIGURATION
+        self.n2x.ports = []
+        self.n2x.profiles = []
+        self.n2x.streamGroups = []
+        self.n2x.PDUs = []
+        self.n2x.frameMatchers = []
+        self.n2x.stats = []
+
+        try:
+            self.n2x.addPortsToSession(config['ports'])
         except:
             print("Enabling probe ports failed. Check the probe's status.")
             self.n2x.closeSession()
             raise
-        self.n2x.setSessionLabel("WRTMasher probing stream session")
-
-        for port in self.n2x.ports:
-            self.n2x.setSutIpAddress(port, "192.168." + port + ".1")
-            self.n2x.setTesterIpAddress(port, "192.168." + port + ".2", "24")
-
-        for port in self.n2x.ports[:2]:
-            self.n2x.addProfile(port, "AGT_CONSTANT_PROFILE")
-
-        for profile in self.n2x.profiles:
-            self.n2x.setProfileMode(profile, "AgtConstantProfile", 
-                                    "AGT_TRAFFIC_PROFILE_MODE_CONTINUOUS")
-            self.n2x.setProfileAverageLoad(profile, "AgtConstantProfile",
-                                           "1 AGT_UNITS_MBITS_PER_SEC")
-            self.n2x.addStreamGroupToProfile(profile)
-
-        self.n2x.setExpectedDestinations(self.n2x.streamGroups[0], self.n2x.ports[2])
-        self.n2x.setExpectedDestinations(self.n2x.streamGroups[1], self.n2x.ports[3])
-
-        for streamGroup in self.n2x.streamGroups[:2]:
-            self.n2x.setPduHeaders(streamGroup, ['ethernet', 'ipv4', 'tcp'])
-
-        self.n2x.setIpv4SourceAddress(self.n2x.PDUs[0], "192.168.1.2")
-        self.n2x.setIpv4SourceAddress(self.n2x.PDUs[1], "192.168.2.2")
-        self.n2x.setIpv4DestinationAddress(self.n2x.PDUs[0], "192.168.3.2")
-        self.n2x.setIpv4DestinationAddress(self.n2x.PDUs[1], "192.168.4.2")
-        self.n2x.setTcpSourcePort(self.n2x.PDUs[0], 6478)
-        self.n2x.setTcpSourcePort(self.n2x.PDUs[1], 6478)
-        self.n2x.setTcpDestinationPort(self.n2x.PDUs[0], 6479)
-        self.n2x.setTcpDestinationPort(self.n2x.PDUs[1], 6479)
-
-        self.n2x.setPayloadFill(self.n2x.PDUs[0], "AGT_PAYLOAD_FILL_TYPE_REPEATING", "0xA5A53C3C")
-        self.n2x.setPayloadFill(self.n2x.PDUs[1], "AGT_PAYLOAD_FILL_TYPE_REPEATING", "0x96965A5A")
-
-        self.n2x.setCapturePorts([self.n2x.ports[2], self.n2x.ports[3]])
-
-        for port in self.n2x.ports[2:]:
-            self.n2x.clearFiltersOnPort(port)
-            self.n2x.createFrameMatcher(port)
-            self.n2x.createFrameMatcher(port)
-
-        self.n2x.addMatcherFrameFlags(self.n2x.frameMatchers[0], 
-                                      "AGT_FRAME_FLAG_IPV4_HEADER_CHECKSUM_ERROR")
-        self.n2x.addMatcherFrameFlags(self.n2x.frameMatchers[1], 
-                                      "AGT_FRAME_FLAG_ANY_L2_ERROR")
-        self.n2x.addMatcherFrameFlags(self.n2x.frameMatchers[2], 
-                                      "AGT_FRAME_FLAG_IPV4_HEADER_CHECKSUM_ERROR")
-        self.n2x.addMatcherFrameFlags(self.n2x.frameMatchers[3], 
-                                      "AGT_FRAME_FLAG_ANY_L2_ERROR")
-
-        self.n2x.addMatcherFilter(self.n2x.ports[2], self.n2x.frameMatchers[0], 
-                                  "AGT_FILTER_ACTION_STORE_PACKET")
-        self.n2x.addMatcherFilter(self.n2x.ports[2], self.n2x.frameMatchers[1], 
-                                  "AGT_FILTER_ACTION_STORE_PACKET")
-        self.n2x.addMatcherFilter(self.n2x.ports[3], self.n2x.frameMatchers[2], 
-                                  "AGT_FILTER_ACTION_STORE_PACKET")
-        self.n2x.addMatcherFilter(self.n2x.ports[3], self.n2x.frameMatchers[3], 
-                                  "AGT_FILTER_ACTION_STORE_PACKET")
-
-        self.n2x.setCaptureMode("AGT_CAPTURE_CYCLIC")
-
-        self.n2x.createStatHandler()
-        self.n2x.createStatHandler()
-
-        self.n2x.selectStats(self.n2x.stats[0], "AGT_PACKET_INTEGRITY_ERROR")
-        self.n2x.selectStats(self.n2x.stats[1], "AGT_PACKET_INTEGRITY_ERROR")
-
-        self.n2x.selectStatStreamGroup(self.n2x.stats[0], self.n2x.streamGroups[0])
-        self.n2x.selectStatStreamGroup(self.n2x.stats[1], self.n2x.streamGroups[1])
-
-        self.n2x.setErroredFrameFilter(self.n2x.ports[2], 
-                                       "AGT_STATISTICS_FILTER_INCLUDE_ALL_FRAMES")
-        self.n2x.setErroredFrameFilter(self.n2x.ports[3], 
-                                       "AGT_STATISTICS_FILTER_INCLUDE_ALL_FRAMES")
-
-        self.n2x.inited = True
-
-    def _startLoadStreams(self):
+
+        # the rest is pipelined, in the order of the original one-by-one setup; a
+        # stage ends where a command needs a handle created within it. Only the
+        # address listings, which change nothing, are hoisted into the first stage.
+        with self.n2x.pipeline():
+            self.n2x.setSessionLabel("WRTMasher probing stream session")
+
+            for port in self.n2x.ports:
+                self.n2x.listSutIpAddresses(port)
+                self.n2x.listAddressPools(port)
+
+        with self.n2x.pipeline():
+            for port in self.n2x.ports:
+                self.n2x.setSutIpAddress(port, "192.168." + port + ".1")
+                self.n2x.setTesterIpAddress(port, "192.168." + port + ".2", "24")
+
+            for port in self.n2x.ports[:2]:
+                self.n2x.addProfile(port, config['profile'])
+
+        with self.n2x.pipeline():
+            profileType = "AgtConstantProfile"
+            for profile in self.n2x.profiles:
+                self.n2x.setProfileMode(profile, profileType, config['profileMode'])
+                self.n2x.setProfileAverageLoad(profile, profileType, config['load'])
+                self.n2x.addStreamGroupToProfile(profile)
+
+        with self.n2x.pipeline():
+            self.n2x.setExpectedDestinations(self.n2x.streamGroups[0], self.n2x.ports[2])
+            self.n2x.setExpectedDestinations(self.n2x.streamGroups[1], self.n2x.ports[3])
+
+            for streamGroup in self.n2x.streamGroups[:2]:
+                self.n2x.setPduHeaders(streamGroup, config['headers'])
+
+            pdus = self.n2x.PDUs[:2]
+            for pdu, address in zip(pdus, config['sources']):
+                self.n2x.setIpv4SourceAddress(pdu, address)
+            for pdu, address in zip(pdus, config['destinations']):
+                self.n2x.setIpv4DestinationAddress(pdu, address)
+            for pdu in pdus:
+                self.n2x.setTcpSourcePort(pdu, config['tcpPorts'][0])
+            for pdu in pdus:
+                self.n2x.setTcpDestinationPort(pdu, config['tcpPorts'][1])
+            for pdu, fill in zip(pdus, config['fills']):
+                self.n2x.setPayloadFill(pdu, "AGT_PAYLOAD_FILL_TYPE_REPEATING", fill)
+
+            self.n2x.setCapturePorts(self.capturePorts())
+
+            for port in self.n2x.ports[2:]:
+                self.n2x.clearFiltersOnPort(port)
+                self.n2x.createFrameMatcher(port)
+                self.n2x.createFrameMatcher(port)
+
+        with self.n2x.pipeline():
+            for i, frameMatcher in enumerate(self.n2x.frameMatchers):
+                self.n2x.addMatcherFrameFlags(frameMatcher, config['frameFlags'][i % 2])
+            for i, frameMatcher in enumerate(self.n2x.frameMatchers):
+                self.n2x.addMatcherFilter(self.n2x.ports[2 + i // 2], frameMatcher,
+                                          "AGT_FILTER_ACTION_STORE_PACKET")
+
+            self.n2x.setCaptureMode(config['captureMode'])
+
+            self.n2x.createStatHandler()
+            self.n2x.createStatHandler()
+
+        with self.n2x.pipeline():
+            for stats in self.n2x.stats:
+                self.n2x.selectStats(stats, config['statistics'])
+
+            self.n2x.selectStatStreamGroup(self.n2x.stats[0], self.n2x.streamGroups[0])
+            self.n2x.selectStatStreamGroup(self.n2x.stats[1], self.n2x.streamGroups[1])
+
+            self.n2x.setErroredFrameFilter(self.n2x.ports[2],
+                                           "AGT_STATISTICS_FILTER_INCLUDE_ALL_FRAMES")
+            self.n2x.setErroredFrameFilter(self.n2x.ports[3],
+                                           "AGT_STATISTICS_FILTER_INCLUDE_ALL_FRAMES")
+
+    def trafficState(self, traffic):
+        """Returns the state of both streams the traffic overrides call for."""
+        config = WrtmN2xWrapper.CONFIGURATION
+        load = parseLoad(traffic.get('load', config['load']))
+        mode = traffic.get('loadMode', config['profileMode'])
+        if not mode.startswith('AGT_'):
+            mode = 'AGT_TRAFFIC_PROFILE_MODE_' + mode.upper()
+        headers = config['headers']
+        if 'loadHeaders' in traffic:
+            headers = [x.strip() for x in traffic['loadHeaders'].split(',') if x.strip()]
+        sourcePort = int(traffic.get('loadSourcePort', config['tcpPorts'][0]))
+        destinationPort = int(traffic.get('loadDestinationPort', config['tcpPorts'][1]))
+
+        streams = []
+        for i in range(2):
+            fields = {('ipv4', 'source_address'): config['sources'][i],
+                      ('ipv4', 'destination_address'): config['destinations'][i]}
+            for protocol in ('tcp', 'udp'):
+                if protocol in headers:
+                    fields[(protocol, 'source_port')] = sourcePort
+                    fields[(protocol, 'destination_port')] = destinationPort
+            streams.append({'load': load,
+                            'mode': mode,
+                            'headers': tuple(headers),
+                            'fields': fields,
+                            'fill': traffic.get('loadFill', config['fills'][i])})
+        return streams
+
+    def applyTraffic(self, traffic):
+        """Reconfigures the streams for the traffic overrides, sending only what
+           differs from the applied state; returns the number of commands sent."""
+        desired = self.trafficState(traffic)
+        applied = self.applied
+        if applied is None:
+            applied = [{'fields': {}} for _ in desired]
+
+        profileType = "AgtConstantProfile"
+        commands = 0
+        self.applied = None
+        with self.n2x.pipeline():
+            for i, stream in enumerate(desired):
+                current = applied[i]
+                profile = self.n2x.profiles[i]
+                pdu = self.n2x.PDUs[i]
+
+                if current.get('mode') != stream['mode']:
+                    self.n2x.setProfileMode(profile, profileType, stream['mode'])
+                    commands += 1
+                if current.get('load') != stream['load']:
+                    self.n2x.setProfileAverageLoad(profile, profileType, stream['load'])
+                    commands += 1
+
+                fields = current['fields']
+                if current.get('headers') != stream['headers']:
+                    self.n2x.setPduHeaders(self.n2x.streamGroups[i], list(stream['headers']))
+                    commands += 1
+                    fields = {}
+                    current = {'fields': fields}
+                for (protocol, field), value in sorted(stream['fields'].items()):
+                    if fields.get((protocol, field)) != value:
+                        self.n2x.setFixedPduFieldValue(pdu, protocol, field, value)
+                        commands += 1
+                if current.get('fill') != stream['fill']:
+                    self.n2x.setPayloadFill(pdu, "AGT_PAYLOAD_FILL_TYPE_REPEATING",
+                                            stream['fill'])
+                    commands += 1
+
+        self.applied = desired
+        return commands
+
+    def _startLoadStreams(self, traffic=None):
         if self.inited:
-            self.n2x.startCapture()
-            self.n2x.startTest()
+            self.applyTraffic(traffic or {})
+            with self.n2x.pipeline():
+                self.n2x.startCapture()
+                self.n2x.startTest()
             self.running = True
 
     def _stopLoadStreams(self):
         if self.inited:
             self.running = False
-            self.n2x.stopTest()
-            self.n2x.stopCapture()
+            with self.n2x.pipeline():
+                self.n2x.stopTest()
+                self.n2x.stopCapture()
+
+    def capturePorts(self):
+        return self.n2x.ports[2:4]
+
+    def capturedFrameCounts(self):
+        """Returns the number of frames captured on each of the capture ports. Kept
+           out of _stopLoadStreams, so a rejected count cannot fail the stop."""
+        counts = []
+        with self.n2x.pipeline():
+            for port in self.capturePorts():
+                self.n2x.getCapturedFrameCount(port, counts.append)
+        return dict(zip(self.capturePorts(), counts))
+
+    def capturedFrames(self, port, first, count):
+        return self.n2x.getCapturedFrames(port, first, count)
 
     def collectLoadStats(self):
-        pass
+        """Returns the packet integrity error counters of the stream groups, in one
+           round trip, or None while the load streams are not running."""
+        if not self.inited or not self.running:
+            return None
+
+        counters = []
+        with self.n2x.pipeline():
+            for stats, streamGroup in zip(self.n2x.stats, self.n2x.streamGroups):
+                self.n2x.collectStats(stats, streamGroup,
+                                      lambda values: counters.append(int(values[0])))
+        return counters
 
     def shutdownN2X(self):
         if self.inited:
@@ -116,3 +326,24 @@ class WrtmN2xWrapper(object):
                 self._stopLoadStreams()
             self.n2x.closeSession()
             self.n2x.disconnectFromProxy()
+
+
+def parseRate(value):
+    """Returns a rate given in Mbit/s, with an optional k/M/G suffix, in Mbit/s."""
+    value = str(value).strip()
+    scale = {'k': 0.001, 'M': 1, 'G': 1000}.get(value[-1:])
+    if scale is not None:
+        value = value[:-1]
+    else:
+        scale = 1
+    return float(value) * scale
+
+
+def parseLoad(value):
+    """Turns a load given in Mbit/s (with an optional k/M/G suffix) into N2X terms;
+       loads given with N2X units are left as they are."""
+    value = value.strip()
+    if 'AGT_' in value:
+        return value
+    # repr keeps every digit, a bisected ramp load is applied exactly as recorded
+    return repr(parseRate(value)) + " AGT_UNITS_MBITS_PER_SEC"
@@ -1,27 +1,21 @@
 import argparse
-import os
-import select
+import asyncio
 import socket
-import struct
 import sys
 import time
 
-from wrtmtester import SerialReader
 from wrtmtester import TestPlanParser
 from wrtmtester import WrtmN2xWrapper
-from wrtmtester.ping import ping_one
-
-
-class WrtmTestError(RuntimeError):
-    pass
-
-
-class WrtmTimeoutError(RuntimeError):
-    pass
-
-
-class WrtmRebootError(RuntimeError):
-    pass
+from wrtmtester.CampaignMetrics import CampaignMetrics
+from wrtmtester.CaptureExporter import CaptureExporter
+from wrtmtester.CampaignJournal import CampaignJournal
+from wrtmtester.ControlChannel import ControlChannel
+from wrtmtester.DutRunner import DutRunner
+from wrtmtester.N2xExecutor import N2xExecutor
+from wrtmtester.OutcomeCache import OutcomeCache
+from wrtmtester.UpsClient import UpsClient
+from wrtmtester.ResultStore import ResultStore
+from wrtmtester.StatsSampler import StatsSampler
 
 
 def implode(thesis):
@@ -33,7 +27,10 @@ class WrtmTester(object):
     """WRTM Tester
     
        Main wrapper class used to initialize the testing environment, load and parse testing
-       definitions and execute them on a remote system with WRTM modules.
+       definitions and execute them on remote systems with WRTM modules. Every router
+       listed in the test description is driven by its own DutRunner, all of them on
+       one asyncio event loop and sharing the ControlChannel, result store, journal,
+       outcome cache, UPS client and N2X. The options are listed in the README.
     """
 
     ARGPARSE_DESCRIPTION = "WRTM Tester 0.13.37"
@@ -41,258 +38,158 @@ class WrtmTester(object):
     INIT_PORT = 4094 
     TEST_PORT = 7999
 
-    INIT_MAGIC = 0xFEE17357
-    INIT_TIMEOUT = 120
-    RCV_TIMEOUT = 10
-
-    ERR_OK = 0
-    ERR_RCV_TIMEOUT = 4
+    CANCEL_INTERVAL = 0.5
 
     def __init__(self):
         self.testParser = TestPlanParser()
         self.n2x = WrtmN2xWrapper()
-        self.serial = SerialReader()
-
-        self.routerSocket = None
-        self.routerIp = None
+        # N2X calls block on the proxy socket; keep them off the event loop, one at a time
+        self.n2xExecutor = N2xExecutor()
+
+        self.channel = None
+        self.results = None
+        self.journal = None
+        self.outcomes = None
+        self.ups = None
+        self.sampler = None
+        self.capture = None
+        self.metrics = None
+        self.runners = []
+
+    async def executeCampaign(self, verboseLog, useLoad, resume=False):
+        # init control channel shared by all routers
+        self.channel = ControlChannel(
+            int(self.testParser.getPlanOption('main', 'testPort', WrtmTester.TEST_PORT)),
+            int(self.testParser.getPlanOption('main', 'initPort', WrtmTester.INIT_PORT)),
+            self.testParser.getPlanOption('main', 'controlAddress', '0.0.0.0'))
+        await self.channel.open()
+        try:
+            await self._runCampaign(verboseLog, useLoad, resume)
+        finally:
+            # whatever got opened is closed, so that no writer thread outlives a failure
+            await self._closeCampaign()
 
-    def executePlan(self, testName, verboseLog):
-        self.routerIp = self.testParser.parser['main']['routerIp']
-        testStartTime = 0
-        testStopTime = 0
-        testRunning = False
+    async def _runCampaign(self, verboseLog, useLoad, resume):
+        # init result store shared by all routers
         timeStr = time.strftime("%d-%m-%Y_%H-%M-%S", time.gmtime())
-
-        # init serial reader
-        if self.testParser.parser.has_option('main', 'tty'):
-            tty = self.testParser.parser['main']['tty']
+        self.results = ResultStore("results_" + timeStr + ".db")
+        self.results.open()
+
+        # init progress journal of this test description
+        self.journal = CampaignJournal(self.testParser.loadedPath)
+        self.journal.open(resume)
+
+        # init outcome cache shared by all campaigns
+        self.outcomes = OutcomeCache(
+            self.testParser.getPlanOption('main', 'outcomeCache', 'wrtm-outcomes.db'),
+            int(self.testParser.getPlanOption('main', 'outcomeExpiry',
+                                              OutcomeCache.DEFAULT_EXPIRY)),
+            int(self.testParser.getPlanOption('main', 'outcomeMaxEntries',
+                                              OutcomeCache.DEFAULT_MAX_ENTRIES)))
+        self.outcomes.open()
+
+        # init power control shared by all routers
+        self.ups = self._createUpsClient()
+
+        # init metrics of all routers, exported as configured
+        self.metrics = CampaignMetrics()
+        await self.metrics.start(
+            self.testParser.getPlanOption('main', 'metricsAddress', '127.0.0.1'),
+            int(self.testParser.getPlanOption('main', 'metricsPort', 0)),
+            self.testParser.getPlanOption('main', 'metricsTextfile'),
+            float(self.testParser.getPlanOption('main', 'metricsInterval', 15.0)))
+
+        # sample the N2X stats in the background while the load streams run
+        if useLoad:
+            self.sampler = StatsSampler(
+                self.n2x, self.n2xExecutor,
+                float(self.testParser.getPlanOption('main', 'statsInterval', 1.0)),
+                int(self.testParser.getPlanOption('main', 'statsCapacity', 3600)))
+            self.sampler.start()
+
+            if self.testParser.getPlanOption('main', 'captureExport', 'yes') == 'yes':
+                self.capture = CaptureExporter(
+                    self.n2x, self.n2xExecutor,
+                    self.testParser.getPlanOption('main', 'captureDirectory', '.'),
+                    int(self.testParser.getPlanOption('main', 'captureChunk',
+                                                      CaptureExporter.CHUNK_FRAMES)))
+
+        # the N2X load is wired to a single router, the first one unless specified
+        routers = self.testParser.getRouters()
+        if self.testParser.parser.has_option('main', 'n2xRouter'):
+            n2xRouter = self.testParser.parser['main']['n2xRouter']
         else:
-            tty = '/dev/ttyAMA0'
-
-        self.serial.init(tty, "wrt54gl-log-" + testName + "-" + timeStr + ".log")
-        self.serial.setVerbose(verboseLog)
-
-        # init router socket
-        self.routerSocket = socket.socket(type=socket.SOCK_DGRAM, proto=socket.IPPROTO_UDP)
-        self.routerSocket.bind(('', WrtmTester.TEST_PORT))
-
-        # init init socket
-        initSocket = socket.socket(type=socket.SOCK_DGRAM, proto=socket.IPPROTO_UDP)
-        initSocket.bind(('', WrtmTester.INIT_PORT))
-
-        # open result file
-        resultsFile = open("results_" + timeStr + ".txt", "a+")
-
-        # loop over tests:
-        for test in self.testParser.getTestGenerator(testName):
-            retCount = 0
-
-            try:
-                while True:
-                    print("\r\tExecuting test #" + str(test[0]) + " (" + time.strftime("%H:%M:%S", time.gmtime()) + ")")
-                    try:
-                        # ping router
-                        try:
-                            ping_one(self.routerIp)
-                        except socket.error:
-                            self.shutdownN2X()
-                            raise WrtmTestError("Router under test did not respond to the "
-                                                + "initial ping request. Abandoning ship.")
-
-                        # start load streams/send test definition (order depends on delay)
-                        # receive acknowledgement
-                        delay = int(self.testParser.parser[testName]['loadDelay'])
-                        if delay < 0:
-                            self.n2x._startLoadStreams()
-                            time.sleep(-delay)
-                            self._sendTest(test)
-                            testRunning = True
-                        else:
-                            self._sendTest(test)
-                            testRunning = True
-                            time.sleep(delay)
-                            self.n2x._startLoadStreams()
-
-                        break
-
-                    except WrtmTimeoutError:
-                        retCount += 1
-                        if retCount == 3:
-                            raise WrtmTimeoutError("Test #" + str(test[0]) + " skipped "
-                                                   + "due to excessive number of init retries.")
-                        print("\r\tLink with the router timed out. Retrying...")
-
-                testStartTime = time.time()
-
-                # keep pinging for the duration of the test
-                # if no response: fail the test
-
-                for pingCount in range(0, test[3]):
-                    time.sleep(1)
-                    try:
-                        ping_one(self.routerIp)
-                    except socket.error:
-                        self.shutdownN2X()
-                        raise WrtmTimeoutError("Router under test did not respond to a ping request "
-                                               + "during test #" + str(test[0]))
-
-                testStopTime = time.time()
-                testRunning = False
-
-                # after pinging: send stop-test, wait for ack; if no response, fail the test
-                self._sendTest(test, stop=True)
-
-                # post-test:
-                # stop load streams
-                self.n2x._stopLoadStreams()
-
-                # if test passed (no matter the result), save the result
-                result = self._formResultString(test, WrtmTester.ERR_OK, 
-                                               testStopTime - testStartTime, retCount)
-                resultsFile.write(result + "\n")
-
-                print("\r\tTest done. Waiting for the router to announce its readiness.")
-                # check if the router is ready (by waiting for broadcast on router socket)
-                # if it won't broadcast within 120 seconds, reboot through UPS
-                # in case it doesn't broadcast after two reboots, cancel the test suite altogether
-                rebootCounter = 0
-
-                while rebootCounter < 3:
-                    try:
-                        timeoutCounter = 0
-                        while(timeoutCounter < WrtmTester.INIT_TIMEOUT):
-                            rsock, _, _ = select.select([initSocket], [], [], 1)
-                            if rsock != []:
-                                data, addr = rsock[0].recvfrom(4096)
-                                if addr[0] != self.routerIp:
-                                    continue
-                                magic = struct.unpack("<II", data[2:10])
-                                if magic[1] == 0xFFFFFFFF and \
-                                   magic[0] == WrtmTester.INIT_MAGIC:
-                                    if test[0] < self.testParser.getNumberOfTestCases(testName):
-                                        print("\r\tResuming testing in 5 seconds...")
-                                        time.sleep(5)
-                                    break
-                            timeoutCounter += 1
-                        
-                        if timeoutCounter == WrtmTester.INIT_TIMEOUT:
-                            raise WrtmRebootError("Router did not initiate after " + 
-                                                  str(WrtmTester.INIT_TIMEOUT) + " seconds, " + 
-                                                  "preparing for a power cycle.")
-
-                        break
-
-                    except WrtmRebootError as re:
-                        rebootCounter += 1
-                        if rebootCounter == 3:
-                            break
-
-                        print("\r\t" + str(re))
-                        os.system('upscmd -u admin -p asdf everwrt load.off')
-                        print("\r\t** System powered down. Restoring power in 10...")
-                        time.sleep(10)
-                        os.system('upscmd -u admin -p asdf everwrt load.on')
-                        continue
-
-                if rebootCounter == 3:
-                   raise WrtmTestError("Router did not initiate after three tries, " +
-                                       "aborting testing.") 
-        
-                # flush init socket
-                initSocket.close()
-                initSocket = socket.socket(type=socket.SOCK_DGRAM, proto=socket.IPPROTO_UDP)
-                initSocket.bind(('', WrtmTester.INIT_PORT))
-
-            except WrtmTestError as te:
-                print("\r\t" + str(te))
-                self.serial.close()
-                self.routerSocket.close()
-                initSocket.close()
-                return
-
-            except WrtmTimeoutError as tme:
-                # if test timed out on pings/second send-ack or test init, report failure and go next
-                if testRunning:
-                    testTime = testStopTime - testStartTime
-                else:
-                    testTime = 0
-                
-                print("\r\t" + str(tme))
-                result = self._formResultString(test, WrtmTester.ERR_RCV_TIMEOUT, testTime, retCount) \
-                         + " [" + str(tme) + "]"
-                resultsFile.write(result + "\n")
-                continue
-
-        # testing done!
-        print("\rTest suite done!")
-
-        # close the serial reader and the result file
-        self.serial.close()
-        resultsFile.close()
-
-        # close router socket
-        initSocket.close()
-        self.routerSocket.close()
-
-    def _prepareTestPacket(self, test, stop=False):
-        if stop:
-            stop = 1
-        else:
-            stop = 0
-        outPack = struct.pack("<IIILII128sII",
-                              test[0],
-                              test[0],
-                              test[1],
-                              136,
-                              test[3],
-                              stop,
-                              bytes(test[2], 'utf-8') + bytes('\0', 'utf-8') * (128 - len(test[2])),
-                              test[4],
-                              test[5])
-        return outPack
-
-    def _sendTest(self, test, stop=False):
-        timeDiff = 0
-
-        outPack = self._prepareTestPacket(test, stop)
-        self.routerSocket.sendto(outPack, (self.routerIp, WrtmTester.TEST_PORT))
-
-        while timeDiff < WrtmTester.RCV_TIMEOUT:
-            startTime = time.time()
-            read,_,_ = select.select([self.routerSocket], [], [], WrtmTester.RCV_TIMEOUT - timeDiff)
-            stopTime = time.time()
-            #print("[:debug] timediff " + str(timeDiff))
-            timeDiff += stopTime - startTime
-            if read == []:
-                raise WrtmTimeoutError()
-            ackData = self.routerSocket.recv(10)
-            #print("[:debug] ackData " + ":".join("{:02x}".format(c) for c in ackData))
-            ackPack = struct.unpack("<2xiL", ackData)
-
-            # code i dont understand
-            if ackPack[1] == 0:
-                if ackPack[0] != test[1]:
-                    raise WrtmTestError("Got an ack for a wrong test?? " + str(test))
-                return
+            n2xRouter = routers[0][0]
+
+        # acks are matched by sequence number only for routers known to echo it
+        echoRouters = self.testParser.getPlanOption('main', 'ackSequence', '').split()
+
+        # one runner per router, all of them sharing the event loop
+        assignments = self.testParser.getPlanAssignments()
+        for routerIp, tty, outlet in routers:
+            link = self.channel.register(routerIp, echoSequence=routerIp in echoRouters)
+            if useLoad and routerIp == n2xRouter:
+                runner = DutRunner(self.testParser, routerIp, tty, outlet, link, self.results,
+                                   self.journal, self.outcomes, self.ups,
+                                   self.n2x, self.n2xExecutor, self.sampler,
+                                   self.capture, self.metrics)
             else:
-                if ackPack[1] == 2:
-                    continue
-                elif ackPack[1] == 1:
-                    raise WrtmTestError("Specified test type (" + str(test[1]) + ") "
-                                        + "was not identified on RUT!")
-                raise WrtmTestError("Received a NACK for test #" + str(test[0]) + " from RUT!")
-
-    def _formResultString(self, test, errCode, testTime, retCount):
-        timeStr = time.strftime("%d-%m-%Y %H-%M-%S", time.gmtime())
-        result = "#" + str(test[0]) + " (" + timeStr \
-                 + ") ret: " + str(errCode) \
-                 + " id: " + str(test[1]) \
-                 + " if: " + test[2] \
-                 + " (o,m/c): (" + str(test[4]) + "," + str(test[5]) \
-                 + ") time:  " + str(testTime) \
-                 + "s rtr: " + str(retCount)
-        return result
-        
+                runner = DutRunner(self.testParser, routerIp, tty, outlet, link, self.results,
+                                   self.journal, self.outcomes, self.ups,
+                                   metrics=self.metrics)
+            self.runners.append(runner)
+
+        runs = [asyncio.ensure_future(runner.run(assignments[runner.routerIp], verboseLog))
+                for runner in self.runners]
+        try:
+            await asyncio.gather(*runs)
+        finally:
+            # a failing runner takes the others down before the shared resources go;
+            # asyncio.wait_for may swallow a cancellation racing its result, so keep
+            # cancelling until they are all gone
+            pending = [run for run in runs if not run.done()]
+            while len(pending) > 0:
+                for run in pending:
+                    run.cancel()
+                _, pending = await asyncio.wait(pending, timeout=WrtmTester.CANCEL_INTERVAL)
+
+    async def _closeCampaign(self):
+        if self.capture is not None:
+            await self.capture.close()
+        self.channel.close()
+        if self.results is not None:
+            self.results.close()
+        if self.journal is not None:
+            self.journal.close()
+        if self.outcomes is not None:
+            self.outcomes.close()
+        if self.ups is not None:
+            await self.ups.close()
+        if self.sampler is not None:
+            await self.sampler.stop()
+        if self.metrics is not None:
+            await self.metrics.close()
+
+    def _createUpsClient(self):
+        if self.testParser.parser.has_section('ups'):
+            options = self.testParser.parser['ups']
+            for option in ('username', 'password'):
+                if option not in options:
+                    raise RuntimeError("The 'ups' section needs a '" + option + "'.")
+        else:
+            # the upsd of the original test rack
+            options = {'username': 'admin', 'password': 'asdf'}
+
+        return UpsClient(options.get('name', 'everwrt'),
+                         options.get('host', 'localhost'),
+                         int(options.get('port', UpsClient.PORT)),
+                         options['username'],
+                         options['password'],
+                         int(options.get('poolSize', 4)),
+                         float(options.get('pollInterval', UpsClient.POLL_INTERVAL)),
+                         float(options.get('holdTime', UpsClient.HOLD_TIME)),
+                         float(options.get('offTime', UpsClient.OFF_TIME)))
+
     def main(self, argv):
         # remove argv0
         argv = argv[1:]
@@ -307,6 +204,10 @@ class WrtmTester(object):
         parser.add_argument('-v', '--verboseLog', action='store_true',
                             help='print the serial output directly to console',
                             required=False, default=False)
+        parser.add_argument('-r', '--resume', action='store_true',
+                            help='skip the tests completed by an interrupted run of the same '
+                                 + 'test description',
+                            required=False, default=False)
         args = parser.parse_args(argv)
 
         # check if run with sudo (required for ping)
@@ -328,15 +229,13 @@ class WrtmTester(object):
 
         # init n2x
         if not args.noload:
-            self.n2x.initN2X()
+            self.n2x.initN2X(
+                self.testParser.getPlanOption('main', 'n2xSessionCache', 'yes') == 'yes')
 
-        # execute plan
-        for testPlan in [x for x in self.testParser.sections() if x != 'main']:
-            print("Starting test suite '" + testPlan + "'"
-                  + " at " + time.strftime("%d-%m-%Y %H:%M:%S", time.gmtime()))
-            self.executePlan(testPlan, args.verboseLog)
-            print("***\n")
+        # execute plans on all routers
+        asyncio.run(self.executeCampaign(args.verboseLog, not args.noload, args.resume))
 
         # shutdown n2x
+        self.n2xExecutor.shutdown()
         if not args.noload:
             self.n2x.shutdownN2X()
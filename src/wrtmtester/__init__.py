@@ -1,8 +1,30 @@
 from __future__ import absolute_import
 
 from .N2xInterface import N2xInterface
+from .AdaptiveSearch import AdaptiveSearch
+from .CampaignJournal import CampaignJournal
+from .CampaignMetrics import CampaignMetrics
+from .CaptureExporter import CaptureExporter
+from .ControlChannel import ControlChannel, RouterLink, RtoEstimator
+from .ConsoleMonitor import ConsoleMonitor, ConsoleEvent
+from .N2xEmulator import N2xEmulator
+from .N2xExecutor import N2xExecutor
+from .OutcomeCache import OutcomeCache
+from .PlanCompiler import PlanCompiler, CompiledPlan, SweepPlan
+from .ResultStore import ResultStore
+from .RouterEmulator import RouterEmulator
+from .SerialLogIndex import SerialLogIndex
+from .SerialLogWriter import SerialLogWriter
 from .SerialReader import SerialReader
-from .TestPlanParser import TestPlanParser
+from .SqliteWriter import SqliteWriter
+from .StatsSampler import StatsSampler
+from .TestPlanParser import TestPlanParser, TestSweep
+from .UpsClient import UpsClient, UpsError
+from .UpsEmulator import UpsEmulator
 from .WrtmN2xWrapper import WrtmN2xWrapper
+from .N2xBenchmark import N2xBenchmark
+from .LivenessProbe import LivenessProbe
+from .LoadRamp import LoadRamp
+from .DutRunner import DutRunner
 from .WrtmTester import WrtmTester
-from .ping import ping_one
+from .ping import ping_one, Pinger
@@ -78,7 +78,9 @@
 
 """
 
+import os
 import time
+import asyncio
 import socket
 import struct
 import select
@@ -87,6 +89,7 @@ import asyncore
 
 # From /usr/include/linux/icmp.h; your milage may vary.
 ICMP_ECHO_REQUEST = 8 # Seems to be the same on Solaris.
+ICMP_ECHO_REPLY = 0
 
 ICMP_CODE = socket.getprotobyname('icmp')
 ERROR_DESCR = {
@@ -96,7 +99,7 @@ ERROR_DESCR = {
            ' users or processes with administrator rights.'
     }
 
-__all__ = ['create_packet', 'ping_one', 'verbose_ping', 'PingQuery',
+__all__ = ['create_packet', 'ping_one', 'verbose_ping', 'Pinger', 'PingQuery',
            'multi_ping_query']
 
 
@@ -213,6 +216,140 @@ def verbose_ping(dest_addr, timeout=2, count=4):
     print('')
 
 
+class Pinger(object):
+    """
+    Long-lived pinger bound to a single target.
+
+    The raw socket is opened and connected to the target once, so the
+    kernel only hands us ICMP traffic coming from that address. The echo
+    request is kept in a preallocated buffer: the payload part of the
+    checksum is computed once and only the sequence number and the
+    checksum are patched in before each send.
+
+    Every request gets the next sequence number and replies are matched
+    by (id, sequence), so a reply arriving after its request timed out is
+    simply dropped instead of being taken for the answer to a newer one.
+
+    Must be used from within a running asyncio event loop.
+
+    """
+    HEADER = struct.Struct('!BBHHH')
+    PAYLOAD_SIZE = 192
+
+    _instances = 0
+
+    def __init__(self, dest_addr):
+        self.dest_addr = dest_addr
+        self.host = socket.gethostbyname(dest_addr)
+        self.loop = None
+        self.socket = None
+        Pinger._instances += 1
+        # Keep ids of several pingers in one process apart.
+        self.packet_id = (os.getpid() + Pinger._instances) & 0xffff
+        self.sequence = 0
+        self.pending = {}
+
+        self.packet = bytearray(Pinger.HEADER.size + Pinger.PAYLOAD_SIZE)
+        self.packet[Pinger.HEADER.size:] = Pinger.PAYLOAD_SIZE * b'Q'
+        self.payload_sum = _ones_complement_sum(self.packet[Pinger.HEADER.size:])
+        self.recv_buffer = bytearray(1024)
+        self.recv_view = memoryview(self.recv_buffer)
+
+    def open(self):
+        self.loop = asyncio.get_event_loop()
+        try:
+            self.socket = socket.socket(socket.AF_INET, socket.SOCK_RAW, ICMP_CODE)
+        except socket.error as e:
+            if e.errno in ERROR_DESCR:
+                # Operation not permitted
+                raise socket.error(''.join((e.args[1], ERROR_DESCR[e.errno])))
+            raise # raise the original error
+        self.socket.setblocking(False)
+        # The icmp protocol does not use a port, but connect expects it,
+        # so we just give it a dummy port.
+        self.socket.connect((self.host, 1))
+        self.loop.add_reader(self.socket.fileno(), self._handle_read)
+
+    def close(self):
+        if self.socket is None:
+            return
+        self.loop.remove_reader(self.socket.fileno())
+        self.socket.close()
+        self.socket = None
+        for future in self.pending.values():
+            future.cancel()
+        self.pending.clear()
+
+    async def ping(self, timeout=1):
+        """
+        Sends one echo request and waits up to "timeout" seconds for the
+        matching reply.
+
+        Returns either the delay (in seconds) or None on timeout.
+
+        """
+        if self.socket is None:
+            self.open()
+        self.sequence = (self.sequence + 1) & 0xffff
+        sequence = self.sequence
+        received = self.loop.create_future()
+        self.pending[sequence] = received
+
+        self._prepare_packet(sequence)
+        time_sent = time.monotonic()
+        try:
+            self.socket.send(self.packet)
+            return await asyncio.wait_for(received, timeout) - time_sent
+        except (asyncio.TimeoutError, OSError):
+            return
+        finally:
+            self.pending.pop(sequence, None)
+
+    def _prepare_packet(self, sequence):
+        header_sum = (ICMP_ECHO_REQUEST << 8) + self.packet_id + sequence
+        my_checksum = _fold_checksum(self.payload_sum + header_sum)
+        Pinger.HEADER.pack_into(self.packet, 0, ICMP_ECHO_REQUEST, 0,
+                                my_checksum, self.packet_id, sequence)
+
+    def _handle_read(self):
+        while True:
+            try:
+                size = self.socket.recv_into(self.recv_buffer)
+            except (BlockingIOError, InterruptedError):
+                return
+            except OSError:
+                # e.g. ECONNREFUSED queued by an ICMP error; nothing to match
+                continue
+            time_received = time.monotonic()
+
+            # Skip the IP header, its length is in the low nibble of byte 0.
+            offset = (self.recv_buffer[0] & 0x0f) * 4
+            if size < offset + Pinger.HEADER.size:
+                continue
+            type, code, checksum, p_id, sequence = Pinger.HEADER.unpack_from(
+                self.recv_view, offset)
+            if type != ICMP_ECHO_REPLY or p_id != self.packet_id:
+                continue
+            received = self.pending.get(sequence)
+            if received is not None and not received.done():
+                received.set_result(time_received)
+
+
+def _ones_complement_sum(data):
+    """Sums "data" as big-endian 16-bit words, the way the internet
+    checksum does."""
+    if len(data) % 2:
+        data = bytes(data) + b'\0'
+    words = struct.unpack('!%dH' % (len(data) // 2), data)
+    return sum(words)
+
+
+def _fold_checksum(sum):
+    sum = (sum >> 16) + (sum & 0xffff)
+    sum = sum + (sum >> 16)
+    return ~sum & 0xffff
+
+
 class PingQuery(asyncore.dispatcher):
     def __init__(self, host, p_id, timeout=0.5, ignore_errors=False):
         """
@@ -0,0 +1,51 @@
+import asyncio
+import contextlib
+import io
+import os
+import sys
+import threading
+
+import pytest
+
+# test the source tree, installed or not
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+from wrtmtester.N2xBenchmark import _freePort
+from wrtmtester.WrtmN2xWrapper import WrtmN2xWrapper
+
+
+@contextlib.contextmanager
+def _n2xSession(emulator, establish=True):
+    # a WrtmN2xWrapper connected to the emulator, with the lines written to it
+    wrapper = WrtmN2xWrapper()
+    wrapper.n2x.proxyPort = _freePort()
+    thread = threading.Thread(target=asyncio.run,
+                              args=(emulator.connect('127.0.0.1', wrapper.n2x.proxyPort),),
+                              daemon=True)
+    thread.start()
+
+    writes = []
+    write = wrapper.n2x._writeWrapper
+    def recorded(socket, data):
+        writes.append(data.split("\r\n"))
+        write(socket, data)
+    wrapper.n2x._writeWrapper = recorded
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        wrapper.n2x.reverseProxy()
+        try:
+            if establish:
+                wrapper.establishSession()
+            yield wrapper, writes
+        finally:
+            if wrapper.inited:
+                wrapper.shutdownN2X()
+            else:
+                wrapper.n2x.closeSession()
+                wrapper.n2x.disconnectFromProxy()
+            thread.join(5)
+
+
+@pytest.fixture
+def n2xSession():
+    return _n2xSession
@@ -0,0 +1,67 @@
+import asyncio
+import threading
+
+from wrtmtester.CampaignJournal import CampaignJournal
+
+
+def _journal(tmp_path):
+    plan = tmp_path / "plan.ini"
+    plan.write_text("[main]\n")
+    return CampaignJournal(str(plan), str(tmp_path))
+
+
+def testResumeSkipsPastSkippedTests(tmp_path):
+    async def run(journal):
+        await journal.started('plan', 1)
+        await journal.completedTest('plan', 1)
+        await journal.skippedTest('plan', 2)
+        await journal.skippedTest('plan', 3)
+        await journal.started('plan', 4)
+
+    journal = _journal(tmp_path)
+    journal.open()
+    asyncio.run(run(journal))
+    journal.close()
+
+    journal = _journal(tmp_path)
+    journal.open(resume=True)
+    journal.close()
+    # test 4 was interrupted
+    assert journal.resumePoint('plan') == 4
+
+
+def testFreshCampaignForgetsProgress(tmp_path):
+    journal = _journal(tmp_path)
+    journal.open()
+    asyncio.run(journal.skippedTest('plan', 1))
+    journal.close()
+
+    _journal(tmp_path).open()
+    journal = _journal(tmp_path)
+    journal.open(resume=True)
+    journal.close()
+    assert journal.resumePoint('plan') == 1
+
+
+def testRecordsAreWrittenOffTheEventLoop(tmp_path, monkeypatch):
+    journal = _journal(tmp_path)
+    journal.open()
+    threads = []
+    append = journal._append
+
+    def recordingAppend(record, sync=True):
+        threads.append(threading.get_ident())
+        append(record, sync)
+
+    monkeypatch.setattr(journal, '_append', recordingAppend)
+
+    async def run():
+        await journal.started('plan', 1)
+        await journal.completedTest('plan', 1)
+        return threading.get_ident()
+
+    loopThread = asyncio.run(run())
+    journal.close()
+    assert len(threads) == 2 and loopThread not in threads
+    with open(journal.path) as journalFile:
+        assert [record.count('"completed"') for record in journalFile] == [0, 0, 1]
@@ -0,0 +1,248 @@
+import asyncio
+import socket
+
+import pytest
+
+from wrtmtester.ControlChannel import ACK, ACK_OK, ACK_PENDING, ACK_SEQUENCE
+from wrtmtester.ControlChannel import ControlChannel, RtoEstimator
+from wrtmtester.PlanCompiler import TEST_PACKET, PlanCompiler
+from wrtmtester.RouterEmulator import RouterEmulator
+
+
+ROUTER_IP = '127.0.0.2'
+
+
+def _freePorts():
+    probe = socket.socket(type=socket.SOCK_DGRAM)
+    probe.bind(('127.0.0.1', 0))
+    init = socket.socket(type=socket.SOCK_DGRAM)
+    init.bind(('127.0.0.1', 0))
+    ports = probe.getsockname()[1], init.getsockname()[1]
+    probe.close()
+    init.close()
+    return ports
+
+
+def _packet(testId, stop=False, testIter=1):
+    return PlanCompiler.packTest([testIter, testId, 'br-lan', 1, 0, 1], stop=stop)
+
+
+class _ScriptedRouter(asyncio.DatagramProtocol):
+    # answers the n-th definition with the acks respond(n, fields) returns, each one
+    # either a datagram or a (delay, datagram) pair
+    def __init__(self, respond):
+        self.respond = respond
+        self.transport = None
+        self.received = []
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def datagram_received(self, data, addr):
+        self.received.append(data)
+        for ack in self.respond(len(self.received), TEST_PACKET.unpack(data)):
+            delay, ack = ack if isinstance(ack, tuple) else (0, ack)
+            asyncio.get_event_loop().call_later(delay, self.transport.sendto, ack, addr)
+
+
+async def _open(routerFactory, **link):
+    testPort, initPort = _freePorts()
+    channel = ControlChannel(testPort, initPort, '127.0.0.1')
+    await channel.open()
+    transport, router = await asyncio.get_event_loop().create_datagram_endpoint(
+        routerFactory(initPort), local_addr=(ROUTER_IP, testPort))
+    return channel, channel.register(ROUTER_IP, **link), transport, router
+
+
+def testRequestsSurviveLoss():
+    async def run():
+        channel, link, transport, router = await _open(
+            lambda initPort: lambda: RouterEmulator('127.0.0.1', initPort, loss=0.2, seed=7))
+        try:
+            acks = [await link.request(_packet(5, testIter=i), 10) for i in range(1, 31)]
+        finally:
+            transport.close()
+            channel.close()
+        return acks, link, router
+
+    acks, link, router = asyncio.run(run())
+    assert all(ack is not None and ACK.unpack_from(ack) == (5, ACK_OK) for ack in acks)
+    assert link.retransmissions > 0
+    # retransmitted definitions are acked again but acted upon once
+    assert router.handled == 30
+    assert link.rto.srtt is not None and link.rto.rto < RtoEstimator.INITIAL_RTO
+
+
+def testEchoedSequencesMatchConcurrentRequests():
+    async def run():
+        channel, link, transport, router = await _open(
+            lambda initPort: lambda: RouterEmulator('127.0.0.1', initPort, loss=0.2,
+                                                    echoSequence=True, seed=3),
+            window=4, echoSequence=True)
+        try:
+            return await asyncio.gather(*[link.request(_packet(testId), 10)
+                                          for testId in range(1, 13)])
+        finally:
+            transport.close()
+            channel.close()
+
+    acks = asyncio.run(run())
+    assert [ACK.unpack_from(ack)[0] for ack in acks] == list(range(1, 13))
+
+
+def testPaddedAckWithoutEchoIsAccepted():
+    # a router that does not echo sequence numbers may still pad its acks
+    def respond(count, fields):
+        return [ACK.pack(fields[2], ACK_OK) + b'\xff' * 8]
+
+    async def run():
+        channel, link, transport, router = await _open(
+            lambda initPort: lambda: _ScriptedRouter(respond))
+        try:
+            return await link.request(_packet(6), 2), router
+        finally:
+            transport.close()
+            channel.close()
+
+    ack, router = asyncio.run(run())
+    assert ack is not None and ACK.unpack_from(ack) == (6, ACK_OK)
+    assert len(router.received) == 1
+
+
+def testDefinitionsGoOutUnchangedWithoutEcho():
+    def respond(count, fields):
+        return [ACK.pack(fields[2], ACK_OK)]
+
+    async def run():
+        channel, link, transport, router = await _open(
+            lambda initPort: lambda: _ScriptedRouter(respond))
+        try:
+            for stop in (False, True):
+                await link.request(_packet(6, stop, testIter=42), 2)
+            return router
+        finally:
+            transport.close()
+            channel.close()
+
+    router = asyncio.run(run())
+    # the first header word keeps the test iteration, stop packets included
+    assert router.received == [_packet(6, False, testIter=42), _packet(6, True, testIter=42)]
+
+
+def testEchoLinkCarriesTheSequenceNumber():
+    def respond(count, fields):
+        return [ACK.pack(fields[2], ACK_OK) + ACK_SEQUENCE.pack(fields[0])]
+
+    async def run():
+        channel, link, transport, router = await _open(
+            lambda initPort: lambda: _ScriptedRouter(respond), echoSequence=True)
+        try:
+            for stop in (False, True):
+                await link.request(_packet(6, stop, testIter=42), 2)
+            return router
+        finally:
+            transport.close()
+            channel.close()
+
+    router = asyncio.run(run())
+    assert [TEST_PACKET.unpack(data)[0] for data in router.received] == [1, 2]
+
+
+def testPendingAckStopsRetransmissions():
+    # pending right away, the final ack well after the initial timeout
+    def respond(count, fields):
+        return [ACK.pack(fields[2], ACK_PENDING),
+                (RtoEstimator.INITIAL_RTO * 1.5, ACK.pack(fields[2], ACK_OK))]
+
+    async def run():
+        channel, link, transport, router = await _open(
+            lambda initPort: lambda: _ScriptedRouter(respond))
+        try:
+            return await link.request(_packet(7), 5), link, router
+        finally:
+            transport.close()
+            channel.close()
+
+    ack, link, router = asyncio.run(run())
+    assert ACK.unpack_from(ack) == (7, ACK_OK)
+    assert link.retransmissions == 0
+    assert len(router.received) == 1
+
+
+def testRetransmittedRequestsAreNotSampled():
+    # Karn's algorithm: the ack of a retransmitted request is ambiguous
+    def respond(count, fields):
+        return [] if count == 1 else [ACK.pack(fields[2], ACK_OK)]
+
+    async def run():
+        channel, link, transport, router = await _open(
+            lambda initPort: lambda: _ScriptedRouter(respond))
+        try:
+            return await link.request(_packet(8), 5), link
+        finally:
+            transport.close()
+            channel.close()
+
+    ack, link = asyncio.run(run())
+    assert ack is not None
+    assert link.retransmissions == 1
+    assert link.rto.srtt is None and link.rto.rto == RtoEstimator.INITIAL_RTO
+
+
+def testUnansweredRequestTimesOut():
+    async def run():
+        channel, link, transport, router = await _open(
+            lambda initPort: lambda: _ScriptedRouter(lambda count, fields: []))
+        try:
+            return await link.request(_packet(9), 2.5), link
+        finally:
+            transport.close()
+            channel.close()
+
+    ack, link = asyncio.run(run())
+    assert ack is None
+    # 1 s, then doubled up to the cap: sent at 0, 1 and 3 s
+    assert link.retransmissions == 1
+    assert len(link.pending) == 0
+
+
+def testRtoEstimator():
+    rto = RtoEstimator()
+    rto.sample(0.1)
+    assert rto.srtt == pytest.approx(0.1)
+    assert rto.rttvar == pytest.approx(0.05)
+    assert rto.rto == pytest.approx(0.3)
+
+    for _ in range(50):
+        rto.sample(0.001)
+    assert rto.rto == RtoEstimator.MIN_RTO
+    assert rto.minRtt == 0.001
+
+    rto.sample(10)
+    assert rto.rto == RtoEstimator.MAX_RTO
+
+
+def testWindowNeedsEchoedSequences():
+    channel = ControlChannel(0, 0)
+    with pytest.raises(ValueError):
+        channel.register(ROUTER_IP, window=2)
+    assert channel.register(ROUTER_IP, window=2, echoSequence=True).echoSequence
+
+
+def testEchoedSequenceDropsDuplicates():
+    # every definition acked twice; the second ack must not complete the next request
+    def respond(count, fields):
+        ack = ACK.pack(fields[2], ACK_OK) + ACK_SEQUENCE.pack(fields[0])
+        return [ack, ack]
+
+    async def run():
+        channel, link, transport, router = await _open(
+            lambda initPort: lambda: _ScriptedRouter(respond), echoSequence=True)
+        try:
+            return [await link.request(_packet(testId), 2) for testId in (1, 2, 3)]
+        finally:
+            transport.close()
+            channel.close()
+
+    acks = asyncio.run(run())
+    assert [ACK.unpack_from(ack)[0] for ack in acks] == [1, 2, 3]
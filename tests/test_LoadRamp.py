@@ -0,0 +1,33 @@
+import pytest
+
+from wrtmtester.LoadRamp import LoadRamp
+
+
+def _run(ramp, onset):
+    load = ramp.next()
+    while load is not None:
+        ramp.record(load, load >= onset)
+        load = ramp.next()
+    return ramp
+
+
+def testRampBisectsToTheTolerance():
+    ramp = _run(LoadRamp(10, 1000, 5), 400)
+    clean, onset = ramp.bracket()
+    assert clean < 400 <= onset and onset - clean <= 5
+    assert ramp.converged()
+    assert len(ramp) <= 2 + 8
+
+
+def testRampStopsAtTheFloatResolution():
+    ramp = _run(LoadRamp(1, 2, 1e-300), 1.5)
+    clean, onset = ramp.bracket()
+    assert onset == 1.5 and (clean + onset) / 2 in (clean, onset)
+    assert ramp.converged()
+    assert len(ramp) < 100
+
+
+@pytest.mark.parametrize('tolerance', [0, -1.0])
+def testRampNeedsAPositiveTolerance(tolerance):
+    with pytest.raises(RuntimeError, match="tolerance"):
+        LoadRamp(1, 1000, tolerance)
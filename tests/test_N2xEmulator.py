@@ -0,0 +1,54 @@
+import time
+
+import pytest
+
+from wrtmtester.N2xEmulator import N2xEmulator
+from wrtmtester.N2xInterface import listFromResponse
+
+
+def testInjectedFailureNamesTheCommand(n2xSession):
+    with n2xSession(N2xEmulator(failMethods=('SetPduHeaders',)), establish=False) \
+            as (wrapper, writes):
+        with pytest.raises(RuntimeError, match="SetPduHeaders"):
+            wrapper.establishSession()
+        # the rest of the pipeline was answered, the connection is still in step
+        assert wrapper.n2x.getTestState() == "STOPPED"
+
+
+def testSavedSessionIsRestored(n2xSession):
+    with n2xSession(N2xEmulator()) as (wrapper, writes):
+        n2x = wrapper.n2x
+        n2x.saveSession("wrtm.ses")
+        assert 'AgtStreamGroupList' in listFromResponse(n2x.listObjects("AGT_SAVED",
+                                                                        "wrtm.ses"))
+
+        n2x.resetSession()
+        with pytest.raises(RuntimeError, match="invalid handle"):
+            n2x.collectStats(n2x.stats[0], n2x.streamGroups[0])
+
+        n2x.restoreSession("wrtm.ses")
+        assert n2x.collectStats(n2x.stats[0], n2x.streamGroups[0]) == ['0']
+        with pytest.raises(RuntimeError, match="no saved session"):
+            n2x.listObjects("AGT_SAVED", "other.ses")
+
+
+def testErrorsStartAtTheOnsetLoad(n2xSession):
+    with n2xSession(N2xEmulator(integrityErrors=1000, onsetLoad=5)) as (wrapper, writes):
+        wrapper._startLoadStreams({'load': '1M'})
+        time.sleep(0.05)
+        assert wrapper.collectLoadStats() == [0, 0]
+        wrapper._stopLoadStreams()
+        assert wrapper.capturedFrameCounts() == {'3': 0, '4': 0}
+
+        wrapper._startLoadStreams({'load': '10M'})
+        time.sleep(0.05)
+        counters = wrapper.collectLoadStats()
+        wrapper._stopLoadStreams()
+        counts = wrapper.capturedFrameCounts()
+        assert counters[0] > 0 and counters[0] == counters[1]
+        assert counts['3'] > 0
+
+        frames = wrapper.capturedFrames('3', 0, 2)
+        assert len(frames) == 2
+        # Ethernet/IPv4 frames, in capture order
+        assert frames[0][0] < frames[1][0] and frames[0][1][12:14] == b'\x08\x00'
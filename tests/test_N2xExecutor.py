@@ -0,0 +1,47 @@
+import threading
+
+import pytest
+
+from wrtmtester.N2xExecutor import N2xExecutor
+
+
+def testControlCallsGoBeforeBackgroundCalls():
+    executor = N2xExecutor()
+    release = threading.Event()
+    order = []
+    try:
+        running = executor.background(release.wait)
+        samples = [executor.background(order.append, 'sample' + str(i)) for i in range(3)]
+        start = executor.submit(order.append, 'start')
+        stop = executor.submit(order.append, 'stop')
+        release.set()
+        for future in [running, start, stop] + samples:
+            future.result(5)
+    finally:
+        executor.shutdown()
+    # the call already running is waited for, the queued samples are not
+    assert order == ['start', 'stop', 'sample0', 'sample1', 'sample2']
+
+
+def testExceptionsReachTheCaller():
+    executor = N2xExecutor()
+    try:
+        with pytest.raises(ZeroDivisionError):
+            executor.submit(lambda: 1 / 0).result(5)
+        assert executor.background(sum, (1, 2)).result(5) == 3
+    finally:
+        executor.shutdown()
+
+
+def testShutdownRunsQueuedCalls():
+    executor = N2xExecutor()
+    release = threading.Event()
+    order = []
+    executor.submit(release.wait)
+    executor.background(order.append, 'sample')
+    executor.submit(order.append, 'stop')
+    release.set()
+    executor.shutdown()
+    assert order == ['stop', 'sample']
+    with pytest.raises(RuntimeError):
+        executor.submit(order.append, 'late')
@@ -0,0 +1,40 @@
+import time
+
+from wrtmtester.OutcomeCache import OutcomeCache
+
+
+TEST = [1, 5, 'br-lan', 1, 0, 1]
+
+
+def testRecordedOutcomesAreWrittenOnClose(tmp_path):
+    path = str(tmp_path / "outcomes.db")
+    cache = OutcomeCache(path)
+    cache.open()
+    cache.record(TEST, 'b1', False)
+    cache.record(TEST, 'b1', False)
+    cache.record(TEST, 'b1', True)
+    cache.record(TEST, 'b2', False)
+    cache.close()
+
+    cache = OutcomeCache(path)
+    cache.open()
+    try:
+        assert cache.lookup(TEST, 'b1') == (2, 1, 1)
+        assert cache.lookup(TEST, 'b2') == (1, 0, 0)
+        assert cache.shouldRun(TEST, 'b1', OutcomeCache.POLICY_FAILURES)
+        assert not cache.shouldRun(TEST, 'b2', OutcomeCache.POLICY_SKIP_STABLE)
+    finally:
+        cache.close()
+
+
+def testOutcomesAreCommittedWithinTheInterval(tmp_path):
+    cache = OutcomeCache(str(tmp_path / "outcomes.db"))
+    cache.open()
+    try:
+        cache.record(TEST, 'b1', False)
+        deadline = time.monotonic() + 5 * OutcomeCache.COMMIT_INTERVAL
+        while cache.lookup(TEST, 'b1') is None and time.monotonic() < deadline:
+            time.sleep(OutcomeCache.COMMIT_INTERVAL / 10)
+        assert cache.lookup(TEST, 'b1') == (1, 0, 0)
+    finally:
+        cache.close()
@@ -0,0 +1,73 @@
+import os
+
+import pytest
+
+from wrtmtester.PlanCompiler import CompiledPlan, PlanCompiler
+from wrtmtester.TestPlanParser import TestPlanParser
+
+
+PLAN = """[main]
+dut = 10.0.0.1
+
+[a]
+loop = 2
+plan =
+    5 br-lan 1 0:3 1
+    7 {eth0,eth1} 2 +4 0xff load=20M loadMode=fixed
+    5 br-lan 1 8 1 load=20M loadMode=fixed
+"""
+
+
+def _parser(tmp_path):
+    path = tmp_path / "plan.ini"
+    path.write_text(PLAN)
+    parser = TestPlanParser()
+    parser.load(str(path))
+    return parser
+
+
+def testCompiledPlanMatchesTheSweep(tmp_path):
+    parser = _parser(tmp_path)
+    plan = parser.getCompiledPlan('a')
+    sweep = parser.getTestSweep('a')
+    try:
+        assert isinstance(plan, CompiledPlan)
+        assert len(plan) == len(sweep) == 12
+        for i in range(len(sweep)):
+            assert plan.test(i) == sweep[i]
+            assert plan.traffic(i) == sweep.traffic(i)
+            assert bytes(plan.startPacket(i)) == PlanCompiler.packTest(sweep[i])
+            assert bytes(plan.stopPacket(i)) == PlanCompiler.packTest(sweep[i], stop=True)
+        # equal overrides are stored once
+        assert len(plan.traffics) == 2
+    finally:
+        plan.close()
+
+
+def testCachedPlanIsNotParsed(tmp_path, monkeypatch):
+    _parser(tmp_path).getCompiledPlan('a').close()
+
+    parser = _parser(tmp_path)
+    monkeypatch.setattr(parser, 'getTestSweep', lambda name: pytest.fail("parsed"))
+    plan = parser.getCompiledPlan('a')
+    try:
+        assert len(plan) == 12
+        assert plan.traffic(5) == {'load': '20M', 'loadMode': 'fixed'}
+    finally:
+        plan.close()
+
+
+def testTornCacheIsCompiledAgain(tmp_path):
+    parser = _parser(tmp_path)
+    path = PlanCompiler(parser).cachePath('a')
+    parser.getCompiledPlan('a').close()
+    size = os.path.getsize(path)
+    with open(path, "r+b") as planFile:
+        planFile.truncate(size // 2)
+
+    plan = _parser(tmp_path).getCompiledPlan('a')
+    try:
+        assert len(plan) == 12
+        assert os.path.getsize(path) == size
+    finally:
+        plan.close()
@@ -0,0 +1,31 @@
+import csv
+import sqlite3
+
+from wrtmtester.ResultStore import ResultStore
+
+
+def testMigratedDatabaseExportsUnderTheRightHeadings(tmp_path):
+    path = str(tmp_path / "results.db")
+    # an older database, with its columns in another order and most of them missing
+    connection = sqlite3.connect(path)
+    connection.execute("CREATE TABLE results (id INTEGER PRIMARY KEY, message TEXT, "
+                       + "router TEXT, error_code INTEGER)")
+    connection.execute("INSERT INTO results (message, router, error_code) "
+                       + "VALUES ('old', '10.0.0.1', 3)")
+    connection.commit()
+    connection.close()
+
+    store = ResultStore(path)
+    store.open()
+    store.record({'router': '10.0.0.2', 'error_code': 0, 'retries': 1, 'message': 'new'})
+    store.close()
+
+    csvPath = str(tmp_path / "results.csv")
+    store.exportCsv(csvPath)
+    with open(csvPath, newline='') as csvFile:
+        rows = list(csv.DictReader(csvFile))
+
+    assert [(row['router'], row['error_code'], row['message']) for row in rows] == \
+        [('10.0.0.1', '3', 'old'), ('10.0.0.2', '0', 'new')]
+    assert rows[1]['retries'] == '1'
+    assert [row['message'] for row in store.rows()] == ['old', 'new']
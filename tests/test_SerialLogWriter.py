@@ -0,0 +1,68 @@
+import threading
+import time
+
+from wrtmtester.SerialLogIndex import SerialLogIndex
+from wrtmtester.SerialLogWriter import SerialLogWriter
+
+
+class _StalledFile(object):
+    # a segment file whose writes hang until released, like a disk that fell behind
+    def __init__(self, segmentFile):
+        self.segmentFile = segmentFile
+        self.release = threading.Event()
+
+    def write(self, data):
+        self.release.wait()
+        return self.segmentFile.write(data)
+
+    def flush(self):
+        self.segmentFile.flush()
+
+    def close(self):
+        self.segmentFile.close()
+
+
+def _marker(testIter, phase):
+    return bytes("\n[WRTM test #" + str(testIter) + " " + phase + "]\n", 'utf-8')
+
+
+def testTestsAreExtractedAcrossRotatedSegments(tmp_path):
+    path = str(tmp_path / "serial.log")
+    writer = SerialLogWriter(path, rotateTests=1)
+    writer.open(b"header\n")
+    for testIter in (1, 2):
+        writer.mark(testIter, 'send', time.monotonic(), _marker(testIter, 'send'))
+        writer.write(b"output of " + bytes(str(testIter), 'utf-8'))
+    writer.close()
+
+    index = SerialLogIndex(path)
+    try:
+        assert [record[2] for record in index.records()] == [0, 1]
+        assert index.extract(1) == _marker(1, 'send') + b"output of 1"
+        assert index.extract(2) == _marker(2, 'send') + b"output of 2"
+    finally:
+        index.close()
+
+
+def testStalledDiskNeverBlocksTheReader(tmp_path, monkeypatch):
+    monkeypatch.setattr(SerialLogWriter, 'MAX_PENDING', 1000)
+    path = str(tmp_path / "serial.log")
+    writer = SerialLogWriter(path)
+    writer.open(b"")
+    stalled = writer.segmentFile = _StalledFile(writer.segmentFile)
+    try:
+        started = time.monotonic()
+        for _ in range(0, 100):
+            writer.write(b"x" * 100)
+        writer.mark(1, 'run', time.monotonic(), _marker(1, 'run'))
+        assert time.monotonic() - started < 1.0
+        assert writer.pendingBytes < SerialLogWriter.MAX_PENDING + 200
+    finally:
+        stalled.release.set()
+        writer.close()
+
+    with open(path, "rb") as logFile:
+        log = logFile.read()
+    assert log == b"x" * 1000 \
+        + b"\n[WRTM 9000 console bytes dropped, the log writer fell behind]\n" \
+        + _marker(1, 'run')
@@ -0,0 +1,173 @@
+import asyncio
+
+import pytest
+
+from wrtmtester.UpsClient import UpsClient, UpsError
+from wrtmtester.UpsEmulator import UpsEmulator
+
+
+async def _serve(handler):
+    server = await asyncio.start_server(handler, '127.0.0.1', 0)
+    return server, server.sockets[0].getsockname()[1]
+
+
+async def _emulated(**options):
+    emulator = UpsEmulator('everwrt', username='admin', password='secret', switchDelay=0.05,
+                           **options)
+    await emulator.start('127.0.0.1', 0)
+    return emulator, emulator.server.sockets[0].getsockname()[1]
+
+
+def _client(port, **options):
+    return UpsClient('everwrt', '127.0.0.1', port, 'admin', 'secret', pollInterval=0.01,
+                     holdTime=0.05, offTime=0.05, **options)
+
+
+async def _hangUp(reader, writer):
+    # an upsd that drops the connection at the first line
+    await reader.readline()
+    writer.close()
+
+
+def testPowerCycleSwitchesTheOutletOffAndOn():
+    async def run():
+        switches = []
+        emulator, port = await _emulated(outlets=2, onSwitch=lambda outlet, on:
+                                         switches.append((outlet, on)))
+        ups = _client(port)
+        try:
+            await ups.powerCycle(2)
+        finally:
+            await ups.close()
+            emulator.close()
+        return emulator, switches
+
+    emulator, switches = asyncio.run(run())
+    assert emulator.commands == ['outlet.2.load.off', 'outlet.2.load.on']
+    assert switches == [(2, False), (2, True)]
+    assert emulator.outlets == {1: True, 2: True}
+
+
+def testConcurrentPowerCyclesShareThePool():
+    async def run():
+        emulator, port = await _emulated(outlets=3)
+        ups = _client(port, poolSize=2)
+        try:
+            await asyncio.gather(*[ups.powerCycle(outlet) for outlet in (1, 2, 3)])
+            pooled = len(ups.idle)
+        finally:
+            await ups.close()
+            emulator.close()
+        return emulator, pooled
+
+    emulator, pooled = asyncio.run(run())
+    assert sorted(emulator.commands) == sorted('outlet.' + str(outlet) + '.load.' + state
+                                               for outlet in (1, 2, 3)
+                                               for state in ('off', 'on'))
+    # connections are reused, never more than the pool
+    assert 1 <= pooled <= 2
+
+
+def testWholeUpsIsCycledWithoutAnOutlet():
+    async def run():
+        emulator, port = await _emulated()
+        ups = _client(port)
+        try:
+            await ups.powerCycle()
+            output = emulator.output
+        finally:
+            await ups.close()
+            emulator.close()
+        return emulator, output
+
+    emulator, output = asyncio.run(run())
+    assert emulator.commands == ['load.off', 'load.on']
+    assert output
+
+
+def testUnknownOutletIsUpsError():
+    async def run():
+        emulator, port = await _emulated(outlets=1)
+        ups = _client(port)
+        try:
+            with pytest.raises(UpsError, match="refused"):
+                await ups.powerCycle(5)
+        finally:
+            await ups.close()
+            emulator.close()
+
+    asyncio.run(run())
+
+
+def testOutletNotSwitchingIsUpsError(monkeypatch):
+    monkeypatch.setattr(UpsClient, 'SWITCH_TIMEOUT', 0.1)
+
+    async def run():
+        emulator, port = await _emulated()
+        emulator.switchDelay = 10
+        ups = _client(port)
+        try:
+            with pytest.raises(UpsError, match="did not switch off"):
+                await ups.powerCycle(1)
+        finally:
+            await ups.close()
+            emulator.close()
+
+    asyncio.run(run())
+
+
+def testRejectedPasswordIsUpsError():
+    async def run():
+        emulator = UpsEmulator('everwrt', username='admin', password='secret')
+        await emulator.start('127.0.0.1', 0)
+        port = emulator.server.sockets[0].getsockname()[1]
+        ups = UpsClient('everwrt', '127.0.0.1', port, 'admin', 'wrong')
+        try:
+            with pytest.raises(UpsError, match="password"):
+                await ups.instcmd('load.off')
+        finally:
+            await ups.close()
+            emulator.close()
+
+    asyncio.run(run())
+
+
+def testDroppedLoginIsUpsError():
+    async def run():
+        server, port = await _serve(_hangUp)
+        ups = UpsClient('everwrt', '127.0.0.1', port, 'admin', 'secret')
+        try:
+            with pytest.raises(UpsError, match="username"):
+                await ups.getVar('ups.status')
+        finally:
+            await ups.close()
+            server.close()
+
+    asyncio.run(run())
+
+
+def testDroppedCommandIsUpsError():
+    async def run():
+        server, port = await _serve(_hangUp)
+        ups = UpsClient('everwrt', '127.0.0.1', port)
+        try:
+            # dropped once, reconnected and dropped again
+            with pytest.raises(UpsError, match="Lost the connection"):
+                await ups.instcmd('load.off')
+        finally:
+            await ups.close()
+            server.close()
+
+    asyncio.run(run())
+
+
+def testUnreachableUpsdIsUpsError():
+    async def run():
+        server, port = await _serve(_hangUp)
+        server.close()
+        await server.wait_closed()
+        ups = UpsClient('everwrt', '127.0.0.1', port)
+        with pytest.raises(UpsError, match="Unable to connect"):
+            await ups.instcmd('load.off')
+
+    asyncio.run(run())
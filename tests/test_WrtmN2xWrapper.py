@@ -0,0 +1,107 @@
+import asyncio
+
+from wrtmtester.CaptureExporter import CaptureExporter
+from wrtmtester.N2xEmulator import N2xEmulator
+from wrtmtester.N2xExecutor import N2xExecutor
+from wrtmtester.WrtmN2xWrapper import parseLoad, parseRate
+
+
+# the commands of the original one-by-one setup after adding the ports, in its order
+# (address listings aside)
+BASELINE = ['SetSessionLabel'] \
+    + ['ModifySutIpAddress', 'SetTesterIpAddresses'] * 4 \
+    + ['AddProfile'] * 2 \
+    + ['SetMode', 'SetAverageLoad', 'AddStreamGroupsWithExistingProfile'] * 2 \
+    + ['SetExpectedDestinationPorts'] * 2 + ['SetPduHeaders'] * 2 \
+    + ['SetFieldFixedValue ipv4 source_address'] * 2 \
+    + ['SetFieldFixedValue ipv4 destination_address'] * 2 \
+    + ['SetFieldFixedValue tcp source_port'] * 2 \
+    + ['SetFieldFixedValue tcp destination_port'] * 2 \
+    + ['SetPayloadFill'] * 2 + ['SetPortGroup'] \
+    + ['ClearAllFilters', 'AddFrameMatcher', 'AddFrameMatcher'] * 2 \
+    + ['AddFrameFlags'] * 4 + ['AddFrameMatcherFilters'] * 4 + ['SetCaptureMode'] \
+    + ['Add'] * 2 + ['SelectStatistics'] * 2 + ['SelectStreamGroups'] * 2 \
+    + ['SetErroredFrameFilter'] * 2
+
+
+def _command(line):
+    words = line.replace('"', '').split()
+    if words[0] != 'invoke':
+        return None
+    if words[1] == 'sm':
+        words = words[1:]
+    method = words[2]
+    if method in ('ListSutIpAddresses', 'ListAddressPools'):
+        return None
+    if method == 'SetFieldFixedValue':
+        return method + " " + words[4] + " " + words[6]
+    return method
+
+
+def testSessionIsBuiltInTheBaselineOrder(n2xSession):
+    with n2xSession(N2xEmulator()) as (wrapper, writes):
+        commands = [_command(line) for lines in writes for line in lines]
+        commands = [x for x in commands if x is not None]
+        # the built session is saved for the next start
+        assert commands[commands.index('SetSessionLabel'):] == BASELINE + ['SaveSession']
+        # one round trip per stage
+        assert sum(1 for lines in writes if len(lines) > 1) == 6
+        assert len(wrapper.n2x.streamGroups) == 2 and len(wrapper.n2x.PDUs) == 2
+        assert len(wrapper.n2x.frameMatchers) == 4 and len(wrapper.n2x.stats) == 2
+
+
+def testSavedSessionIsRestoredWithItsHandles(n2xSession):
+    emulator = N2xEmulator()
+    with n2xSession(emulator) as (wrapper, writes):
+        built = (list(wrapper.n2x.ports), list(wrapper.n2x.profiles),
+                 list(wrapper.n2x.streamGroups), list(wrapper.n2x.PDUs),
+                 list(wrapper.n2x.frameMatchers), list(wrapper.n2x.stats))
+
+    with n2xSession(emulator) as (wrapper, writes):
+        commands = [_command(line) for lines in writes for line in lines]
+        assert 'RestoreSession' in commands and 'AddProfile' not in commands
+        assert (wrapper.n2x.ports, wrapper.n2x.profiles, wrapper.n2x.streamGroups,
+                wrapper.n2x.PDUs, wrapper.n2x.frameMatchers, wrapper.n2x.stats) == built
+        wrapper._startLoadStreams()
+        assert wrapper.collectLoadStats() == [0, 0]
+
+
+def testRejectedListingRebuildsTheSession(n2xSession):
+    emulator = N2xEmulator()
+    with n2xSession(emulator):
+        pass
+
+    emulator.failMethods.add('ListPdus')
+    with n2xSession(emulator) as (wrapper, writes):
+        commands = [_command(line) for lines in writes for line in lines]
+        assert commands.index('ResetSession') < commands.index('AddProfile')
+        assert wrapper.inited and len(wrapper.n2x.PDUs) == 2
+
+
+def testRejectedCaptureCountLeavesTheStopAlone(n2xSession, tmp_path):
+    with n2xSession(N2xEmulator(failMethods=('GetCapturedFrameCount',))) \
+            as (wrapper, writes):
+        executor = N2xExecutor()
+        capture = CaptureExporter(wrapper, executor, str(tmp_path))
+        try:
+            wrapper._startLoadStreams()
+            wrapper._stopLoadStreams()
+            assert not wrapper.running and wrapper.n2x.getTestState() == "STOPPED"
+            assert asyncio.run(capture.count()) is None and not capture.enabled
+            # turned off, the N2X is not asked again
+            sent = len(writes)
+            assert asyncio.run(capture.count()) is None and len(writes) == sent
+        finally:
+            executor.shutdown()
+
+
+def testBisectedLoadIsAppliedExactly():
+    # a ramp between 1 and 1000 Mbit/s bisected towards the maximum, '%g' makes 999.023
+    load = 1.0
+    for _ in range(10):
+        load = (load + 1000) / 2
+    applied = parseLoad(repr(load))
+    assert float(applied.split()[0]) == load
+    assert parseRate(repr(load)) == load
+    assert parseLoad("20M") == "20.0 AGT_UNITS_MBITS_PER_SEC"
+    assert parseLoad("2 AGT_UNITS_GBITS_PER_SEC") == "2 AGT_UNITS_GBITS_PER_SEC"